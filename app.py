@@ -16,6 +16,7 @@ import argparse
 import ast
 import gradio as gr
 from os.path import isdir
+from data_measurements import scheduler
 from data_measurements.dataset_statistics import DatasetStatisticsCacheClass as dmt_cls
 import utils
 from utils import dataset_utils
@@ -34,12 +35,15 @@ def get_load_prepare_list(dstats):
     """
     # Measurement calculation:
     # Add any additional modules and their load-prepare function here.
-    load_prepare_list = [("general stats", dstats.load_or_prepare_general_stats),
-                         ("label distribution", dstats.load_or_prepare_labels),
-                         ("text_lengths", dstats.load_or_prepare_text_lengths),
-                         ("duplicates", dstats.load_or_prepare_text_duplicates),
-                         ("npmi", dstats.load_or_prepare_npmi),
-                         ("zipf", dstats.load_or_prepare_zipf)]
+    # Measurements named as in the scheduler's graph are run with the
+    # prerequisites declared there; others are run independently.
+    load_prepare_list = [(scheduler.GENERAL, dstats.load_or_prepare_general_stats),
+                         (scheduler.LABELS, dstats.load_or_prepare_labels),
+                         (scheduler.LENGTHS, dstats.load_or_prepare_text_lengths),
+                         (scheduler.DUPLICATES, dstats.load_or_prepare_text_duplicates),
+                         (scheduler.NPMI, dstats.load_or_prepare_npmi),
+                         (scheduler.COLLOCATIONS, dstats.load_or_prepare_collocations),
+                         (scheduler.ZIPF, dstats.load_or_prepare_zipf)]
 
     return load_prepare_list
 
@@ -52,6 +56,7 @@ def get_ui_widgets():
             widgets.TextLengths(),
             widgets.Duplicates(),
             widgets.Npmi(),
+            widgets.Collocations(),
             widgets.Zipf()]
 
 
@@ -81,7 +86,7 @@ def display_initial_UI():
     return dataset_args
 
 
-def load_or_prepare_widgets(dstats, load_prepare_list, show_perplexities, live=True, pull_cache_from_hub=False):
+def load_or_prepare_widgets(dstats, load_prepare_list, show_perplexities, live=True, pull_cache_from_hub=False, num_workers=1):
     """
      Takes the dataset arguments from the GUI and uses them to load a dataset from the Hub or, if
      a cache for those arguments is available, to load it from the cache.
@@ -93,6 +98,7 @@ def load_or_prepare_widgets(dstats, load_prepare_list, show_perplexities, live=T
          show_perplexities (Bool): whether perplexities should be loaded and displayed for this dataset
          live (Bool): Whether the system is deployed for live use by users.
          pull_cache_from_hub (Bool): Whether the cache should be pulled from the hub (vs locally)
+         num_workers (int): Number of widgets to load or prepare at the same time
      Returns:
          dstats: the computed dataset statistics (from the dataset_statistics class)
      """
@@ -111,33 +117,30 @@ def load_or_prepare_widgets(dstats, load_prepare_list, show_perplexities, live=T
     if pull_cache_from_hub:
         dataset_utils.pull_cache_from_hub(dstats.cache_path, dstats.dataset_cache_dir)
 
-    # Data common across DMT:
-    # Includes the dataset text/requested feature column,
-    # the dataset tokenized, and the vocabulary
-    dstats.load_or_prepare_text_dataset(load_only=load_only)
     # Just a snippet of the dataset
     dstats.load_or_prepare_dset_peek(load_only=load_only)
-    # Tokenized dataset
-    dstats.load_or_prepare_tokenized_df(load_only=load_only)
-    # Vocabulary (uses tokenized dataset)
-    dstats.load_or_prepare_vocab(load_only=load_only)
+    # Data common across DMT:
+    # The dataset text/requested feature column, the dataset tokenized, and
+    # the vocabulary are prepared by the scheduler, as the widgets need them.
+    # When live, the widgets only read their cached results, so neither the
+    # dataset text nor its tokenization is loaded; just the cached vocabulary.
+    if live:
+        dstats.load_or_prepare_vocab(load_only=load_only)
     # Custom widgets
-    for widget_tuple in load_prepare_list:
-        widget_name = widget_tuple[0]
-        widget_fn = widget_tuple[1]
-        try:
-            widget_fn(load_only=load_only)
-        except Exception as e:
-            logs.warning("Issue with %s." % widget_name)
-            logs.exception(e)
+    # Independent widgets are loaded or prepared concurrently; an issue with
+    # one of them is logged without stopping the others.
+    dmt_scheduler = scheduler.get_dmt_scheduler(dstats,
+                                                num_workers=num_workers)
+    widget_names = []
+    for widget_name, widget_fn in load_prepare_list:
+        if widget_name not in dmt_scheduler:
+            dmt_scheduler.add(widget_name, widget_fn)
+        widget_names += [widget_name]
     # TODO: If these are cached, can't we just show them by default?
     # It won't take up computation time.
     if show_perplexities:
-        try:
-            dstats.load_or_prepare_text_perplexities(load_only=load_only)
-        except Exception as e:
-            logs.warning("Issue with %s." % "perplexities")
-            logs.exception(e)
+        widget_names += [scheduler.PERPLEXITIES]
+    dmt_scheduler.run(widget_names, load_only=load_only)
     return dstats
 
 
@@ -168,7 +171,7 @@ def show_column(dstats, display_list, show_perplexities, column_id=""):
     logs.info("Have finished displaying the widgets.")
 
 
-def create_demo(live: bool, pull_cache_from_hub: bool):
+def create_demo(live: bool, pull_cache_from_hub: bool, num_workers: int = 1):
     with gr.Blocks() as demo:
         state = gr.State()
         with gr.Row():
@@ -191,7 +194,8 @@ def create_demo(live: bool, pull_cache_from_hub: bool):
                                  label_field=label_field, label_names=label_names, use_cache=True)
                 load_prepare_list = get_load_prepare_list_fn(dstats)
                 dstats = load_or_prepare_widgets(dstats, load_prepare_list, show_perplexities=False,
-                                                 live=live, pull_cache_from_hub=pull_cache_from_hub)
+                                                 live=live, pull_cache_from_hub=pull_cache_from_hub,
+                                                 num_workers=num_workers)
                 output = {title: get_title(dstats), state: dstats}
                 for widget in widget_list:
                     output.update(widget.update(dstats))
@@ -252,12 +256,14 @@ def main():
         "--live", default=False, required=False, action="store_true", help="Flag to specify that this is not running live.")
     parser.add_argument(
         "--pull_cache_from_hub", default=False, required=False, action="store_true", help="Flag to specify whether to look in the hub for measurements caches. If you are using this option, you must have HUB_CACHE_ORGANIZATION=<the organization you've set up on the hub to store your cache> and HF_TOKEN=<your hf token> on separate lines in a file named .env at the root of this repo.")
+    parser.add_argument(
+        "--num_workers", default=1, type=int, required=False, help="Number of widgets to load or prepare at the same time.")
     arguments = parser.parse_args()
     live = arguments.live
     pull_cache_from_hub = arguments.pull_cache_from_hub
 
     # Create and initialize the demo
-    demo = create_demo(live, pull_cache_from_hub)
+    demo = create_demo(live, pull_cache_from_hub, arguments.num_workers)
 
     demo.launch()
 
@@ -0,0 +1,152 @@
+# Copyright 2021 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+import utils
+import utils.dataset_utils as ds_utils
+from data_measurements.npmi.npmi import (calc_sentence_npmi,
+                                         make_sentence_matrix)
+from os.path import join as pjoin
+from utils.dataset_utils import CNT, TOKENIZED_FIELD
+
+logs = utils.prepare_logging(__file__)
+
+# Columns of the results: The two words of a pair (in vocabulary order),
+# the number of sentences they co-occur in, and their nPMI.
+WORD1 = "word 1"
+WORD2 = "word 2"
+COOC_CNT = "co-occurrences"
+NPMI = "npmi"
+# Number of word pairs kept
+TOP_N = 1000
+# Number of words whose co-occurrences are computed at a time
+BLOCK_SIZE = 2048
+# Version of the cached table of the top word pairs (COLLOCATIONS_CACHE)
+CACHE_VERSION = 1
+
+
+def find_collocations(sentence_matrix, vocabulary, min_count=1, top_n=TOP_N,
+                      block_size=BLOCK_SIZE):
+    """
+    The top_n word pairs with the highest nPMI over the sentences (see
+    calc_sentence_npmi).
+    The co-occurrence counts X^T X are computed block_size words at a time,
+    as sparse matrices, and only for the pairs whose first word comes before
+    the second; the dense vocabulary x vocabulary matrix is never made.
+    :param sentence_matrix: Binary # sentences x vocabulary size CSR matrix.
+    :param vocabulary: The words of the matrix columns.
+    :param min_count: Pairs co-occurring in fewer sentences are left out, as
+    their nPMI isn't reliable.
+    :return: DataFrame with WORD1, WORD2, COOC_CNT and NPMI columns, by
+    decreasing nPMI.
+    """
+    num_sentences = sentence_matrix.shape[0]
+    word_matrix = sentence_matrix.tocsc()
+    word_probs = np.asarray(word_matrix.sum(axis=0)).ravel() / num_sentences
+    # The best pairs so far, as (first word ids, second word ids, co-occurrence
+    # counts, nPMI scores).
+    best = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64), np.zeros(0))
+    for start in range(0, len(vocabulary), block_size):
+        end = min(start + block_size, len(vocabulary))
+        # Co-occurrences of the block's words with the words up to them.
+        block_cooc = (word_matrix[:, :end].T @
+                      word_matrix[:, start:end]).tocoo()
+        second = block_cooc.col.astype(np.int64) + start
+        keep = (block_cooc.row < second) & (block_cooc.data >= min_count)
+        first = block_cooc.row[keep].astype(np.int64)
+        second = second[keep]
+        cooc_counts = block_cooc.data[keep].astype(np.int64)
+        npmi_scores = calc_sentence_npmi(cooc_counts, word_probs[first],
+                                         word_probs[second], num_sentences)
+        best = _keep_top(best, (first, second, cooc_counts, npmi_scores),
+                         top_n)
+        logs.debug("Found the collocations of words %s to %s" % (start, end))
+    first, second, cooc_counts, npmi_scores = best
+    vocabulary = np.asarray(vocabulary, dtype=object)
+    return pd.DataFrame({WORD1: vocabulary[first], WORD2: vocabulary[second],
+                         COOC_CNT: cooc_counts, NPMI: npmi_scores})
+
+
+def _keep_top(best, candidates, top_n):
+    """
+    The top_n of the best pairs and the candidate pairs, by decreasing nPMI,
+    then co-occurrence count, then word ids (so ties are kept the same way
+    whatever the block size).
+    """
+    pairs = [np.concatenate([best_col, candidate_col]) for
+             best_col, candidate_col in zip(best, candidates)]
+    first, second, cooc_counts, npmi_scores = pairs
+    order = np.lexsort((second, first, -cooc_counts, -npmi_scores))[:top_n]
+    return tuple(col[order] for col in pairs)
+
+
+class DMTHelper:
+    """Helper class for the Data Measurements Tool.
+    This allows us to keep all variables and functions related to the
+    collocations in one file.
+    """
+
+    def __init__(self, dstats, load_only=False, save=True, top_n=TOP_N):
+        self.dstats = dstats
+        self.load_only = load_only
+        self.save = save
+        self.top_n = top_n
+        # Pairs of words co-occurring fewer times aren't counted.
+        self.min_count = dstats.min_vocab_count
+        dstats.register_cache(ds_utils.COLLOCATIONS_CACHE, CACHE_VERSION,
+                              params={"min_count": self.min_count,
+                                      "top_n": self.top_n},
+                              depends_on=[ds_utils.TOKENIZED_CACHE,
+                                          ds_utils.VOCAB_CACHE])
+        self.use_cache = dstats.use_cache_for(ds_utils.COLLOCATIONS_CACHE)
+        # DataFrame of the top word pairs (see find_collocations)
+        self.collocations_df = None
+        self.cache_path = pjoin(dstats.dataset_cache_dir, "collocations")
+        self.collocations_fid = pjoin(self.cache_path, "collocations.json")
+
+    def run_DMT_processing(self):
+        if self.use_cache and ds_utils.df_exists(self.collocations_fid):
+            self.collocations_df = ds_utils.read_df(self.collocations_fid)
+            logs.info("Loaded cached collocations.")
+        elif not self.load_only:
+            self.collocations_df = self.prepare_collocations()
+            if self.save:
+                self._write_collocations_cache()
+
+    def prepare_collocations(self):
+        # Only the words occurring at least min_count times can be in a pair
+        # that co-occurs that often.
+        vocab_counts_df = self.dstats.vocab_counts_df
+        vocabulary = list(
+            vocab_counts_df.index[vocab_counts_df[CNT] >= self.min_count])
+        logs.info("Finding the collocations of %s words." % len(vocabulary))
+        if self.dstats.corpus is not None:
+            sentence_matrix = self.dstats.corpus.to_csr(vocabulary=vocabulary,
+                                                        binary=True)
+        else:
+            sentence_matrix = make_sentence_matrix(
+                self.dstats.tokenized_df[TOKENIZED_FIELD], vocabulary)
+        return find_collocations(sentence_matrix, vocabulary,
+                                 min_count=self.min_count, top_n=self.top_n)
+
+    def _write_collocations_cache(self):
+        ds_utils.make_path(self.cache_path)
+        if self.collocations_df is not None:
+            ds_utils.write_df(self.collocations_df, self.collocations_fid)
+            self.dstats.write_cache_key(ds_utils.COLLOCATIONS_CACHE)
+
+    def get_filenames(self):
+        return {"collocations": self.collocations_fid}
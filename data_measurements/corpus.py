@@ -0,0 +1,242 @@
+# Copyright 2021 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import utils
+import utils.dataset_utils as ds_utils
+from os.path import exists
+from os.path import join as pjoin
+from scipy.sparse import coo_matrix
+
+logs = utils.prepare_logging(__file__)
+
+# Cache filenames, within the corpus cache directory.
+VOCAB_JSON = "vocab.json"
+TOKEN_IDS_NPY = "token_ids.npy"
+OFFSETS_NPY = "offsets.npy"
+# Number of array items copied at a time when building the corpus on disk.
+COPY_CHUNK_SIZE = 10 ** 7
+
+
+class Corpus:
+    """
+    Integer-encoded version of the tokenized text, shared by the measurements.
+    Built once after tokenization, it holds:
+    - vocab: The vocabulary, alphabetically ordered; a word's id is its index.
+    - token_ids: Flat int32 array of the token ids of every sentence, in order.
+    - offsets: int64 array of size # sentences + 1; the tokens of sentence i
+      are token_ids[offsets[i]:offsets[i + 1]].
+    The arrays are saved as .npy files, so they can be memory-mapped on load.
+    """
+
+    def __init__(self, vocab, token_ids, offsets, corpus_dir=None):
+        self.vocab = vocab
+        self.token_ids = token_ids
+        self.offsets = offsets
+        # Where the corpus is saved, if it is; other processes can then
+        # memory-map it rather than be sent a copy.
+        self.corpus_dir = corpus_dir
+
+    @classmethod
+    def from_tokenized(cls, tokenized_sentences):
+        """
+        Builds the corpus from tokenized sentences.
+        :param tokenized_sentences: pyarrow list<string> (Chunked)Array, as
+        from the arrow tokenizer, or a sequence/Series of token tuples.
+        """
+        if isinstance(tokenized_sentences, pd.Series):
+            tokenized_sentences = tokenized_sentences.tolist()
+        if not isinstance(tokenized_sentences, (pa.Array, pa.ChunkedArray)):
+            tokenized_sentences = pa.array(tokenized_sentences,
+                                           type=pa.list_(pa.string()))
+        if isinstance(tokenized_sentences, pa.ChunkedArray):
+            tokenized_sentences = tokenized_sentences.combine_chunks()
+        row_lengths = pc.list_value_length(tokenized_sentences).fill_null(0)
+        offsets = np.zeros(len(tokenized_sentences) + 1, dtype=np.int64)
+        np.cumsum(row_lengths.to_numpy(), out=offsets[1:])
+        # Integer-encode all the tokens at once.
+        encoded = pc.dictionary_encode(pc.list_flatten(tokenized_sentences))
+        dictionary = encoded.dictionary
+        # Reorder the ids so that they follow the alphabetical vocabulary,
+        # as with sklearn's CountVectorizer.
+        alpha_order = pc.sort_indices(dictionary).to_numpy()
+        new_ids = np.empty(len(alpha_order), dtype=np.int32)
+        new_ids[alpha_order] = np.arange(len(alpha_order), dtype=np.int32)
+        token_ids = new_ids[encoded.indices.to_numpy(zero_copy_only=False)]
+        vocab = dictionary.take(pa.array(alpha_order)).to_pylist()
+        logs.info("Built a corpus of %s sentences, %s tokens and %s words." % (
+            len(offsets) - 1, len(token_ids), len(vocab)))
+        return cls(vocab, token_ids, offsets)
+
+    @classmethod
+    def build_on_disk(cls, tokenized_batches, corpus_dir):
+        """
+        Builds the corpus from a stream of tokenized batches (as from
+        tokenize.iter_tokenized_batches), writing the token ids and offsets
+        straight to disk; only the vocabulary is kept in memory.
+        :param tokenized_batches: Iterable of pyarrow list<string> arrays or
+        lists of token tuples.
+        :return: The corpus, memory-mapped from corpus_dir.
+        """
+        ds_utils.make_path(corpus_dir)
+        raw_token_ids_fid = pjoin(corpus_dir, "raw_" + TOKEN_IDS_NPY)
+        raw_offsets_fid = pjoin(corpus_dir, "raw_" + OFFSETS_NPY)
+        # Words get ids in the order they're first seen; they're renumbered
+        # alphabetically once the whole vocabulary is known.
+        word_ids = {}
+        num_tokens = 0
+        num_sentences = 0
+        with open(raw_token_ids_fid, "wb") as token_ids_file, \
+                open(raw_offsets_fid, "wb") as offsets_file:
+            np.zeros(1, dtype=np.int64).tofile(offsets_file)
+            for tokenized_batch in tokenized_batches:
+                if not isinstance(tokenized_batch, (pa.Array, pa.ChunkedArray)):
+                    tokenized_batch = pa.array(tokenized_batch,
+                                               type=pa.list_(pa.string()))
+                row_lengths = pc.list_value_length(
+                    tokenized_batch).fill_null(0).to_numpy()
+                encoded = pc.dictionary_encode(
+                    pc.list_flatten(tokenized_batch))
+                if isinstance(encoded, pa.ChunkedArray):
+                    encoded = encoded.combine_chunks()
+                batch_ids = np.array(
+                    [word_ids.setdefault(word, len(word_ids)) for word in
+                     encoded.dictionary.to_pylist()], dtype=np.int32)
+                batch_ids[encoded.indices.to_numpy(
+                    zero_copy_only=False)].tofile(token_ids_file)
+                (num_tokens + np.cumsum(row_lengths, dtype=np.int64)).tofile(
+                    offsets_file)
+                num_tokens += int(row_lengths.sum())
+                num_sentences += len(row_lengths)
+        # Alphabetical, as in from_tokenized.
+        vocab = sorted(word_ids)
+        new_ids = np.empty(len(vocab), dtype=np.int32)
+        new_ids[[word_ids[word] for word in vocab]] = np.arange(
+            len(vocab), dtype=np.int32)
+        del word_ids
+        raw_token_ids = np.memmap(raw_token_ids_fid, dtype=np.int32, mode="r",
+                                  shape=(num_tokens,))
+        token_ids = np.lib.format.open_memmap(
+            pjoin(corpus_dir, TOKEN_IDS_NPY), mode="w+", dtype=np.int32,
+            shape=(num_tokens,))
+        for start in range(0, num_tokens, COPY_CHUNK_SIZE):
+            token_ids[start:start + COPY_CHUNK_SIZE] = new_ids[
+                raw_token_ids[start:start + COPY_CHUNK_SIZE]]
+        token_ids.flush()
+        raw_offsets = np.memmap(raw_offsets_fid, dtype=np.int64, mode="r",
+                                shape=(num_sentences + 1,))
+        offsets = np.lib.format.open_memmap(
+            pjoin(corpus_dir, OFFSETS_NPY), mode="w+", dtype=np.int64,
+            shape=(num_sentences + 1,))
+        for start in range(0, num_sentences + 1, COPY_CHUNK_SIZE):
+            offsets[start:start + COPY_CHUNK_SIZE] = raw_offsets[
+                start:start + COPY_CHUNK_SIZE]
+        offsets.flush()
+        del raw_token_ids, raw_offsets, token_ids, offsets
+        os.remove(raw_token_ids_fid)
+        os.remove(raw_offsets_fid)
+        ds_utils.write_json(vocab, pjoin(corpus_dir, VOCAB_JSON))
+        logs.info("Built a corpus of %s sentences, %s tokens and %s words on "
+                  "disk." % (num_sentences, num_tokens, len(vocab)))
+        return cls.load(corpus_dir)
+
+    @classmethod
+    def load(cls, corpus_dir, mmap_mode="r"):
+        vocab = ds_utils.read_json(pjoin(corpus_dir, VOCAB_JSON))
+        token_ids = np.load(pjoin(corpus_dir, TOKEN_IDS_NPY),
+                            mmap_mode=mmap_mode)
+        offsets = np.load(pjoin(corpus_dir, OFFSETS_NPY), mmap_mode=mmap_mode)
+        return cls(vocab, token_ids, offsets, corpus_dir=corpus_dir)
+
+    @staticmethod
+    def exists(corpus_dir):
+        return all(exists(pjoin(corpus_dir, fid)) for fid in
+                   [VOCAB_JSON, TOKEN_IDS_NPY, OFFSETS_NPY])
+
+    def save(self, corpus_dir):
+        ds_utils.make_path(corpus_dir)
+        ds_utils.write_json(self.vocab, pjoin(corpus_dir, VOCAB_JSON))
+        np.save(pjoin(corpus_dir, TOKEN_IDS_NPY), self.token_ids)
+        np.save(pjoin(corpus_dir, OFFSETS_NPY), self.offsets)
+        self.corpus_dir = corpus_dir
+
+    @property
+    def num_sentences(self):
+        return len(self.offsets) - 1
+
+    @property
+    def vocab_size(self):
+        return len(self.vocab)
+
+    def sentence_lengths(self):
+        """Number of tokens in each sentence."""
+        return np.diff(self.offsets)
+
+    def word_counts(self):
+        """Number of times each vocab word occurs, indexed by word id."""
+        # In chunks, so that a memory-mapped corpus isn't read in all at once.
+        word_counts = np.zeros(self.vocab_size, dtype=np.int64)
+        for start in range(0, len(self.token_ids), COPY_CHUNK_SIZE):
+            word_counts += np.bincount(
+                self.token_ids[start:start + COPY_CHUNK_SIZE],
+                minlength=self.vocab_size)
+        return word_counts
+
+    def sentence_ids(self, start=0, end=None):
+        """
+        The (local) sentence index of each token in sentences [start, end);
+        aligned with token_ids[offsets[start]:offsets[end]].
+        """
+        if end is None:
+            end = self.num_sentences
+        lengths = np.diff(self.offsets[start:end + 1])
+        return np.repeat(np.arange(end - start), lengths)
+
+    def get_id_map(self, vocabulary):
+        """
+        Maps the corpus word ids onto positions in another vocabulary order,
+        e.g., the vocab_counts_df index. Words missing from it are mapped to -1.
+        """
+        return pd.Index(vocabulary).get_indexer(self.vocab)
+
+    def to_csr(self, vocabulary=None, binary=False, start=0, end=None):
+        """
+        Sparse # sentences x # words matrix of word counts per sentence.
+        :param vocabulary: Word order for the columns; defaults to the corpus
+        ids. Words not in the given vocabulary are left out.
+        :param binary: Whether to only mark presence (1) instead of counting.
+        :param start, end: The range of sentences (rows) to include.
+        :return: scipy.sparse.csr_matrix
+        """
+        if end is None:
+            end = self.num_sentences
+        word_cols = np.asarray(
+            self.token_ids[self.offsets[start]:self.offsets[end]])
+        num_cols = self.vocab_size
+        if vocabulary is not None:
+            word_cols = self.get_id_map(vocabulary)[word_cols]
+            num_cols = len(vocabulary)
+        sentence_rows = self.sentence_ids(start, end)
+        in_vocab = word_cols >= 0
+        # Converting to CSR sums the duplicate (sentence, word) entries.
+        matrix = coo_matrix((np.ones(in_vocab.sum(), dtype=np.int64),
+                             (sentence_rows[in_vocab], word_cols[in_vocab])),
+                            shape=(end - start, num_cols)).tocsr()
+        if binary:
+            matrix.data[:] = 1
+        return matrix
@@ -21,26 +21,37 @@ import pandas as pd
 import plotly.graph_objects as go
 import seaborn as sns
 import statistics
+import threading
 import utils
 import utils.dataset_utils as ds_utils
-from data_measurements.tokenize import Tokenize
+from data_measurements.corpus import Corpus
+from data_measurements.fused_scan import FusedScan
+from data_measurements.postings import Postings
+from data_measurements.tokenize import (Tokenize, BATCH_SIZE, PYTHON_BACKEND,
+                                        TOKEN_PATTERN, iter_tokenized_batches)
 from data_measurements.labels import labels
+from data_measurements.label_npmi import label_npmi
 from data_measurements.perplexity import perplexity
 from data_measurements.lengths import lengths
 from data_measurements.text_duplicates import text_duplicates as td
 from data_measurements.npmi import npmi
+from data_measurements.collocations import collocations
 from data_measurements.zipf import zipf
+from collections import Counter
 from datasets import load_from_disk
+from multiprocessing import Pool
 from nltk.corpus import stopwords
 from os import mkdir, getenv
 from os.path import exists, isdir
 from os.path import join as pjoin
 from pathlib import Path
 from sklearn.feature_extraction.text import CountVectorizer
-from utils.dataset_utils import (CNT, LENGTH_FIELD,
+from utils.dataset_utils import (CNT, DOC_CNT, LENGTH_FIELD,
                                  TEXT_FIELD, PERPLEXITY_FIELD, PROP,
                                  TEXT_NAN_CNT, TOKENIZED_FIELD, TOT_OPEN_WORDS,
-                                 TOT_WORDS, VOCAB, WORD)
+                                 TOT_WORDS, VOCAB, WORD, CORPUS_CACHE,
+                                 GENERAL_CACHE, TEXT_DSET_CACHE,
+                                 TOKENIZED_CACHE, VOCAB_CACHE, ZIPF_CACHE)
 
 logs = utils.prepare_logging(__file__)
 
@@ -81,8 +92,20 @@ IDENTITY_TERMS = [
 pd.set_option("use_inf_as_na", True)
 
 MIN_VOCAB_COUNT = 10
-_NUM_VOCAB_BATCHES = 2000
 _TOP_N = 100
+# Vocab counting engines used when there's no corpus to count from.
+# Column sums over the sparse CountVectorizer document matrix
+SPARSE_VOCAB_ENGINE = "sparse"
+# Counters over shards of the tokenized text, merged across worker processes
+COUNTER_VOCAB_ENGINE = "counter"
+# Versions of the cached computations done in this file (see the cache names
+# in utils/dataset_utils.py).
+_TEXT_DSET_VERSION = 1
+_TOKENIZED_VERSION = 1
+_CORPUS_VERSION = 1
+_VOCAB_VERSION = 1
+_GENERAL_VERSION = 1
+_ZIPF_VERSION = 4
 
 
 class DatasetStatisticsCacheClass:
@@ -99,6 +122,15 @@ class DatasetStatisticsCacheClass:
             dataset_cache_dir=None,
             use_cache=False,
             save=True,
+            num_proc=None,
+            batch_size=BATCH_SIZE,
+            tokenizer_backend=PYTHON_BACKEND,
+            fused_scan=False,
+            npmi_out_of_core=False,
+            npmi_measure=npmi.NPMI_MEASURE,
+            max_rows=ds_utils._MAX_ROWS,
+            zipf_bootstrap_replicates=0,
+            zipf_bootstrap_seed=0,
     ):
         ### What are we analyzing?
         # name of the Hugging Face dataset
@@ -118,12 +150,17 @@ class DatasetStatisticsCacheClass:
         # save label pie chart in the class so it doesn't ge re-computed
         self.fig_labels = None
         ## Hugging Face dataset objects
-        self.dset = None  # original dataset
+        # These are loaded lazily, the first time they're used (see the
+        # dset and text_dset properties), so that when only cached results
+        # are needed (as in the live app), no dataset is loaded at all.
+        self._dset = None  # original dataset
         # HF dataset with all of the self.text_field instances in self.dset
-        self.text_dset = None
+        self._text_dset = None
         self.dset_peek = None
         # HF dataset with text embeddings in the same order as self.text_dset
         self.embeddings_dset = None
+        # Embeddings object, with the clustering used in the UI
+        self.embeddings_obj = None
         # HF dataset with all of the self.label_field instances in self.dset
         # TODO: Not being used anymore; make sure & remove.
         self.label_dset = None
@@ -155,9 +192,43 @@ class DatasetStatisticsCacheClass:
         self.use_cache = use_cache
         # Save newly calculated results.
         self.save = save
+        # Number of processes to use for the parallelizable calculations
+        # (currently tokenization); None means work serially.
+        self.num_proc = num_proc
+        # Number of examples per batch in those calculations.
+        self.batch_size = batch_size
+        # Which tokenizer implementation to use (see tokenize.py)
+        self.tokenizer_backend = tokenizer_backend
+        # Whether to compute the vocab, lengths, duplicates, label and NaN
+        # counts in one pass over the dataset (see fused_scan.py), rather
+        # than in a pass for each.
+        self.fused_scan = fused_scan
+        # The FusedScan, once it has run.
+        self.scan = None
+        # Whether to build the corpus and compute the nPMI out-of-core,
+        # streaming from disk, for datasets too large to tokenize in memory.
+        self.npmi_out_of_core = npmi_out_of_core
+        # The association measure of the word association results (nPMI or
+        # PMI); both are computed from the same cached co-occurrence counts.
+        self.npmi_measure = npmi_measure
+        # Number of rows of the dataset to analyze
+        self.max_rows = max_rows
+        # Number of synthetic datasets of the bootstrap goodness-of-fit test
+        # of the Zipf fit (0 skips it), and the seed of their draws.
+        self.zipf_bootstrap_replicates = zipf_bootstrap_replicates
+        self.zipf_bootstrap_seed = zipf_bootstrap_seed
         self.dset_peek = None
         # Tokenized text
         self.tokenized_df = None
+        # Arrow table version of the tokenized text, when it is available
+        # (from the arrow tokenizer backend).
+        self.tokenized_table = None
+        # Integer-encoded tokenized text (vocab ids, token ids, row offsets),
+        # shared by the measurements.
+        self.corpus = None
+        # Word -> sentence ids index of the corpus, built in the vocab pass;
+        # gives the associations of any word on demand.
+        self.postings = None
 
         ## Zipf
         # Save zipf fig so it doesn't need to be recreated.
@@ -198,12 +269,38 @@ class DatasetStatisticsCacheClass:
 
         # nPMI
         self.npmi_obj = None
+        ## Label-word associations
+        # The nPMI of the words with each label, ranked per label
+        self.label_npmi_df = None
+        self.label_npmi_files = {}
+        ## Collocations
+        # The word pairs with the highest nPMI across the vocabulary
+        self.collocations_df = None
+        self.collocations_files = {}
         # The minimum amount of times a word should occur to be included in
         # word-count-based calculations (currently just relevant to nPMI)
         self.min_vocab_count = MIN_VOCAB_COUNT
 
-        self.hf_dset_cache_dir = pjoin(self.dataset_cache_dir, "base_dset")
+        # The truncated dataset is saved for its number of rows, so that
+        # changing max_rows doesn't reload a differently truncated dataset.
+        # (With the default, it's where it has always been.)
+        if self.max_rows == ds_utils._MAX_ROWS:
+            self.hf_dset_cache_dir = pjoin(self.dataset_cache_dir, "base_dset")
+        else:
+            self.hf_dset_cache_dir = pjoin(self.dataset_cache_dir,
+                                           "base_dset_%s_rows" % self.max_rows)
         self.tokenized_df_fid = pjoin(self.dataset_cache_dir, "tokenized_df.json")
+        self.corpus_dir = pjoin(self.dataset_cache_dir, "corpus")
+        self.postings_dir = pjoin(self.dataset_cache_dir, "postings")
+        # Cache keys of the cached results, stored as <name>.json
+        self.cache_keys_dir = pjoin(self.dataset_cache_dir, "cache_keys")
+        # name: (version, params, names of the cached inputs)
+        self._cache_specs = {}
+        # name: cache key, computed from the specs
+        self._cache_keys = {}
+        # The measurements register their caches (and get their keys) in the
+        # threads of the scheduler.
+        self._cache_lock = threading.Lock()
 
         self.text_dset_fid = pjoin(self.dataset_cache_dir, "text_dset")
         self.dset_peek_json_fid = pjoin(self.dataset_cache_dir, "dset_peek.json")
@@ -225,11 +322,48 @@ class DatasetStatisticsCacheClass:
             self.dataset_cache_dir, "sorted_top_vocab.json"
         )
 
-        # Set the HuggingFace dataset object with the given arguments.
-        self.dset = self._get_dataset()
-        self.text_dset = None
-        # Defines self.text_dset, a HF Dataset with just the TEXT_FIELD instances in self.dset extracted
-        self.load_or_prepare_text_dataset()
+        self._register_caches()
+
+    @property
+    def dset(self):
+        """
+        The HuggingFace dataset, loaded (or downloaded) on first use.
+        """
+        if self._dset is None:
+            # Set the HuggingFace dataset object with the given arguments.
+            self._dset = self._get_dataset()
+        return self._dset
+
+    @dset.setter
+    def dset(self, dset):
+        self._dset = dset
+
+    @property
+    def text_dset(self):
+        """
+        HF Dataset with just the TEXT_FIELD instances in self.dset extracted,
+        loaded (or prepared) on first use.
+        """
+        if self._text_dset is None:
+            # Defines self.text_dset
+            self.load_or_prepare_text_dataset()
+        return self._text_dset
+
+    @text_dset.setter
+    def text_dset(self, text_dset):
+        self._text_dset = text_dset
+
+    def get_dset_features(self):
+        """
+        The features of the HuggingFace dataset; read from the metadata of the
+        saved dataset when it hasn't been loaded.
+        """
+        if self._dset is None:
+            features = ds_utils.read_saved_dataset_features(
+                self.hf_dset_cache_dir)
+            if features is not None:
+                return features
+        return self.dset.features
 
     def _get_dataset(self):
         """
@@ -239,10 +373,114 @@ class DatasetStatisticsCacheClass:
         """
         dset = ds_utils.load_truncated_dataset(self.dset_name, self.dset_config,
                                                self.split_name,
+                                               num_rows=self.max_rows,
+                                               use_cache=self.use_cache,
                                                cache_dir=self.hf_dset_cache_dir,
                                                save=self.save)
         return dset
 
+    def _register_caches(self):
+        """Registers the cached results computed in this class."""
+        self.register_cache(TEXT_DSET_CACHE, _TEXT_DSET_VERSION,
+                            params={"text_field": self.text_field,
+                                    "max_rows": self.max_rows})
+        # The tokenizer backends give the same tokens, so the backend isn't
+        # a parameter.
+        self.register_cache(TOKENIZED_CACHE, _TOKENIZED_VERSION,
+                            params={"token_pattern": TOKEN_PATTERN,
+                                    "lowercase": True},
+                            depends_on=[TEXT_DSET_CACHE])
+        self.register_cache(CORPUS_CACHE, _CORPUS_VERSION,
+                            depends_on=[TOKENIZED_CACHE])
+        self.register_cache(VOCAB_CACHE, _VOCAB_VERSION,
+                            depends_on=[TOKENIZED_CACHE])
+        self.register_cache(GENERAL_CACHE, _GENERAL_VERSION,
+                            params={"top_n": _TOP_N,
+                                    "closed_class": _CLOSED_CLASS},
+                            depends_on=[TOKENIZED_CACHE, VOCAB_CACHE])
+        self.register_cache(ZIPF_CACHE, _ZIPF_VERSION,
+                            params={"bootstrap_replicates":
+                                        self.zipf_bootstrap_replicates,
+                                    "bootstrap_seed": self.zipf_bootstrap_seed},
+                            depends_on=[VOCAB_CACHE])
+
+    def get_dset_fingerprint(self):
+        """
+        The Hugging Face fingerprint of the (truncated) dataset; read from the
+        metadata of the saved dataset when it hasn't been loaded.
+        """
+        if self._dset is None:
+            fingerprint = ds_utils.read_saved_dataset_fingerprint(
+                self.hf_dset_cache_dir)
+            if fingerprint is not None:
+                return fingerprint
+        return self.dset._fingerprint
+
+    def register_cache(self, name, version, params=None, depends_on=()):
+        """
+        Declares how a cached result is computed, for its cache key.
+        Args:
+            name (string): Name of the cached result.
+            version (int): Version of the code computing it.
+            params (dict): The parameters it is computed with.
+            depends_on (list): Names of the cached results it is computed from.
+        """
+        with self._cache_lock:
+            self._cache_specs[name] = (version, params or {},
+                                       list(depends_on))
+            # Keys of the results computed from this one may change too.
+            self._cache_keys = {}
+
+    def get_cache_key(self, name):
+        """
+        Content-addressed key of a cached result: A hash of the dataset
+        fingerprint, the result's version and parameters, and the keys of
+        the results it is computed from.
+        """
+        # Outside of the lock, as it may load the dataset.
+        fingerprint = self.get_dset_fingerprint()
+        with self._cache_lock:
+            return self._get_cache_key(name, fingerprint)
+
+    def _get_cache_key(self, name, fingerprint):
+        """get_cache_key, with the cache lock held."""
+        cache_key = self._cache_keys.get(name)
+        if cache_key is None:
+            version, params, depends_on = self._cache_specs[name]
+            dependency_keys = [self._get_cache_key(dependency, fingerprint)
+                               for dependency in depends_on]
+            cache_key = ds_utils.make_cache_key(fingerprint, params, version,
+                                                dependency_keys)
+            self._cache_keys[name] = cache_key
+        return cache_key
+
+    def _get_cache_key_fid(self, name):
+        return pjoin(self.cache_keys_dir, name + ".json")
+
+    def is_cache_valid(self, name):
+        """
+        Whether the cached result was computed from the same dataset, with the
+        same parameters and code version, as it would be now.
+        Results cached before there were cache keys have no stored key; these
+        are used as they are.
+        """
+        stored_key = ds_utils.read_cache_key(self._get_cache_key_fid(name))
+        if stored_key is None:
+            return True
+        if stored_key != self.get_cache_key(name):
+            logs.info("Cached %s is out of date; recomputing it." % name)
+            return False
+        return True
+
+    def use_cache_for(self, name):
+        """Whether to load the cached result (when there is one)."""
+        return self.use_cache and self.is_cache_valid(name)
+
+    def write_cache_key(self, name):
+        """Stores the key of a newly saved result."""
+        ds_utils.write_cache_key(self.get_cache_key(name),
+                                 self._get_cache_key_fid(name))
+
     def load_or_prepare_text_dataset(self, load_only=False):
         """
         Prepares the HF dataset text/feature based on given config, split, etc.
@@ -250,7 +488,7 @@ class DatasetStatisticsCacheClass:
             load_only: Whether only a cached dataset can be used.
         """
         logs.info("Doing text dset.")
-        if self.use_cache and exists(self.text_dset_fid):
+        if self.use_cache_for(TEXT_DSET_CACHE) and exists(self.text_dset_fid):
             # load extracted text
             self.text_dset = load_from_disk(self.text_dset_fid)
             logs.info("Loaded dataset from disk")
@@ -263,6 +501,7 @@ class DatasetStatisticsCacheClass:
                 # save extracted text instances
                 logs.info("Saving dataset to disk")
                 self.text_dset.save_to_disk(self.text_dset_fid)
+                self.write_cache_key(TEXT_DSET_CACHE)
 
     def prepare_text_dset(self):
         logs.info("Working with dataset:")
@@ -276,10 +515,27 @@ class DatasetStatisticsCacheClass:
                 examples, self.text_field, TEXT_FIELD
             ),
             batched=True,
-            remove_columns=list(self.dset.features),
+            remove_columns=list(self.get_dset_features()),
         )
 
 
+    def load_or_prepare_fused_scan(self, load_only=False):
+        """
+        Runs the single pass over the dataset whose results are used by the
+        vocab, lengths, duplicates, labels and general stats calculations.
+        Nothing is cached: It only feeds what those calculations cache.
+        """
+        if self.scan is not None or load_only:
+            return
+        label_field = self.label_field
+        # As in labels.py, only one label column is supported.
+        if isinstance(label_field, tuple):
+            label_field = label_field[0]
+        self.scan = FusedScan(self.dset, self.text_field,
+                              label_field=label_field,
+                              batch_size=self.batch_size,
+                              backend=self.tokenizer_backend).run()
+
     def load_or_prepare_general_stats(self, load_only=False):
         """
         Content for expander_general_stats widget.
@@ -304,9 +560,9 @@ class DatasetStatisticsCacheClass:
         self.general_stats_dict.update(self.duplicates_results)
         # TODO: Tighten the rest of this similar to text_duplicates.
         if (
-                self.use_cache
+                self.use_cache_for(GENERAL_CACHE)
                 and exists(self.general_stats_json_fid)
-                and exists(self.sorted_top_vocab_df_fid)
+                and ds_utils.df_exists(self.sorted_top_vocab_df_fid)
         ):
             logs.info("Loading cached general stats")
             self.load_general_stats()
@@ -318,6 +574,7 @@ class DatasetStatisticsCacheClass:
                                self.sorted_top_vocab_df_fid)
                 ds_utils.write_json(self.general_stats_dict,
                                  self.general_stats_json_fid)
+                self.write_cache_key(GENERAL_CACHE)
 
     def load_or_prepare_text_lengths(self, load_only=False):
         """
@@ -329,8 +586,12 @@ class DatasetStatisticsCacheClass:
         Returns:
 
         """
-        # We work with the already tokenized dataset
-        self.load_or_prepare_tokenized_df()
+        # We work with the already tokenized dataset;
+        # only needed when the lengths may be computed.
+        if not load_only and self.scan is None:
+            if self.tokenized_df is None:
+                self.load_or_prepare_tokenized_df()
+            self.load_or_prepare_corpus()
         self.length_obj = lengths.DMTHelper(self, load_only=load_only, save=self.save)
         self.length_obj.run_DMT_processing()
 
@@ -344,7 +605,7 @@ class DatasetStatisticsCacheClass:
         """
         label_obj = labels.DMTHelper(self, load_only=load_only, save=self.save)
         self.label_files = label_obj.get_label_filenames()
-        if self.use_cache and exists(self.label_files["figure json"]) and exists(self.label_files["statistics"]):
+        if label_obj.use_cache and exists(self.label_files["figure json"]) and exists(self.label_files["statistics"]):
             self.fig_labels = ds_utils.read_plotly(self.label_files["figure json"])
             self.label_results = ds_utils.read_json(self.label_files["statistics"])
         elif not load_only:
@@ -360,22 +621,43 @@ class DatasetStatisticsCacheClass:
         :param
         :return:
         """
-        if self.use_cache and exists(self.vocab_counts_df_fid):
+        if (self.use_cache_for(VOCAB_CACHE)
+                and ds_utils.df_exists(self.vocab_counts_df_fid)):
             logs.info("Reading vocab from cache")
             self.load_vocab()
             self.vocab_counts_filtered_df = filter_vocab(self.vocab_counts_df)
         elif not load_only:
-            if self.tokenized_df is None:
-                # Building the vocabulary starts with tokenizing.
-                self.load_or_prepare_tokenized_df(load_only=False)
-            logs.info("Calculating vocab afresh")
-            word_count_df = count_vocab_frequencies(self.tokenized_df)
+            if self.scan is not None:
+                logs.info("Using the vocab counted in the fused scan")
+                word_count_df = self.scan.get_word_count_df()
+            elif self.npmi_out_of_core:
+                # Counted from the corpus on disk, without the tokenized text.
+                self.load_or_prepare_corpus(load_only=False)
+                logs.info("Counting vocab from the corpus on disk")
+                word_count_df = pd.DataFrame(
+                    {CNT: self.corpus.word_counts()},
+                    index=pd.Index(self.corpus.vocab, name=WORD))
+            else:
+                if self.tokenized_df is None:
+                    # Building the vocabulary starts with tokenizing.
+                    self.load_or_prepare_tokenized_df(load_only=False)
+                self.load_or_prepare_corpus(load_only=False)
+                logs.info("Calculating vocab afresh")
+                word_count_df = count_vocab_frequencies(self.tokenized_df,
+                                                        corpus=self.corpus,
+                                                        num_proc=self.num_proc)
+                # The postings (and document frequencies) come from the
+                # same pass over the corpus.
+                self.postings = Postings.from_corpus(self.corpus)
             logs.info("Making dfs with proportion.")
             self.vocab_counts_df = calc_p_word(word_count_df)
             self.vocab_counts_filtered_df = filter_vocab(self.vocab_counts_df)
             if self.save:
                 logs.info("Writing out.")
                 ds_utils.write_df(self.vocab_counts_df, self.vocab_counts_df_fid)
+                if self.postings is not None:
+                    self.postings.save(self.postings_dir)
+                self.write_cache_key(VOCAB_CACHE)
         logs.info("unfiltered vocab")
         logs.info(self.vocab_counts_df)
         logs.info("filtered vocab")
@@ -398,6 +680,24 @@ class DatasetStatisticsCacheClass:
         self.duplicates_files = dups_obj.get_duplicates_filenames()
 
 
+    def load_or_prepare_embeddings(self, load_only=False):
+        """
+        Loads or computes the text embeddings and their hierarchical
+        clustering.
+        """
+        embeddings_dir = pjoin(self.dataset_cache_dir, "embeddings")
+        if load_only and not exists(embeddings_dir):
+            return
+        # Imported here, since it loads torch and transformers.
+        from data_measurements.embeddings.embeddings import Embeddings
+        ds_utils.make_path(embeddings_dir)
+        self.embeddings_obj = Embeddings(text_dset=self.text_dset,
+                                         text_field_name=TEXT_FIELD,
+                                         cache_path=embeddings_dir,
+                                         use_cache=self.use_cache)
+        self.embeddings_obj.make_hierarchical_clustering()
+        self.embeddings_dset = self.embeddings_obj.embeddings_dset
+
     def load_or_prepare_text_perplexities(self, load_only=False):
         perplex_obj = perplexity.DMTHelper(self, load_only=load_only)
         perplex_obj.run_DMT_processing()
@@ -415,7 +715,7 @@ class DatasetStatisticsCacheClass:
         self.total_open_words = self.general_stats_dict[TOT_OPEN_WORDS]
 
     def prepare_general_stats(self):
-        if self.tokenized_df is None:
+        if self.tokenized_df is None and self.scan is None:
             logs.warning("Tokenized dataset not yet loaded; doing so.")
             self.load_or_prepare_tokenized_df()
         if self.vocab_counts_df is None:
@@ -426,7 +726,10 @@ class DatasetStatisticsCacheClass:
         ).head(_TOP_N)
         self.total_words = len(self.vocab_counts_df)
         self.total_open_words = len(self.vocab_counts_filtered_df)
-        self.text_nan_count = int(self.tokenized_df.isnull().sum().sum())
+        if self.scan is not None:
+            self.text_nan_count = self.scan.text_nan_count
+        else:
+            self.text_nan_count = int(self.tokenized_df.isnull().sum().sum())
         self.load_or_prepare_text_duplicates()
         self.general_stats_dict = {
             TOT_WORDS: self.total_words,
@@ -442,7 +745,7 @@ class DatasetStatisticsCacheClass:
             load_only: Whether only a cached dataset can be used.
         """
         logs.info("Doing text dset.")
-        if self.use_cache and exists(self.text_dset_fid):
+        if self.use_cache_for(TEXT_DSET_CACHE) and exists(self.text_dset_fid):
             # load extracted text
             self.text_dset = load_from_disk(self.text_dset_fid)
             logs.warning("Loaded dataset from disk")
@@ -454,6 +757,7 @@ class DatasetStatisticsCacheClass:
                 # save extracted text instances
                 logs.warning("Saving dataset to disk")
                 self.text_dset.save_to_disk(self.text_dset_fid)
+                self.write_cache_key(TEXT_DSET_CACHE)
 
     # TODO: Are we not using this anymore?
     def load_or_prepare_dset_peek(self, load_only=False):
@@ -467,30 +771,111 @@ class DatasetStatisticsCacheClass:
                                  self.dset_peek_json_fid)
 
     def load_or_prepare_tokenized_df(self, load_only=False):
-        if self.use_cache and exists(self.tokenized_df_fid):
+        if (self.use_cache_for(TOKENIZED_CACHE)
+                and ds_utils.df_exists(self.tokenized_df_fid)):
             self.tokenized_df = ds_utils.read_df(self.tokenized_df_fid)
         elif not load_only:
             # tokenize all text instances
-            self.tokenized_df = Tokenize(self.text_dset, feature=TEXT_FIELD,
-                                         tok_feature=TOKENIZED_FIELD).get_df()
+            tokenizer = Tokenize(self.text_dset, feature=TEXT_FIELD,
+                                 tok_feature=TOKENIZED_FIELD,
+                                 num_proc=self.num_proc,
+                                 batch_size=self.batch_size,
+                                 backend=self.tokenizer_backend)
+            self.tokenized_table = tokenizer.tokenized_table
+            self.tokenized_df = tokenizer.get_df()
             logs.info("tokenized df is")
             logs.info(self.tokenized_df)
             if self.save:
                 logs.warning("Saving tokenized dataset to disk")
                 # save tokenized text
                 ds_utils.write_df(self.tokenized_df, self.tokenized_df_fid)
+                self.write_cache_key(TOKENIZED_CACHE)
+
+    def load_or_prepare_corpus(self, load_only=False):
+        """
+        Loads (memory-mapped) or builds the integer-encoded corpus from the
+        tokenized text.
+        """
+        if self.corpus is not None:
+            return
+        if self.use_cache_for(CORPUS_CACHE) and Corpus.exists(self.corpus_dir):
+            logs.info("Loading corpus from cache")
+            self.corpus = Corpus.load(self.corpus_dir)
+        elif not load_only and self.npmi_out_of_core:
+            logs.info("Building corpus on disk")
+            self.corpus = Corpus.build_on_disk(
+                iter_tokenized_batches(self.text_dset, feature=TEXT_FIELD,
+                                       batch_size=self.batch_size,
+                                       backend=self.tokenizer_backend),
+                self.corpus_dir)
+            if self.save:
+                self.write_cache_key(CORPUS_CACHE)
+        elif not load_only:
+            if self.tokenized_df is None:
+                self.load_or_prepare_tokenized_df()
+            logs.info("Building corpus")
+            if self.tokenized_table is not None:
+                tokenized_sentences = self.tokenized_table.column(
+                    TOKENIZED_FIELD)
+            else:
+                tokenized_sentences = self.tokenized_df[TOKENIZED_FIELD]
+            self.corpus = Corpus.from_tokenized(tokenized_sentences)
+            if self.save:
+                self.corpus.save(self.corpus_dir)
+                self.write_cache_key(CORPUS_CACHE)
+
+    def load_or_prepare_postings(self, load_only=False):
+        """
+        Loads (memory-mapped) or builds the word -> sentence ids postings of
+        the corpus. They're cached with the vocab they were counted with.
+        """
+        if self.postings is not None:
+            return
+        if self.use_cache_for(VOCAB_CACHE) and Postings.exists(
+                self.postings_dir):
+            logs.info("Loading postings from cache")
+            self.postings = Postings.load(self.postings_dir)
+        # Building the postings holds the whole corpus matrix in memory,
+        # so they aren't available out-of-core.
+        elif not load_only and not self.npmi_out_of_core:
+            self.load_or_prepare_corpus()
+            logs.info("Building postings")
+            self.postings = Postings.from_corpus(self.corpus)
+            if self.save:
+                self.postings.save(self.postings_dir)
 
     def load_or_prepare_npmi(self, load_only=False):
-        npmi_obj = npmi.DMTHelper(self, IDENTITY_TERMS, load_only=load_only, use_cache=self.use_cache, save=self.save)
+        if not load_only:
+            self.load_or_prepare_corpus()
+        npmi_obj = npmi.DMTHelper(self, IDENTITY_TERMS, load_only=load_only, use_cache=self.use_cache, save=self.save, measure=self.npmi_measure)
         npmi_obj.run_DMT_processing()
         self.npmi_obj = npmi_obj
         self.npmi_results = npmi_obj.results_dict
         self.npmi_files = npmi_obj.get_filenames()
 
+    def load_or_prepare_label_npmi(self, load_only=False):
+        if not load_only:
+            self.load_or_prepare_corpus()
+        label_npmi_obj = label_npmi.DMTHelper(self, load_only=load_only,
+                                              save=self.save)
+        label_npmi_obj.run_DMT_processing()
+        self.label_npmi_df = label_npmi_obj.label_npmi_df
+        self.label_npmi_files = label_npmi_obj.get_filenames()
+
+    def load_or_prepare_collocations(self, load_only=False):
+        if not load_only:
+            self.load_or_prepare_corpus()
+        collocations_obj = collocations.DMTHelper(self, load_only=load_only,
+                                                  save=self.save)
+        collocations_obj.run_DMT_processing()
+        self.collocations_df = collocations_obj.collocations_df
+        self.collocations_files = collocations_obj.get_filenames()
+
     def load_or_prepare_zipf(self, load_only=False):
         zipf_json_fid, zipf_fig_json_fid, zipf_fig_html_fid = zipf.get_zipf_fids(
             self.dataset_cache_dir)
-        if self.use_cache and exists(zipf_json_fid):
+        zipf_fig_data_fid = zipf.get_zipf_fig_data_fid(self.dataset_cache_dir)
+        if self.use_cache_for(ZIPF_CACHE) and exists(zipf_json_fid):
             # Zipf statistics
             # Read Zipf statistics: Alpha, p-value, etc.
             with open(zipf_json_fid, "r") as f:
@@ -501,67 +886,163 @@ class DatasetStatisticsCacheClass:
             if exists(zipf_fig_json_fid):
                 self.zipf_fig = ds_utils.read_plotly(zipf_fig_json_fid)
             elif not load_only:
+                # Only read when the figure has to be remade.
+                if exists(zipf_fig_data_fid):
+                    self.z.load_fig_data(ds_utils.read_json(zipf_fig_data_fid))
                 self.zipf_fig = zipf.make_zipf_fig(self.z)
                 if self.save:
-                    ds_utils.write_plotly(self.zipf_fig)
+                    ds_utils.write_plotly(self.zipf_fig, zipf_fig_json_fid)
         elif not load_only:
             self.prepare_zipf()
             if self.save:
                 zipf_dict = self.z.get_zipf_dict()
                 ds_utils.write_json(zipf_dict, zipf_json_fid)
+                ds_utils.write_json(self.z.get_fig_data(), zipf_fig_data_fid)
                 ds_utils.write_plotly(self.zipf_fig, zipf_fig_json_fid)
-                self.zipf_fig.write_html(zipf_fig_html_fid)
+                # The page loads plotly.js from its CDN rather than embedding
+                # its several MB.
+                self.zipf_fig.write_html(zipf_fig_html_fid,
+                                         include_plotlyjs="cdn")
+                self.write_cache_key(ZIPF_CACHE)
 
     def prepare_zipf(self):
         # Calculate zipf from scratch
         # TODO: Does z even need to be self?
         self.z = zipf.Zipf(self.vocab_counts_df)
         self.z.calc_fit()
+        if self.zipf_bootstrap_replicates:
+            self.z.calc_bootstrap_p(self.zipf_bootstrap_replicates,
+                                    seed=self.zipf_bootstrap_seed,
+                                    num_proc=self.num_proc)
         self.zipf_fig = zipf.make_zipf_fig(self.z)
 
 def dummy(doc):
     return doc
 
-def count_vocab_frequencies(tokenized_df):
+def count_vocab_frequencies(tokenized_df, corpus=None, engine=None,
+                            num_proc=None, doc_freq=False):
     """
     Based on an input pandas DataFrame with a 'text' column,
     this function will count the occurrences of all words.
-    :return: [num_words x num_sentences] DataFrame with the rows corresponding to the
-    different vocabulary words and the column to the presence (0 or 1) of that word.
+    Counts are taken without densifying anything:
+    - When the integer-encoded corpus is given, from its sparse matrix.
+    - With the "sparse" engine, as column sums over the sparse
+      CountVectorizer document matrix.
+    - With the "counter" engine, from Counters over shards of the sentences,
+      run across num_proc processes and merged.
+    By default, the counter engine is used when num_proc > 1.
+    :param doc_freq: Whether to also include the number of sentences each word
+    occurs in (the document frequency) as a DOC_CNT column.
+    :return: [num_words x 1] DataFrame with the rows corresponding to the
+    different vocabulary words (alphabetically) and the column to the number
+    of times that word occurs.
     """
-
-    cvec = CountVectorizer(
-        tokenizer=dummy,
-        preprocessor=dummy,
-    )
-    # We do this to calculate per-word statistics
-    # Fast calculation of single word counts
-    logs.info(
-        "Fitting dummy tokenization to make matrix using the previous tokenization"
-    )
-    cvec.fit(tokenized_df[TOKENIZED_FIELD])
-    document_matrix = cvec.transform(tokenized_df[TOKENIZED_FIELD])
-    batches = np.linspace(0, tokenized_df.shape[0], _NUM_VOCAB_BATCHES).astype(
-        int)
-    i = 0
-    tf = []
-    while i < len(batches) - 1:
-        if i % 100 == 0:
-            logs.info("%s of %s vocab batches" % (str(i), str(len(batches))))
-        batch_result = np.sum(
-            document_matrix[batches[i]: batches[i + 1]].toarray(), axis=0
+    if corpus is not None:
+        logs.info("Counting vocab from the corpus token ids")
+        document_matrix = corpus.to_csr()
+        vocab = corpus.vocab
+    else:
+        if engine is None:
+            if num_proc is not None and num_proc > 1:
+                engine = COUNTER_VOCAB_ENGINE
+            else:
+                engine = SPARSE_VOCAB_ENGINE
+        if engine == COUNTER_VOCAB_ENGINE:
+            return _count_vocab_with_counters(tokenized_df[TOKENIZED_FIELD],
+                                              num_proc=num_proc,
+                                              doc_freq=doc_freq)
+        cvec = CountVectorizer(
+            tokenizer=dummy,
+            preprocessor=dummy,
+        )
+        # We do this to calculate per-word statistics
+        # Fast calculation of single word counts
+        logs.info(
+            "Fitting dummy tokenization to make matrix using the previous tokenization"
         )
-        tf.append(batch_result)
-        i += 1
+        document_matrix = cvec.fit_transform(tokenized_df[TOKENIZED_FIELD])
+        vocab = cvec.get_feature_names_out()
+    # Term frequency: The column sums of the sparse # sentences x # words matrix
     word_count_df = pd.DataFrame(
-        [np.sum(tf, axis=0)], columns=cvec.get_feature_names_out()
-    ).transpose()
-    # Now organize everything into the dataframes
-    word_count_df.columns = [CNT]
-    word_count_df.index.name = WORD
+        {CNT: np.asarray(document_matrix.sum(axis=0)).ravel()},
+        index=pd.Index(vocab, name=WORD))
+    if doc_freq:
+        # Document frequency: Each (sentence, word) entry is stored once in
+        # the CSR matrix, so this is how often each column index appears.
+        word_count_df[DOC_CNT] = np.bincount(document_matrix.indices,
+                                             minlength=len(vocab))
     return word_count_df
 
 
+def _count_shard(tokenized_sentences):
+    """Term and document frequency Counters for one shard of sentences."""
+    term_counts = Counter()
+    doc_counts = Counter()
+    for sentence in tokenized_sentences:
+        term_counts.update(sentence)
+        doc_counts.update(set(sentence))
+    return term_counts, doc_counts
+
+
+def _count_vocab_with_counters(tokenized_sentences, num_proc=None,
+                               doc_freq=False):
+    """
+    Streams shards of the tokenized sentences through Counters, in parallel
+    when num_proc > 1, and merges them into the vocab count DataFrame.
+    """
+    tokenized_sentences = list(tokenized_sentences)
+    num_shards = max(num_proc or 1, 1)
+    shard_size = -(-len(tokenized_sentences) // num_shards)
+    shards = [tokenized_sentences[i:i + shard_size] for i in
+              range(0, len(tokenized_sentences), shard_size)]
+    if num_shards > 1:
+        logs.info("Counting vocab in %s processes" % num_shards)
+        with Pool(num_shards) as pool:
+            shard_counts = pool.map(_count_shard, shards)
+    else:
+        shard_counts = [_count_shard(shard) for shard in shards]
+    vocab_counts = (Counter(), Counter())
+    for shard_vocab_counts in shard_counts:
+        vocab_counts = VocabCounts.merge(vocab_counts, shard_vocab_counts)
+    return VocabCounts.finalize(vocab_counts, doc_freq=doc_freq)
+
+
+class VocabCounts:
+    """
+    The vocab counts of a sharded dataset (see sharding.py), from the term
+    and document frequency Counters of each shard.
+    """
+
+    @staticmethod
+    def partial(batch):
+        """
+        Vocab counts of a batch of tokenized text.
+        :param batch: Dict with a list of tokenized sentences in
+        TOKENIZED_FIELD.
+        :return: (term frequency Counter, document frequency Counter)
+        """
+        return _count_shard(batch[TOKENIZED_FIELD])
+
+    @staticmethod
+    def merge(vocab_counts_a, vocab_counts_b):
+        term_counts_a, doc_counts_a = vocab_counts_a
+        term_counts_b, doc_counts_b = vocab_counts_b
+        return term_counts_a + term_counts_b, doc_counts_a + doc_counts_b
+
+    @staticmethod
+    def finalize(vocab_counts, doc_freq=False):
+        """The word count DataFrame, as from count_vocab_frequencies."""
+        term_counts, doc_counts = vocab_counts
+        # Alphabetical, as with the CountVectorizer vocabulary.
+        vocab = sorted(term_counts)
+        word_count_df = pd.DataFrame(
+            {CNT: [term_counts[word] for word in vocab]},
+            index=pd.Index(vocab, name=WORD))
+        if doc_freq:
+            word_count_df[DOC_CNT] = [doc_counts[word] for word in vocab]
+        return word_count_df
+
+
 def calc_p_word(word_count_df):
     # p(word)
     word_count_df[PROP] = word_count_df[CNT] / float(sum(word_count_df[CNT]))
@@ -0,0 +1,220 @@
+# Copyright 2021 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import utils
+import utils.dataset_utils as ds_utils
+from collections import Counter
+from data_measurements.tokenize import (ARROW_BACKEND, BATCH_SIZE,
+                                        PYTHON_BACKEND, TOKEN_PATTERN,
+                                        arrow_tokenize)
+from sklearn.feature_extraction.text import CountVectorizer
+from utils.dataset_utils import CNT, TEXT_FIELD, WORD
+
+logs = utils.prepare_logging(__file__)
+
+# These are string constants defined in the evaluate library, as in
+# text_duplicates.py and labels.py.
+DUPS_FRAC = "duplicate_fraction"
+DUPS_DICT = "duplicates_dict"
+EVAL_LABEL_MEASURE = "label_distribution"
+EVAL_LABEL_ID = "labels"
+EVAL_LABEL_FRAC = "fractions"
+EVAL_LABEL_SKEW = "label_skew"
+
+
+def _hash_text(text):
+    """The hash used for the duplicate fraction (as in the evaluate library)."""
+    return hashlib.md5(text.strip().encode("utf-8")).digest()
+
+
+def label_skew(label_counts):
+    """
+    The (biased) skewness of the label ids, as scipy.stats.skew would give
+    for the full list of labels, computed from the label counts.
+    Non-numeric labels are given ids in the order they were first seen.
+    """
+    labels = list(label_counts)
+    counts = np.array([label_counts[label] for label in labels], dtype=float)
+    if labels and not isinstance(labels[0], (int, float, np.number)):
+        values = np.arange(len(labels), dtype=float)
+    else:
+        values = np.array(labels, dtype=float)
+    num_labels = counts.sum()
+    mean = (values * counts).sum() / num_labels
+    m2 = (counts * (values - mean) ** 2).sum() / num_labels
+    m3 = (counts * (values - mean) ** 3).sum() / num_labels
+    if m2 == 0:
+        return float("nan")
+    return float(m3 / m2 ** 1.5)
+
+
+def make_label_measurement(label_counts):
+    """
+    The results of the evaluate label_distribution measurement, from the
+    label counts (in the order the labels were first seen).
+    """
+    num_labels = sum(label_counts.values())
+    return {EVAL_LABEL_MEASURE: {
+                EVAL_LABEL_ID: list(label_counts),
+                EVAL_LABEL_FRAC: [count / num_labels for count in
+                                  label_counts.values()]},
+            EVAL_LABEL_SKEW: label_skew(label_counts)}
+
+
+class FusedScan:
+    """
+    Computes the inputs of several measurements in one pass over the dataset.
+    Each batch of rows is read once, and feeds:
+    - The word counts (for the vocab)
+    - The number of tokens of each text instance, and the numbers of text
+      instances of each length in characters and in bytes (for the lengths)
+    - Hashes of the text instances (for the exact duplicates)
+    - The label counts (for the label distribution)
+    - The number of missing (None) text instances
+    Without it, each of these measurements reads (and tokenizes) the
+    dataset separately.
+    """
+
+    def __init__(self, dset, text_field, label_field=None, lowercase=True,
+                 batch_size=BATCH_SIZE, backend=PYTHON_BACKEND):
+        # The original HF dataset
+        self.dset = dset
+        # The (possibly nested) text field, extracted as in the text dataset.
+        self.text_field = text_field
+        self.label_field = label_field
+        self.lowercase = lowercase
+        self.batch_size = batch_size
+        self.backend = backend
+        self.num_rows = 0
+        self.text_nan_count = 0
+        # Number of tokens per text instance
+        self.lengths = None
+        # Number of text instances per length
+        self.length_counts = Counter()
+        # Number of text instances per length in characters and in UTF-8 bytes
+        self.char_length_counts = Counter()
+        self.byte_length_counts = Counter()
+        self.word_counts = Counter()
+        self.label_counts = Counter()
+        # Number of occurrences of each (stripped) text instance hash
+        self.dup_hash_counts = Counter()
+        # The exact text instances that occur more than once
+        self.dups_counts = Counter()
+        self._exact_hashes = set()
+
+    def run(self):
+        sent_tokenizer = CountVectorizer(token_pattern=TOKEN_PATTERN,
+                                         lowercase=self.lowercase
+                                         ).build_tokenizer()
+        lengths = []
+        features = self.dset.features
+        label_field = self.label_field
+        if label_field is not None and label_field not in features:
+            logs.info("No label field %s; not counting labels." % label_field)
+            label_field = None
+        for start in range(0, len(self.dset), self.batch_size):
+            batch = self.dset[start:start + self.batch_size]
+            texts = ds_utils.extract_field(batch, self.text_field,
+                                           TEXT_FIELD)[TEXT_FIELD]
+            self._count_texts(texts)
+            self._count_text_lengths(texts)
+            lengths += [self._count_tokens(texts, sent_tokenizer)]
+            if label_field is not None:
+                self.label_counts.update(batch[label_field])
+        self.lengths = np.concatenate(lengths) if lengths else np.zeros(
+            0, dtype=np.int64)
+        self.length_counts = Counter(self.lengths.tolist())
+        logs.info("Scanned %s text instances." % self.num_rows)
+        return self
+
+    def _count_texts(self, texts):
+        """Updates the missing value count and the duplicates hashes."""
+        for text in texts:
+            self.num_rows += 1
+            if text is None:
+                # Counted as an empty string in the duplicates.
+                self.text_nan_count += 1
+                text = ""
+            self.dup_hash_counts[_hash_text(text)] += 1
+            # Exact duplicates: Hash the unstripped text, and only keep the
+            # text itself from its second occurrence on.
+            exact_hash = hashlib.md5(text.encode("utf-8")).digest()
+            if exact_hash in self._exact_hashes:
+                self.dups_counts[text] += 1
+            else:
+                self._exact_hashes.add(exact_hash)
+
+    def _count_text_lengths(self, texts):
+        """
+        Updates the numbers of text instances per length in characters and in
+        bytes (0 for missing text), as Lengths computes them.
+        """
+        text_array = pa.array(texts, type=pa.string())
+        self.char_length_counts.update(
+            pc.utf8_length(text_array).fill_null(0).to_numpy().tolist())
+        self.byte_length_counts.update(
+            pc.binary_length(text_array).fill_null(0).to_numpy().tolist())
+
+    def _count_tokens(self, texts, sent_tokenizer):
+        """Updates the word counts; returns the number of tokens per text."""
+        if self.backend == ARROW_BACKEND:
+            tokenized = arrow_tokenize(pa.array(texts, type=pa.string()),
+                                       self.lowercase)
+            value_counts = pc.value_counts(pc.list_flatten(tokenized))
+            self.word_counts.update(dict(zip(
+                value_counts.field("values").to_pylist(),
+                value_counts.field("counts").to_pylist())))
+            return pc.list_value_length(tokenized).fill_null(0).to_numpy()
+        batch_lengths = np.zeros(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            if text is None:
+                continue
+            if self.lowercase:
+                text = text.lower()
+            tokens = sent_tokenizer(text)
+            self.word_counts.update(tokens)
+            batch_lengths[i] = len(tokens)
+        return batch_lengths
+
+    def get_word_count_df(self):
+        """
+        The word counts, in the format of count_vocab_frequencies: rows for
+        the words (alphabetically), with their counts.
+        """
+        vocab = sorted(self.word_counts)
+        return pd.DataFrame({CNT: [self.word_counts[word] for word in vocab]},
+                            index=pd.Index(vocab, name=WORD))
+
+    def get_duplicates_results(self, list_duplicates=True):
+        """The results of the evaluate text_duplicates measurement."""
+        num_dedup = len(self.dup_hash_counts)
+        # An empty split has no duplicates.
+        dups_frac = 1 - (num_dedup / self.num_rows) if self.num_rows else 0.0
+        results = {DUPS_FRAC: dups_frac}
+        if list_duplicates:
+            # The second and later occurrences were counted.
+            results[DUPS_DICT] = {text: count + 1 for text, count in
+                                  self.dups_counts.items()}
+        return results
+
+    def get_label_measurement(self):
+        """The results of the evaluate label_distribution measurement."""
+        if not self.label_counts:
+            return {}
+        return make_label_measurement(self.label_counts)
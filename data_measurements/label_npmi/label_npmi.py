@@ -0,0 +1,186 @@
+# Copyright 2021 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+import utils
+import utils.dataset_utils as ds_utils
+from data_measurements.npmi.npmi import (calc_sentence_npmi,
+                                         make_sentence_matrix)
+from os.path import join as pjoin
+from scipy.sparse import csr_matrix
+from utils.dataset_utils import CNT, TOKENIZED_FIELD, WORD
+
+logs = utils.prepare_logging(__file__)
+
+# Columns of the results: The label (and its name, when there are label
+# names), the word, the number of sentences with both, and their nPMI.
+LABEL = "label"
+LABEL_NAME = "label name"
+COOC_CNT = "count"
+NPMI = "npmi"
+# Version of the cached label-word association table (LABEL_NPMI_CACHE)
+CACHE_VERSION = 1
+
+
+def make_label_matrix(label_list):
+    """
+    One-hot matrix of the labels of the sentences. Sentences with a missing
+    (None or NaN) label have an empty row, so they count towards the number
+    of sentences but not towards any label.
+    :param label_list: The label of each sentence.
+    :return: (scipy.sparse.csr_matrix of # sentences x # labels, the labels
+    of the columns, in the order they are first seen)
+    """
+    label_ids, labels = pd.factorize(pd.Series(label_list), sort=False)
+    num_sentences = len(label_ids)
+    # factorize gives missing labels the id -1.
+    labeled = np.flatnonzero(label_ids >= 0)
+    label_matrix = csr_matrix(
+        (np.ones(len(labeled), dtype=np.int64),
+         (labeled, label_ids[labeled])),
+        shape=(num_sentences, len(labels)))
+    return label_matrix, list(labels)
+
+
+def calc_label_npmi(sentence_matrix, label_list, vocabulary, min_count=1,
+                    label_names=()):
+    """
+    nPMI of every vocabulary word with every label, over the sentences
+    (see calc_sentence_npmi), from one sparse product of the sentence x vocab
+    and the sentence x label matrices.
+    :param sentence_matrix: Binary # sentences x vocabulary size CSR matrix.
+    :param label_list: The label of each sentence (row of the matrix).
+    :param vocabulary: The words of the matrix columns.
+    :param min_count: Words occurring with a label in fewer sentences are
+    left out for that label.
+    :param label_names: Names of the labels, when the labels are their ids.
+    :return: DataFrame of the LABEL, WORD, COOC_CNT and NPMI (and LABEL_NAME)
+    of the words with each label, ranked by decreasing nPMI per label.
+    """
+    label_matrix, labels = make_label_matrix(label_list)
+    num_sentences = sentence_matrix.shape[0]
+    # [vocabulary size x # labels] number of sentences with each word and
+    # label; sparse, since most words don't occur with most labels.
+    label_cooc = (sentence_matrix.T @ label_matrix).tocoo()
+    keep = label_cooc.data >= min_count
+    word_ids = label_cooc.row[keep]
+    label_ids = label_cooc.col[keep]
+    cooc_counts = label_cooc.data[keep].astype(np.int64)
+    word_probs = np.asarray(sentence_matrix.sum(axis=0)).ravel() / \
+                 num_sentences
+    label_probs = np.asarray(label_matrix.sum(axis=0)).ravel() / num_sentences
+    npmi_scores = calc_sentence_npmi(cooc_counts, word_probs[word_ids],
+                                     label_probs[label_ids], num_sentences)
+    # Labels in the order first seen; words by decreasing nPMI, then count.
+    order = np.lexsort((word_ids, -cooc_counts, -npmi_scores, label_ids))
+    results_df = pd.DataFrame({
+        LABEL: np.asarray(labels, dtype=object)[label_ids[order]],
+        WORD: np.asarray(vocabulary, dtype=object)[word_ids[order]],
+        COOC_CNT: cooc_counts[order],
+        NPMI: npmi_scores[order]})
+    if label_names and all(isinstance(label, (int, np.integer)) and
+                           0 <= label < len(label_names) for label in labels):
+        results_df.insert(1, LABEL_NAME, [label_names[label] for label in
+                                          results_df[LABEL]])
+    return results_df
+
+
+class DMTHelper:
+    """Helper class for the Data Measurements Tool.
+    This allows us to keep all variables and functions related to the
+    label-word associations in one file.
+    """
+
+    def __init__(self, dstats, load_only=False, save=True):
+        self.dstats = dstats
+        self.load_only = load_only
+        self.save = save
+        # Words occurring with a label fewer times aren't counted.
+        self.min_count = dstats.min_vocab_count
+        # TODO: Handle the case where there are multiple label columns.
+        if type(dstats.label_field) == tuple:
+            self.label_field = dstats.label_field[0]
+        else:
+            self.label_field = dstats.label_field
+        self.label_names = dstats.label_names
+        dstats.register_cache(ds_utils.LABEL_NPMI_CACHE, CACHE_VERSION,
+                              params={"label_field": self.label_field,
+                                      "label_names": self.label_names,
+                                      "min_count": self.min_count},
+                              depends_on=[ds_utils.TOKENIZED_CACHE,
+                                          ds_utils.VOCAB_CACHE])
+        self.use_cache = dstats.use_cache_for(ds_utils.LABEL_NPMI_CACHE)
+        # Ranked DataFrame of the words of each label (see calc_label_npmi)
+        self.label_npmi_df = None
+        self.cache_path = pjoin(dstats.dataset_cache_dir, "label_npmi")
+        self.label_npmi_fid = pjoin(self.cache_path, "label_npmi.json")
+
+    def run_DMT_processing(self):
+        if self.use_cache and ds_utils.df_exists(self.label_npmi_fid):
+            self.label_npmi_df = ds_utils.read_df(self.label_npmi_fid)
+            logs.info("Loaded cached label-word associations.")
+        elif not self.load_only:
+            self.label_npmi_df = self.prepare_label_npmi()
+            if self.save:
+                self._write_label_npmi_cache()
+
+    def prepare_label_npmi(self):
+        if self.label_field not in self.dstats.get_dset_features():
+            logs.warning("No label column found -- nothing to do.")
+            return None
+        label_list = self.dstats.dset[self.label_field]
+        vocab_counts_df = self.dstats.vocab_counts_df
+        vocabulary = list(
+            vocab_counts_df.index[vocab_counts_df[CNT] >= self.min_count])
+        if self.dstats.corpus is not None:
+            sentence_matrix = self.dstats.corpus.to_csr(vocabulary=vocabulary,
+                                                        binary=True)
+        else:
+            sentence_matrix = make_sentence_matrix(
+                self.dstats.tokenized_df[TOKENIZED_FIELD], vocabulary)
+        if sentence_matrix.shape[0] != len(label_list):
+            logs.warning("%s labels for %s text instances; not computing "
+                         "the label-word associations." % (
+                             len(label_list), sentence_matrix.shape[0]))
+            return None
+        label_names = self.label_names
+        if not label_names:
+            # ClassLabel features have the names of their label ids.
+            label_names = getattr(
+                self.dstats.dset.features[self.label_field], "names", [])
+        logs.info("Computing the associations of %s words with the labels."
+                  % len(vocabulary))
+        return calc_label_npmi(sentence_matrix, label_list, vocabulary,
+                               min_count=self.min_count,
+                               label_names=label_names)
+
+    def get_label_words(self, label, top_n=None):
+        """The words most associated with a label, by decreasing nPMI."""
+        if self.label_npmi_df is None:
+            return pd.DataFrame()
+        label_df = self.label_npmi_df[self.label_npmi_df[LABEL] == label]
+        label_df = label_df.set_index(WORD)[[COOC_CNT, NPMI]]
+        if top_n is not None:
+            label_df = label_df.head(top_n)
+        return label_df
+
+    def _write_label_npmi_cache(self):
+        ds_utils.make_path(self.cache_path)
+        if self.label_npmi_df is not None:
+            ds_utils.write_df(self.label_npmi_df, self.label_npmi_fid)
+            self.dstats.write_cache_key(ds_utils.LABEL_NPMI_CACHE)
+
+    def get_filenames(self):
+        return {"label-word associations": self.label_npmi_fid}
@@ -6,6 +6,7 @@ import plotly.express as px
 import utils
 import utils.dataset_utils as ds_utils
 from collections import Counter
+from data_measurements import fused_scan
 from os.path import exists, isdir
 from os.path import join as pjoin
 
@@ -19,6 +20,8 @@ EVAL_LABEL_ID = "labels"
 EVAL_LABEL_FRAC = "fractions"
 # TODO: This should ideally be in what's returned from the evaluate library
 EVAL_LABEL_SUM = "sums"
+# Version of the cached label distribution and its figure (LABELS_CACHE)
+CACHE_VERSION = 1
 
 logs = utils.prepare_logging(__file__)
 
@@ -90,16 +93,20 @@ class DMTHelper:
     def __init__(self, dstats, load_only, save):
         logs.info("Initializing labels.")
         # -- Data Measurements Tool variables
+        self.dstats = dstats
         self.label_results = dstats.label_results
         self.fig_labels = dstats.fig_labels
-        self.use_cache = dstats.use_cache
+        dstats.register_cache(ds_utils.LABELS_CACHE, CACHE_VERSION,
+                              params={"label_field": dstats.label_field,
+                                      "label_names": dstats.label_names})
+        self.use_cache = dstats.use_cache_for(ds_utils.LABELS_CACHE)
         self.cache_dir = dstats.dataset_cache_dir
         self.load_only = load_only
         self.save = save
         # -- Hugging Face Dataset variables
         self.label_field = dstats.label_field
-        # Input HuggingFace dataset
-        self.dset = dstats.dset
+        # The input HuggingFace dataset is dstats.dset; it's only loaded
+        # if the labels need to be computed.
         self.dset_name = dstats.dset_name
         self.dset_config = dstats.dset_config
         self.label_names = dstats.label_names
@@ -158,7 +165,7 @@ class DMTHelper:
     def _prepare_labels(self):
         """Loads a Labels object and computes label statistics"""
         # Label object for the dataset
-        label_obj = Labels(dataset=self.dset,
+        label_obj = Labels(dataset=self.dstats.dset,
                            dataset_name=self.dset_name,
                            config_name=self.dset_config)
         # TODO: Handle the case where there are multiple label columns.
@@ -172,7 +179,12 @@ class DMTHelper:
                          "Not computing label statistics." %
                          type(self.label_field))
             return {}
-        label_results = label_obj.prepare_labels(label_field, self.label_names)
+        label_counts = None
+        if self.dstats.scan is not None:
+            # The labels were counted in the fused scan.
+            label_counts = self.dstats.scan.label_counts
+        label_results = label_obj.prepare_labels(label_field, self.label_names,
+                                                 label_counts=label_counts)
         return label_results
 
     def _write_label_cache(self):
@@ -182,6 +194,7 @@ class DMTHelper:
         if self.fig_labels:
             ds_utils.write_plotly(self.fig_labels, self.labels_fig_json_fid)
             self.fig_labels.write_html(self.labels_fig_html_fid)
+        self.dstats.write_cache_key(ds_utils.LABELS_CACHE)
 
     def get_label_filenames(self):
         label_fid_dict = {"statistics": self.labels_json_fid,
@@ -207,30 +220,61 @@ class Labels:
         # For measurement data and additional metadata.
         self.label_results_dict = {}
 
-    def prepare_labels(self, label_field, label_names=[]):
-        """ Uses the evaluate library to return the label distribution. """
+    def prepare_labels(self, label_field, label_names=[], label_counts=None):
+        """
+        Uses the evaluate library to return the label distribution.
+        When the label counts are given (as from the fused scan), the same
+        measurement is made from them, without reading the labels again.
+        """
         logs.info("Inside main label calculation function.")
-        logs.debug("Looking for label field called '%s'" % label_field)
-        # The input Dataset object
-        # When the label field is not found, an error will be thrown.
-        if label_field in self.dset.features:
-            label_list = self.dset[label_field]
-        else:
-            logs.warning("No label column found -- nothing to do. Returning.")
-            logs.debug(self.dset.features)
-            return {}
-        # Get the evaluate library's measurement for label distro.
-        label_distribution = evaluate.load(EVAL_LABEL_MEASURE)
-        # Measure the label distro.
-        label_measurement = label_distribution.compute(data=label_list)
-        # TODO: Incorporate this summation into what the evaluate library returns.
-        label_sum_dict = Counter(label_list)
-        label_sums = [label_sum_dict[key] for key in sorted(label_sum_dict)]
-        label_measurement["sums"] = label_sums
+        if not label_counts:
+            logs.debug("Looking for label field called '%s'" % label_field)
+            # The input Dataset object
+            # When the label field is not found, an error will be thrown.
+            if label_field in self.dset.features:
+                label_list = self.dset[label_field]
+            else:
+                logs.warning("No label column found -- nothing to do. Returning.")
+                logs.debug(self.dset.features)
+                return {}
+            # Get the evaluate library's measurement for label distro.
+            label_distribution = evaluate.load(EVAL_LABEL_MEASURE)
+            # Measure the label distro.
+            label_measurement = label_distribution.compute(data=label_list)
+            # TODO: Incorporate this summation into what the evaluate library returns.
+            label_sum_dict = Counter(label_list)
         if not label_names:
             # Have to extract the label names from the Dataset object when the
             # actual dataset columns are just ints representing the label names.
             label_names = extract_label_names(label_field, self.ds_name,
                                               self.config_name)
+        if label_counts:
+            return self.finalize(label_counts, label_names)
+        label_sums = [label_sum_dict[key] for key in sorted(label_sum_dict)]
+        label_measurement["sums"] = label_sums
         label_results = make_label_results_dict(label_measurement, label_names)
         return label_results
+
+    # For sharded datasets (see sharding.py): The label counts add up over
+    # the shards, and keep the order the labels are first seen in (which is
+    # the order of the evaluate results).
+    @staticmethod
+    def partial(batch, label_field):
+        """
+        Label counts of a batch.
+        :param batch: Dict with a list of labels in label_field.
+        :return: Counter of {label: number of instances}
+        """
+        return Counter(batch[label_field])
+
+    @staticmethod
+    def merge(label_counts_a, label_counts_b):
+        return label_counts_a + label_counts_b
+
+    @staticmethod
+    def finalize(label_counts, label_names=[]):
+        """The label results (as from prepare_labels) for the label counts."""
+        label_measurement = fused_scan.make_label_measurement(label_counts)
+        label_measurement[EVAL_LABEL_SUM] = [label_counts[key] for key in
+                                             sorted(label_counts)]
+        return make_label_results_dict(label_measurement, label_names)
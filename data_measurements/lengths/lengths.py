@@ -3,8 +3,10 @@ import matplotlib.image as mpimg
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 from PIL import Image
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import seaborn as sns
-import statistics
 from os.path import join as pjoin
 import pandas as pd
 import utils
@@ -22,6 +24,17 @@ LENGTH_FIELD = "length"
 UNIQ = "num_instance_lengths"
 AVG = "average_instance_length"
 STD = "standard_dev_instance_length"
+# The same statistics of the lengths in characters and in UTF-8 bytes.
+CHAR_AVG = "average_instance_char_length"
+CHAR_STD = "standard_dev_instance_char_length"
+BYTE_AVG = "average_instance_byte_length"
+BYTE_STD = "standard_dev_instance_byte_length"
+# Lengths counted in the mergeable statistics (see Lengths.partial)
+TOKEN_LENGTHS = "tokens"
+CHAR_LENGTHS = "characters"
+BYTE_LENGTHS = "bytes"
+# Version of the cached length statistics, table and figure (LENGTHS_CACHE)
+CACHE_VERSION = 2
 
 logs = utils.prepare_logging(__file__)
 
@@ -36,14 +49,63 @@ def make_fig_lengths(lengths_df):
     sns.rugplot(data=lengths_df, ax=axs)
     return fig_tok_lengths
 
+def _calc_mean_std(length_values, length_counts):
+    """
+    Mean and sample standard deviation (as statistics.stdev) of lengths,
+    given as the sorted unique lengths and the number of instances of each.
+    The single-pass and the merged statistics both go through here, so they
+    are the same.
+    """
+    length_values = np.asarray(length_values, dtype=float)
+    length_counts = np.asarray(length_counts, dtype=float)
+    num_instances = length_counts.sum()
+    if num_instances < 2:
+        # As statistics.stdev, rather than a NaN standard deviation.
+        raise ValueError("Length statistics need at least 2 text instances; "
+                         "got %d." % num_instances)
+    avg_length = (length_values * length_counts).sum() / num_instances
+    std_length = np.sqrt(
+        (length_counts * (length_values - avg_length) ** 2).sum() /
+        (num_instances - 1))
+    return float(avg_length), float(std_length)
+
+
+def _calc_counter_mean_std(length_counts):
+    """_calc_mean_std of a Counter of {length: number of instances}."""
+    length_values = sorted(length_counts)
+    return _calc_mean_std(length_values, [length_counts[length] for length in
+                                          length_values])
+
+
+def _calc_text_lengths(text_array):
+    """
+    Numbers of characters and of UTF-8 bytes of each text instance (0 for
+    missing text), from the Arrow string kernels.
+    """
+    return (pc.utf8_length(text_array).fill_null(0).to_numpy(),
+            pc.binary_length(text_array).fill_null(0).to_numpy())
+
+
 class DMTHelper:
     def __init__(self, dstats, load_only=False, save=True):
+        self.dstats = dstats
         self.tokenized_df = dstats.tokenized_df
+        # Arrow version of the tokenized text, when there is one; gives the
+        # lengths without going through Python objects.
+        self.tokenized_table = dstats.tokenized_table
+        # Integer-encoded tokenized text; gives the lengths from its offsets.
+        self.corpus = dstats.corpus
+        # Single pass over the dataset that also counts the lengths, if run.
+        self.scan = dstats.scan
         # Whether to only use cache
         self.load_only = load_only
         # Whether to try using cache first.
         # Must be true when self.load_only = True; this function assures that.
-        self.use_cache = dstats.use_cache
+        # Lengths come from the tokenized text, so they are out of date
+        # whenever it is.
+        dstats.register_cache(ds_utils.LENGTHS_CACHE, CACHE_VERSION,
+                              depends_on=[ds_utils.TOKENIZED_CACHE])
+        self.use_cache = dstats.use_cache_for(ds_utils.LENGTHS_CACHE)
         self.cache_dir = dstats.dataset_cache_dir
         self.save = save
         # Lengths class object
@@ -110,7 +172,7 @@ class DMTHelper:
 
     def load_lengths_cache(self):
         # Dataframe with <sentence, length> exists. Load it.
-        if exists(self.lengths_df_json_fid):
+        if ds_utils.df_exists(self.lengths_df_json_fid):
             self.lengths_df = ds_utils.read_df(self.lengths_df_json_fid)
         # Image exists. Load it.
         if exists(self.lengths_fig_png_fid):
@@ -129,11 +191,23 @@ class DMTHelper:
             self.fig_lengths.savefig(self.lengths_fig_png_fid)
         if isinstance(self.lengths_df, pd.DataFrame):
             ds_utils.write_df(self.lengths_df, self.lengths_df_json_fid)
+        self.dstats.write_cache_key(ds_utils.LENGTHS_CACHE)
 
     def _prepare_lengths(self):
         """Loads a Lengths object and computes length statistics"""
         # Length object for the dataset
-        lengths_obj = Lengths(dataset=self.tokenized_df)
+        if self.scan is not None:
+            # The scan doesn't keep the text; the table takes it from the
+            # text dataset.
+            lengths_obj = Lengths(
+                dataset=self.dstats.text_dset.to_pandas(),
+                lengths=self.scan.lengths,
+                char_length_counts=self.scan.char_length_counts,
+                byte_length_counts=self.scan.byte_length_counts)
+        else:
+            lengths_obj = Lengths(dataset=self.tokenized_df,
+                                  corpus=self.corpus,
+                                  tokenized_table=self.tokenized_table)
         lengths_obj.prepare_lengths()
         return lengths_obj
 
@@ -151,8 +225,21 @@ class Lengths:
     and the text instances in a column called TEXT, compute statistics.
     """
 
-    def __init__(self, dataset):
+    def __init__(self, dataset, corpus=None, lengths=None,
+                 tokenized_table=None, char_length_counts=None,
+                 byte_length_counts=None):
         self.dset_df = dataset
+        # When given, the lengths are read from the corpus row offsets.
+        self.corpus = corpus
+        # Or, the lengths may be given as they are (e.g., from the fused scan).
+        self.lengths = lengths
+        # Or, they are read from the list lengths of the Arrow tokenized text.
+        self.tokenized_table = tokenized_table
+        # The numbers of text instances per length in characters and in
+        # bytes, when already counted (e.g., by the fused scan); otherwise,
+        # they are computed from the text.
+        self.char_length_counts = char_length_counts
+        self.byte_length_counts = byte_length_counts
         # Dict of measurements
         self.length_stats_dict = {}
         # Measurements
@@ -163,14 +250,101 @@ class Lengths:
         self.lengths_df = None
 
     def prepare_lengths(self):
+        """
+        Computes the length statistics with numpy, from the number of tokens
+        of each text instance, and the numbers of characters and bytes of
+        their text, which come from Arrow string kernels.
+        """
+        lengths_array = self._get_token_lengths()
         self.lengths_df = pd.DataFrame(self.dset_df[TEXT_FIELD])
-        self.lengths_df[LENGTH_FIELD] = self.dset_df[TOKENIZED_FIELD].apply(len)
-        lengths_array = self.lengths_df[LENGTH_FIELD]
-        self.avg_length = statistics.mean(lengths_array)
-        self.std_length = statistics.stdev(lengths_array)
-        self.num_uniq_lengths = len(lengths_array.unique())
+        self.lengths_df[LENGTH_FIELD] = lengths_array
+        length_values, length_counts = np.unique(lengths_array,
+                                                 return_counts=True)
+        self.avg_length, self.std_length = _calc_mean_std(length_values,
+                                                          length_counts)
+        self.num_uniq_lengths = len(length_values)
+        if (self.char_length_counts is not None and
+                self.byte_length_counts is not None):
+            char_avg, char_std = _calc_counter_mean_std(
+                self.char_length_counts)
+            byte_avg, byte_std = _calc_counter_mean_std(
+                self.byte_length_counts)
+        else:
+            char_lengths, byte_lengths = _calc_text_lengths(
+                self._get_text_array())
+            char_avg, char_std = _calc_mean_std(
+                *np.unique(char_lengths, return_counts=True))
+            byte_avg, byte_std = _calc_mean_std(
+                *np.unique(byte_lengths, return_counts=True))
         self.length_stats_dict = {
-            "average_instance_length": self.avg_length,
-            "standard_dev_instance_length": self.std_length,
-            "num_instance_lengths": self.num_uniq_lengths,
+            AVG: self.avg_length,
+            STD: self.std_length,
+            UNIQ: self.num_uniq_lengths,
+            CHAR_AVG: char_avg,
+            CHAR_STD: char_std,
+            BYTE_AVG: byte_avg,
+            BYTE_STD: byte_std,
         }
+
+    def _get_token_lengths(self):
+        """Number of tokens of each text instance, as a numpy array."""
+        if self.lengths is not None:
+            return np.asarray(self.lengths)
+        if self.corpus is not None:
+            return self.corpus.sentence_lengths()
+        if self.tokenized_table is not None:
+            return pc.list_value_length(
+                self.tokenized_table.column(TOKENIZED_FIELD)).fill_null(
+                0).to_numpy()
+        return np.fromiter(map(len, self.dset_df[TOKENIZED_FIELD]),
+                           dtype=np.int64, count=len(self.dset_df))
+
+    def _get_text_array(self):
+        """The text instances, as an Arrow string array."""
+        if (self.tokenized_table is not None and
+                TEXT_FIELD in self.tokenized_table.column_names):
+            return self.tokenized_table.column(TEXT_FIELD)
+        # Missing text may be None or NaN.
+        return pa.array(self.dset_df[TEXT_FIELD], type=pa.string(),
+                        from_pandas=True)
+
+    # For sharded datasets (see sharding.py), the numbers of instances of each
+    # length, in tokens, characters and bytes, are counted per shard; the
+    # mean and standard deviation are only taken once they're summed.
+    @staticmethod
+    def partial(batch):
+        """
+        Length statistics of a batch of tokenized text.
+        :param batch: Dict with a list of tokenized instances in
+        TOKENIZED_FIELD, and of their text in TEXT_FIELD.
+        :return: Dict of {TOKEN_LENGTHS, CHAR_LENGTHS, BYTE_LENGTHS: Counter
+        of {length: number of instances}}
+        """
+        char_lengths, byte_lengths = _calc_text_lengths(
+            pa.array(batch[TEXT_FIELD], type=pa.string(), from_pandas=True))
+        return {TOKEN_LENGTHS: Counter(len(tokens) for tokens in
+                                       batch[TOKENIZED_FIELD]),
+                CHAR_LENGTHS: Counter(char_lengths.tolist()),
+                BYTE_LENGTHS: Counter(byte_lengths.tolist())}
+
+    @staticmethod
+    def merge(length_counts_a, length_counts_b):
+        return {key: length_counts_a[key] + length_counts_b[key] for key in
+                length_counts_a}
+
+    @staticmethod
+    def finalize(length_counts):
+        """The length_stats_dict for the merged length counts."""
+        avg_length, std_length = _calc_counter_mean_std(
+            length_counts[TOKEN_LENGTHS])
+        char_avg, char_std = _calc_counter_mean_std(
+            length_counts[CHAR_LENGTHS])
+        byte_avg, byte_std = _calc_counter_mean_std(
+            length_counts[BYTE_LENGTHS])
+        return {AVG: avg_length,
+                STD: std_length,
+                UNIQ: len(length_counts[TOKEN_LENGTHS]),
+                CHAR_AVG: char_avg,
+                CHAR_STD: char_std,
+                BYTE_AVG: byte_avg,
+                BYTE_STD: byte_std}
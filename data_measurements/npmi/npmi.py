@@ -13,16 +13,22 @@
 # limitations under the License.
 
 import numpy as np
+import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import sys
 import utils
 import utils.dataset_utils as ds_utils
 import warnings
 from collections import defaultdict
-from os.path import exists
+from data_measurements.corpus import Corpus
+from functools import partial, reduce
+from multiprocessing import Pool
+from os.path import dirname, exists, splitext
 from os.path import join as pjoin
 from sklearn.preprocessing import MultiLabelBinarizer
-from utils.dataset_utils import (CNT, TOKENIZED_FIELD)
+from utils.dataset_utils import (CNT, PROP, TOKENIZED_FIELD, WORD)
 
 # Might be nice to print to log instead? Happens when we drop closed class.
 warnings.filterwarnings(action="ignore", category=UserWarning)
@@ -31,14 +37,50 @@ np.seterr(divide="ignore")
 # treating inf values as NaN as well
 pd.set_option("use_inf_as_na", True)
 logs = utils.prepare_logging(__file__)
-# TODO: Should be possible for a user to specify this.
-NUM_BATCHES = 500
 # For the associations of an identity term
 SING = "associations"
 # For the difference between the associations of identity terms
 DIFF = "biases"
 # Used in the figures we show in DMT
 DMT = "combined"
+# The association measures the results can be computed with, from the same
+# co-occurrence counts; nPMI is the default.
+NPMI_MEASURE = "npmi"
+PMI_MEASURE = "pmi"
+MEASURES = (NPMI_MEASURE, PMI_MEASURE)
+# Columns of the per-term results: <term>-score (its nPMI or PMI, as
+# measured) and <term>-count
+SCORE_COL = "%s-score"
+COUNT_COL = "%s-count"
+# Out-of-core mode: Number of sentences read from the corpus at a time,
+# number of vocabulary words whose associations are computed at a time,
+# and the file the co-occurrence counts are accumulated in (with the terms
+# of its columns).
+SHARD_SIZE = 100000
+VOCAB_CHUNK_SIZE = 100000
+COOC_NPY = "cooccurrences.npy"
+COOC_TERMS_JSON = "cooccurrence_terms.json"
+# Version of the cached raw co-occurrence counts (NPMI_COUNTS_CACHE), which
+# don't depend on the minimum count, the term list or the measure, so
+# changing these reuses them.
+COUNTS_CACHE_VERSION = 1
+# Version of the cached association scores and top-k views (NPMI_CACHE)
+CACHE_VERSION = 4
+# Number of highest and of lowest scoring words kept for each pair of terms
+# and each column of their display, and the number of words shown at a time.
+TOP_K = 1000
+PAGE_SIZE = 50
+# Columns of the top-k views: The pair (alphabetically ordered), the column
+# the words are sorted by, whether ascending, and the words' bias and scores
+# with the FIRST and SECOND terms of the pair.
+TERM1 = "term1"
+TERM2 = "term2"
+SORT_COL = "sort_col"
+ASCENDING = "ascending"
+BIAS = "bias"
+FIRST = "first"
+SECOND = "second"
+VIEW_COLS = [BIAS, FIRST, SECOND]
 
 def pair_terms(id_terms):
     """Creates alphabetically ordered paired terms based on the given terms."""
@@ -53,6 +95,313 @@ def pair_terms(id_terms):
     return pairs
 
 
+def make_terms_df(assoc_results_dict, measure=NPMI_MEASURE):
+    """
+    Puts the scores (of the measure, e.g. nPMI) and co-occurrence counts of
+    all the terms in one vocab x (2 * # terms) DataFrame, with SCORE_COL and
+    COUNT_COL columns for each term. Words without a score for a term have
+    NaN there.
+    """
+    term_columns = {}
+    for term, term_results in assoc_results_dict.items():
+        term_columns[SCORE_COL % term] = term_results[measure][term]
+        term_columns[COUNT_COL % term] = term_results["count"].iloc[:, 0]
+    return pd.DataFrame(term_columns)
+
+
+def get_terms(terms_df):
+    """The terms with results in a terms DataFrame (see make_terms_df)."""
+    score_suffix = SCORE_COL % ""
+    return [col[:-len(score_suffix)] for col in terms_df.columns if
+            col.endswith(score_suffix)]
+
+
+def derive_pair_results(terms_df, s1, s2):
+    """
+    The paired bias results of two terms (as in nPMI.calc_bias), from their
+    columns in a terms DataFrame.
+    """
+    s1_results = terms_df[SCORE_COL % s1].dropna()
+    s2_results = terms_df[SCORE_COL % s2].dropna()
+    paired_results = pd.DataFrame()
+    paired_results[("%s - %s" % (s1, s2))] = s1_results - s2_results
+    paired_results[s1] = s1_results
+    paired_results[s2] = s2_results
+    return paired_results.dropna()
+
+
+def make_top_k_views(pair_results, pair, top_k=TOP_K):
+    """
+    The top_k highest and lowest scoring words of a pair's results, sorted by
+    each of the columns of its display.
+    :param pair_results: The paired results (see derive_pair_results).
+    :param pair: The alphabetically ordered pair of terms.
+    :return: DataFrame with TERM1, TERM2, SORT_COL, ASCENDING, WORD and
+    VIEW_COLS columns; each view's rows are in its sort order.
+    """
+    pair_df = pair_results.copy()
+    pair_df.columns = VIEW_COLS
+    pair_df.index.name = WORD
+    pair_df = pair_df.reset_index()
+    views = []
+    for sort_col in VIEW_COLS:
+        for ascending in [False, True]:
+            view = pair_df.sort_values(sort_col, ascending=ascending,
+                                       kind="mergesort").head(top_k)
+            view.insert(0, TERM1, pair[0])
+            view.insert(1, TERM2, pair[1])
+            view.insert(2, SORT_COL, sort_col)
+            view.insert(3, ASCENDING, ascending)
+            views += [view]
+    return pd.concat(views, ignore_index=True)
+
+
+def group_top_k_views(top_k_df):
+    """
+    The views of a top-k DataFrame (see make_top_k_views), keyed by
+    (TERM1, TERM2, SORT_COL, ASCENDING), with the words as the index.
+    """
+    if top_k_df is None or top_k_df.empty:
+        return {}
+    return {key: view.set_index(WORD)[VIEW_COLS] for key, view in
+            top_k_df.groupby([TERM1, TERM2, SORT_COL, ASCENDING], sort=False)}
+
+
+def _count_corpus_shard(corpus_dir, term_cols, vocabulary, start, end):
+    """
+    Sparse [vocabulary size x # terms] co-occurrence counts of the sentences
+    [start, end) of the corpus saved in corpus_dir. The corpus is
+    memory-mapped, so worker processes share it through the page cache
+    rather than being sent a copy.
+    :param vocabulary: Word order for the rows; None for the corpus ids.
+    """
+    corpus = Corpus.load(corpus_dir)
+    sentence_matrix = corpus.to_csr(vocabulary=vocabulary, binary=True,
+                                    start=start, end=end)
+    return (sentence_matrix.T @ sentence_matrix.tocsc()[:, term_cols]).tocoo()
+
+
+def count_corpus_cooccurrences(corpus, term_cols, cooc_counts,
+                               vocabulary=None, shard_size=SHARD_SIZE,
+                               num_proc=None):
+    """
+    Adds the co-occurrence counts of all the sentences of the corpus into
+    cooc_counts (a numpy array or memmap), computing them a shard of
+    sentences at a time; in num_proc processes when the corpus is saved.
+    """
+    bounds = list(range(0, corpus.num_sentences, shard_size)) + [
+        corpus.num_sentences]
+    shards = list(zip(bounds[:-1], bounds[1:]))
+    if num_proc is not None and num_proc > 1 and corpus.corpus_dir:
+        logs.info("Counting co-occurrences of %s shards in %s processes" % (
+            len(shards), num_proc))
+        count_shard = partial(_count_corpus_shard, corpus.corpus_dir,
+                              term_cols, vocabulary)
+        with Pool(num_proc) as pool:
+            # The shard counts are added in as they come in.
+            for shard_cooc in pool.starmap(count_shard, shards, chunksize=1):
+                cooc_counts[shard_cooc.row, shard_cooc.col] += shard_cooc.data
+        return cooc_counts
+    for start, end in shards:
+        logs.debug("Counting co-occurrences of sentences %s to %s" % (
+            start, end))
+        sentence_matrix = corpus.to_csr(vocabulary=vocabulary, binary=True,
+                                        start=start, end=end)
+        shard_cooc = (sentence_matrix.T @ sentence_matrix.tocsc()[
+                                          :, term_cols]).tocoo()
+        cooc_counts[shard_cooc.row, shard_cooc.col] += shard_cooc.data
+    return cooc_counts
+
+
+def load_or_count_out_of_core(corpus, identity_terms, cache_dir,
+                              reuse_counts=False, shard_size=SHARD_SIZE,
+                              num_proc=None):
+    """
+    The memory-mapped [vocab size x # terms] co-occurrence counts of the
+    terms, in COOC_NPY in cache_dir. Counts already there (for the same
+    corpus) are reused when reuse_counts is set: only the terms that
+    weren't counted yet are counted, into a copy with columns for them.
+    :return: (The memory-mapped counts, the columns of identity_terms in it)
+    """
+    cooc_fid = pjoin(cache_dir, COOC_NPY)
+    cooc_terms_fid = pjoin(cache_dir, COOC_TERMS_JSON)
+    vocab_size = corpus.vocab_size
+    counted_terms = []
+    if reuse_counts and exists(cooc_fid) and exists(cooc_terms_fid):
+        counted_terms = ds_utils.read_json(cooc_terms_fid)
+        if np.load(cooc_fid, mmap_mode="r").shape != (vocab_size,
+                                                      len(counted_terms)):
+            counted_terms = []
+    new_terms = [term for term in identity_terms if term not in counted_terms]
+    if not counted_terms and not new_terms:
+        # No terms, so nothing to count (or to cache).
+        return np.zeros((vocab_size, 0), dtype=np.int64), []
+    if new_terms:
+        logs.info("Counting the co-occurrences of %s" % new_terms)
+        all_terms = counted_terms + new_terms
+        new_cooc_fid = pjoin(cache_dir, "new_" + COOC_NPY)
+        cooc_counts = np.lib.format.open_memmap(
+            new_cooc_fid, mode="w+", dtype=np.int64,
+            shape=(vocab_size, len(all_terms)))
+        if counted_terms:
+            counted = np.load(cooc_fid, mmap_mode="r")
+            for start in range(0, vocab_size, VOCAB_CHUNK_SIZE):
+                end = min(start + VOCAB_CHUNK_SIZE, vocab_size)
+                cooc_counts[start:end, :len(counted_terms)] = counted[start:end]
+            del counted
+        count_corpus_cooccurrences(
+            corpus, pd.Index(corpus.vocab).get_indexer(new_terms),
+            cooc_counts[:, len(counted_terms):], shard_size=shard_size,
+            num_proc=num_proc)
+        cooc_counts.flush()
+        del cooc_counts
+        os.replace(new_cooc_fid, cooc_fid)
+        ds_utils.write_json(all_terms, cooc_terms_fid)
+        counted_terms = all_terms
+    else:
+        logs.info("Reusing the cached co-occurrence counts.")
+    return np.load(cooc_fid, mmap_mode="r"), [counted_terms.index(term) for
+                                              term in identity_terms]
+
+
+def calc_npmi_out_of_core(corpus, identity_terms, terms_fid,
+                          shard_size=SHARD_SIZE,
+                          vocab_chunk_size=VOCAB_CHUNK_SIZE, num_proc=None,
+                          reuse_counts=False, measure=NPMI_MEASURE,
+                          counts_dir=None):
+    """
+    Computes the nPMI (or the PMI) of every word with the identity terms with
+    bounded memory: Sentences are streamed in shards from the (memory-mapped)
+    corpus, and their co-occurrence counts accumulated in a memory-mapped
+    array in counts_dir. The association table (as from make_terms_df, with
+    NaN where there's no finite score) is then written to terms_fid as
+    parquet, a chunk of the vocabulary at a time.
+    :param corpus: The Corpus, e.g. memory-mapped from disk.
+    :param identity_terms: List of the identity terms (in the corpus vocab)
+    :param terms_fid: The cache filename of the association table.
+    :param num_proc: Number of processes to count the shards in.
+    :param reuse_counts: Whether to reuse the co-occurrence counts cached
+    in counts_dir (see load_or_count_out_of_core).
+    :param measure: One of MEASURES.
+    :param counts_dir: Where the co-occurrence counts are cached; defaults to
+    the directory of terms_fid.
+    """
+    ds_utils.make_path(dirname(terms_fid))
+    if counts_dir is None:
+        counts_dir = dirname(terms_fid)
+    ds_utils.make_path(counts_dir)
+    vocab_size = corpus.vocab_size
+    term_idxs = pd.Index(corpus.vocab).get_indexer(identity_terms)
+    cooc_counts, term_cols = load_or_count_out_of_core(
+        corpus, identity_terms, counts_dir, reuse_counts=reuse_counts,
+        shard_size=shard_size, num_proc=num_proc)
+    word_counts = corpus.word_counts()
+    word_probs = word_counts / word_counts.sum()
+    term_probs = word_probs[term_idxs]
+    term_totals = np.zeros(len(identity_terms), dtype=np.int64)
+    for start in range(0, vocab_size, vocab_chunk_size):
+        term_totals += cooc_counts[start:start + vocab_chunk_size][
+                       :, term_cols].sum(axis=0)
+    parquet_fid = splitext(terms_fid)[0] + ".parquet"
+    writer = None
+    for start in range(0, vocab_size, vocab_chunk_size):
+        end = min(start + vocab_chunk_size, vocab_size)
+        chunk_cooc = np.asarray(cooc_counts[start:end][:, term_cols])
+        pmi, normalize_pmi = calc_pmi_arrays(
+            chunk_cooc, word_counts[start:end], word_probs[start:end],
+            term_probs, term_totals=term_totals)
+        if measure == PMI_MEASURE:
+            scores = pmi.copy()
+        else:
+            with np.errstate(invalid="ignore"):
+                scores = pmi / normalize_pmi
+        # Infinite values are treated as missing, as in the pandas results.
+        scores[~(np.isfinite(pmi) & np.isfinite(scores))] = np.nan
+        term_columns = {}
+        for term_col, term in enumerate(identity_terms):
+            term_columns[SCORE_COL % term] = scores[:, term_col]
+            term_columns[COUNT_COL % term] = chunk_cooc[:, term_col]
+        chunk_df = pd.DataFrame(term_columns, index=pd.Index(
+            corpus.vocab[start:end], name=WORD))
+        chunk_table = pa.Table.from_pandas(chunk_df, preserve_index=True)
+        if writer is None:
+            writer = pq.ParquetWriter(parquet_fid, chunk_table.schema)
+        writer.write_table(chunk_table)
+    if writer is not None:
+        writer.close()
+    del cooc_counts
+    logs.info("Wrote the %s of %s words with %s terms to %s" % (
+        measure, vocab_size, len(identity_terms), parquet_fid))
+
+
+def make_sentence_matrix(tokenized_sentences, vocabulary):
+    """
+    Sparse binary matrix of # sentences x vocabulary size, with 1 where the
+    word occurs in the sentence. Words outside the vocabulary are ignored.
+    """
+    mlb = MultiLabelBinarizer(classes=vocabulary, sparse_output=True)
+    return mlb.fit_transform(tokenized_sentences).tocsr()
+
+
+def count_cooccurrences(sentence_matrix, term_cols):
+    """
+    Number of sentences where each word occurs together with each term.
+    :param sentence_matrix: Binary # sentences x vocabulary size CSR matrix.
+    :param term_cols: The columns of the (identity) terms in the matrix.
+    :return: [vocabulary size x # terms] numpy array, X^T X[:, term_cols]
+    """
+    term_matrix = sentence_matrix.tocsc()[:, term_cols]
+    cooc_counts = sentence_matrix.T @ term_matrix
+    return np.asarray(cooc_counts.todense(), dtype=np.int64)
+
+
+def calc_pmi_arrays(cooc_counts, word_counts, word_probs, term_probs,
+                    term_totals=None):
+    """
+    PMI of every vocabulary word with every term, and the nPMI normalization,
+    as aligned [vocabulary size x # terms] arrays.
+    PMI(word;term) = log(p(term|word) / p(term))
+    nPMI additionally divides by -log(p(word|term)p(word)).
+    The rows may be a chunk of the vocabulary, if the term_totals are given.
+    :param cooc_counts: [vocabulary size x # terms] co-occurrence counts
+    :param word_counts: Count of each vocabulary word
+    :param word_probs: Proportion of each vocabulary word
+    :param term_probs: Proportion of each term
+    :param term_totals: The co-occurrence counts of each term summed over the
+    whole vocabulary; defaults to the sums over the given rows.
+    :return: (pmi, normalize_pmi) arrays; the nPMI is pmi / normalize_pmi.
+    """
+    if term_totals is None:
+        term_totals = cooc_counts.sum(axis=0)
+    # p(term|word) = count(term, word) / count(word)
+    p_term_g_word = cooc_counts / word_counts[:, np.newaxis]
+    pmi = np.log(p_term_g_word / term_probs[np.newaxis, :])
+    # p(word|term) = count(term, word) / sum over words of count(term, word)
+    p_word_g_term = cooc_counts / term_totals
+    normalize_pmi = -np.log(p_word_g_term * word_probs[:, np.newaxis])
+    return pmi, normalize_pmi
+
+
+def calc_sentence_npmi(cooc_counts, first_probs, second_probs,
+                       num_sentences):
+    """
+    nPMI of co-occurring items (e.g., word pairs, or words and labels) over
+    the sentences they occur in:
+    nPMI(a, b) = log(p(a, b) / (p(a)p(b))) / -log(p(a, b)),
+    where p is the fraction of the sentences with the item(s).
+    The arguments are numpy arrays that broadcast together.
+    :param cooc_counts: Number of sentences with both items.
+    :param first_probs: p(a), the fraction of sentences with the first items.
+    :param second_probs: p(b), the same for the second items.
+    """
+    p_pair = cooc_counts / num_sentences
+    with np.errstate(divide="ignore", invalid="ignore"):
+        npmi_scores = np.log(p_pair / (first_probs * second_probs)) / -np.log(
+            p_pair)
+    # Items that are in every sentence, together, are fully associated.
+    return np.where(p_pair == 1, 1.0, npmi_scores)
+
+
 class DMTHelper:
     """Helper class for the Data Measurements Tool.
     This allows us to keep all variables and functions related to labels
@@ -60,18 +409,38 @@ class DMTHelper:
     """
 
     def __init__(self, dstats, identity_terms, load_only=False, use_cache=False,
-                 save=True):
+                 save=True, measure=NPMI_MEASURE):
+        if measure not in MEASURES:
+            raise ValueError("Unknown association measure %s; choose from %s"
+                             % (measure, ", ".join(MEASURES)))
         # The data measurements tool settings (dataset, config, etc.)
         self.dstats = dstats
         # Whether we can use caching (when live, no).
         self.load_only = load_only
+        # The association measure of the results (see MEASURES)
+        self.measure = measure
         # Whether to first try using cache before calculating
-        self.use_cache = use_cache
+        # The results depend on the vocab counts (which terms are available),
+        # on the tokenized sentences, on the minimum count and term list, and
+        # on the measure.
+        dstats.register_cache(ds_utils.NPMI_CACHE, CACHE_VERSION,
+                              params={"min_count": dstats.min_vocab_count,
+                                      "identity_terms": identity_terms,
+                                      "measure": measure},
+                              depends_on=[ds_utils.TOKENIZED_CACHE,
+                                          ds_utils.VOCAB_CACHE])
+        self.use_cache = use_cache and dstats.is_cache_valid(
+            ds_utils.NPMI_CACHE)
+        # The raw co-occurrence counts only depend on the sentences and the
+        # vocab; counts of the terms are added as they're needed, and they're
+        # shared by the measures.
+        dstats.register_cache(ds_utils.NPMI_COUNTS_CACHE, COUNTS_CACHE_VERSION,
+                              depends_on=[ds_utils.TOKENIZED_CACHE,
+                                          ds_utils.VOCAB_CACHE])
+        self.use_counts_cache = use_cache and dstats.is_cache_valid(
+            ds_utils.NPMI_COUNTS_CACHE)
         # Whether to save results
         self.save = save
-        # Tokenized dataset
-        tokenized_df = dstats.tokenized_df
-        self.tokenized_sentence_df = tokenized_df[TOKENIZED_FIELD]
         # Dataframe of shape #vocab x 1 (count)
         self.vocab_counts_df = dstats.vocab_counts_df
         # Cutoff for the number of times something must occur to be included
@@ -94,10 +463,21 @@ class DMTHelper:
         self.bias_results_dict = defaultdict(dict)
         # Dataframes used in displays.
         self.bias_dfs_dict = defaultdict(dict)
-        # Results of the single word associations and their paired bias values.
+        # nPMI scores and co-occurrence counts of every word with each
+        # identity term, in one DataFrame (see make_terms_df).
+        self.terms_df = None
+        # Whether the results are computed out-of-core, streaming the corpus
+        # from disk. Then the terms_df is only read in a pair at a time.
+        self.out_of_core = dstats.npmi_out_of_core
+        # Paired bias values, derived from the terms_df when first displayed.
         # Formatted as:
         # {(s1,s2)): {pd.DataFrame({s1-s2:diffs, s1:assoc, s2:assoc})}}
         self.results_dict = defaultdict(lambda: defaultdict(dict))
+        # The top-k words of each pair, sorted by each display column, so
+        # the display pages don't need sorting (see make_top_k_views).
+        self.top_k_df = None
+        # {(term1, term2, sort column, ascending): DataFrame of the view}
+        self.top_k_views = {}
         # Filenames for cache, based on the results
         self.filenames_dict = defaultdict(dict)
 
@@ -156,49 +536,147 @@ class DMTHelper:
 
     def load_or_prepare_dmt_results(self):
         # Initialize with no results (reset).
+        self.terms_df = None
         self.results_dict = {}
+        self.top_k_df = None
+        self.top_k_views = {}
         # Filenames for caching and saving
         self._make_fids()
         # If we're trying to use the cache of already computed results
+        has_results = False
         if self.use_cache:
-            # Loads the association results and dataframes used in the display.
+            # Loads the association results of all the identity terms.
             logs.debug("Trying to load...")
-            self.results_dict = self._load_dmt_cache()
+            if self.out_of_core:
+                has_results = ds_utils.df_exists(self.terms_fid)
+            else:
+                self.terms_df = self._load_dmt_cache()
+                has_results = self.terms_df is not None
+            if ds_utils.df_exists(self.top_k_fid):
+                self.top_k_df = ds_utils.read_df(self.top_k_fid)
+            has_results = has_results and self.top_k_df is not None
         # Compute results if we can
         if not self.load_only:
             # If there isn't a solution using cache
-            if not self.results_dict:
+            if not has_results:
                 # Does the actual computations
                 self.prepare_results()
             # Finish
             if self.save:
-                # Writes the paired & singleton dataframe out.
+                # Writes the per-term dataframe out.
                 self._write_dmt_cache()
 
     def _load_dmt_cache(self):
         """
-        Loads dataframe with paired differences and individual item scores.
+        Loads the dataframe of per-term scores and counts; the paired
+        differences are derived from it.
         """
-        results_dict = defaultdict(lambda: defaultdict(dict))
-        pairs = pair_terms(self.avail_identity_terms)
-        for pair in pairs:
-            combined_fid = self.filenames_dict[DMT][pair]
-            if exists(combined_fid):
-                results_dict[pair] = ds_utils.read_df(combined_fid)
-        return results_dict
+        if ds_utils.df_exists(self.terms_fid):
+            return ds_utils.read_df(self.terms_fid)
+        return None
 
     def prepare_results(self):
-        assoc_obj = nPMI(self.dstats.vocab_counts_df,
-                         self.tokenized_sentence_df,
-                         self.avail_identity_terms)
+        if self.out_of_core:
+            # Written straight to the cache.
+            self.dstats.load_or_prepare_corpus()
+            calc_npmi_out_of_core(self.dstats.corpus,
+                                  self.avail_identity_terms, self.terms_fid,
+                                  num_proc=self.dstats.num_proc,
+                                  reuse_counts=self.use_counts_cache,
+                                  measure=self.measure,
+                                  counts_dir=self.counts_dir)
+            if self.save:
+                self.dstats.write_cache_key(ds_utils.NPMI_COUNTS_CACHE)
+            self.top_k_df = self.prepare_top_k_views()
+            return
+        cooc_counts = self.load_or_prepare_cooccurrences(
+            self.avail_identity_terms)
+        assoc_obj = nPMI(self.dstats.vocab_counts_df, None,
+                         self.avail_identity_terms,
+                         cooc_counts=cooc_counts, measure=self.measure)
         self.assoc_results_dict = assoc_obj.assoc_results_dict
+        self.terms_df = make_terms_df(self.assoc_results_dict, self.measure)
         self.results_dict = assoc_obj.bias_results_dict
+        self.top_k_df = self.prepare_top_k_views()
 
-    def _prepare_dmt_dfs(self, measure="npmi"):
+    def load_or_prepare_cooccurrences(self, terms):
+        """
+        The [vocab size x # terms] co-occurrence counts of the terms, from the
+        cached counts; only the terms that weren't counted yet are counted
+        over the sentences, and added to the cache.
+        """
+        counts_df = None
+        if self.use_counts_cache and ds_utils.df_exists(self.counts_fid):
+            counts_df = ds_utils.read_df(self.counts_fid)
+            if not counts_df.index.equals(self.vocab_counts_df.index):
+                counts_df = None
+        new_terms = [term for term in terms if
+                     counts_df is None or term not in counts_df.columns]
+        if counts_df is None and not new_terms:
+            # No terms, so nothing to count (or to cache).
+            return np.zeros((len(self.vocab_counts_df), 0), dtype=np.int64)
+        if new_terms:
+            logs.info("Counting the co-occurrences of %s" % new_terms)
+            if self.dstats.tokenized_df is None:
+                self.dstats.load_or_prepare_tokenized_df()
+            tokenized_sentence_df = self.dstats.tokenized_df[TOKENIZED_FIELD]
+            new_counts = nPMI(self.vocab_counts_df, tokenized_sentence_df,
+                              new_terms, corpus=self.dstats.corpus,
+                              num_proc=self.dstats.num_proc).cooc_counts
+            new_counts_df = pd.DataFrame(new_counts, columns=new_terms,
+                                         index=self.vocab_counts_df.index)
+            counts_df = pd.concat([counts_df, new_counts_df], axis=1)
+            if self.save:
+                ds_utils.make_path(dirname(self.counts_fid))
+                ds_utils.write_df(counts_df, self.counts_fid)
+                self.dstats.write_cache_key(ds_utils.NPMI_COUNTS_CACHE)
+        else:
+            logs.info("Reusing the cached co-occurrence counts.")
+        return counts_df[terms].to_numpy()
+
+    def prepare_top_k_views(self):
+        """The top-k views of all the pairs of the identity terms."""
+        views = []
+        for pair in pair_terms(self.avail_identity_terms):
+            terms_df = self._get_terms_df(pair)
+            views += [make_top_k_views(derive_pair_results(terms_df, *pair),
+                                       pair)]
+        if not views:
+            # With fewer than 2 terms there are no pairs; that's cached too.
+            return pd.DataFrame(
+                columns=[TERM1, TERM2, SORT_COL, ASCENDING, WORD] + VIEW_COLS)
+        logs.info("Prepared the top %s words of %s pairs." % (TOP_K,
+                                                              len(views)))
+        return pd.concat(views, ignore_index=True)
+
+    def prepare_pair_results(self, s1, s2):
+        """
+        The nPMI associations and bias for any two words in the vocabulary,
+        computed on demand from the co-occurrences in their postings.
+        :return: DataFrame of the bias and the two words' associations
+        (empty if either word isn't in the vocabulary).
+        """
+        terms = sorted([s1, s2])
+        if s1 == s2 or any(term not in self.vocab_counts_df.index for term in
+                           terms):
+            logs.info("Can't compute associations of %s and %s." % (s1, s2))
+            return pd.DataFrame()
+        self.dstats.load_or_prepare_corpus(load_only=self.load_only)
+        self.dstats.load_or_prepare_postings(load_only=self.load_only)
+        if self.dstats.corpus is None or self.dstats.postings is None:
+            logs.warning("No postings to compute associations from.")
+            return pd.DataFrame()
+        cooc_counts = self.dstats.postings.cooccurrences(
+            terms, self.dstats.corpus, list(self.vocab_counts_df.index))
+        assoc_obj = nPMI(self.vocab_counts_df, None, terms,
+                         cooc_counts=cooc_counts, measure=self.measure)
+        return assoc_obj.bias_results_dict[tuple(terms)]
+
+    def _prepare_dmt_dfs(self):
         """
         Create the main dataframe that is used in the DMT, which lists
-        the npmi scores for each paired identity term and the difference between
-        them. The difference between them is the "bias".
+        the scores (of self.measure) for each paired identity term and the
+        difference between them. The difference between them is the "bias".
         """
         # Paired identity terms, associations and differences, in one dataframe.
         bias_dfs_dict = defaultdict(dict)
@@ -211,9 +689,11 @@ class DMTHelper:
             s1 = pair[0]
             s2 = pair[1]
             # Single identity term 1, values
-            combined_df[s1] = pd.DataFrame(self.assoc_results_dict[s1][measure])
+            combined_df[s1] = pd.DataFrame(
+                self.assoc_results_dict[s1][self.measure])
             # Single identity term 2, values
-            combined_df[s2] = pd.DataFrame(self.assoc_results_dict[s2][measure])
+            combined_df[s2] = pd.DataFrame(
+                self.assoc_results_dict[s2][self.measure])
             # Full dataframe with scores per-term,
             # as well as the difference between.
             bias_dfs_dict[pair] = combined_df
@@ -228,48 +708,107 @@ class DMTHelper:
             ds_utils.write_json(self.avail_identity_terms,
                                 self.avail_terms_json_fid)
 
-    def _write_dmt_cache(self, measure="npmi"):
-        ds_utils.make_path(pjoin(self.cache_path, measure))
-        for pair, bias_df in self.results_dict.items():
-            logs.debug("Results for pair is:")
-            logs.debug(bias_df)
-            fid = self.filenames_dict[DMT][pair]
-            logs.debug("Writing to %s" % fid)
-            ds_utils.write_df(bias_df, fid)
+    def _write_dmt_cache(self):
+        ds_utils.make_path(pjoin(self.cache_path, self.measure))
+        if self.terms_df is not None:
+            logs.debug("Writing to %s" % self.terms_fid)
+            ds_utils.write_df(self.terms_df, self.terms_fid)
+        if self.top_k_df is not None:
+            ds_utils.write_df(self.top_k_df, self.top_k_fid)
+        self.dstats.write_cache_key(ds_utils.NPMI_CACHE)
 
-    def _make_fids(self, measure="npmi"):
+    def _make_fids(self):
         """
-        Utility function to create filename/path strings for the different
-        result caches. This include single identity term results as well
-        as the difference between them. Also includes the datastructure used in
-        the DMT, which is a dataframe that has:
-        (term1, term2) difference, term1 (scores), term2 (scores)
+        Utility function to create filename/path strings for the result
+        cache: One dataframe of the scores and counts of every word with
+        each identity term, in a directory for the measure. The DMT
+        displays, with the (term1, term2) difference, term1 (scores), term2
+        (scores), are derived from it.
         """
-        self.filenames_dict = {SING: {}, DIFF: {}, DMT: {}}
-        # When we have the available identity terms,
-        # we can make cache filenames for them.
-        for id_term in self.avail_identity_terms:
-            filename = SING + "-" + id_term + ".json"
-            json_fid = pjoin(self.cache_path, measure, filename)
-            self.filenames_dict[SING][id_term] = json_fid
-        paired_terms = pair_terms(self.avail_identity_terms)
-        for id_term_tuple in paired_terms:
-            # The paired association results (bias) are stored with these files.
-            id_term_str = '-'.join(id_term_tuple)
-            filename = DIFF + "-" + id_term_str + ".json"
-            json_fid = pjoin(self.cache_path, measure, filename)
-            self.filenames_dict[DIFF][id_term_tuple] = json_fid
-            # The display dataframes in the DMT are stored with these files.
-            filename = DMT + "-" + id_term_str + ".json"
-            json_fid = pjoin(self.cache_path, measure, filename)
-            self.filenames_dict[DMT][id_term_tuple] = json_fid
+        self.terms_fid = pjoin(self.cache_path, self.measure, SING + ".json")
+        self.top_k_fid = pjoin(self.cache_path, self.measure, "top_k.json")
+        # The raw co-occurrence counts (see load_or_prepare_cooccurrences),
+        # shared by the measures.
+        self.counts_dir = pjoin(self.cache_path, "counts")
+        self.counts_fid = pjoin(self.counts_dir, "cooccurrences.json")
+        self.filenames_dict = {SING: self.terms_fid, "top_k": self.top_k_fid}
+
+    def _get_pair_results(self, pair):
+        """The paired results of an alphabetically ordered pair of words."""
+        if pair not in self.results_dict:
+            terms_df = self._get_terms_df(pair)
+            if terms_df is not None:
+                self.results_dict[pair] = derive_pair_results(terms_df, *pair)
+            else:
+                # Not precomputed: Compute it from the postings.
+                self.results_dict[pair] = self.prepare_pair_results(*pair)
+        return self.results_dict[pair]
 
     def get_display(self, s1, s2):
         pair = tuple(sorted([s1, s2]))
-        display_df = self.results_dict[pair]
+        display_df = self._get_pair_results(pair)
         logs.debug(self.results_dict)
-        display_df.columns = ["bias", s1, s2]
-        return display_df
+        if display_df.empty:
+            return display_df
+        # The results are for the alphabetically ordered pair.
+        display_df = display_df.copy()
+        display_df.columns = ["bias", pair[0], pair[1]]
+        if s1 != pair[0]:
+            # The bias is relative to s1.
+            display_df["bias"] = -display_df["bias"]
+        return display_df[["bias", s1, s2]]
+
+    def get_display_page(self, s1, s2, sort_col=BIAS, ascending=False, page=0,
+                         page_size=PAGE_SIZE):
+        """
+        A page of the display of two words, from their precomputed top-k
+        views, so it takes the same time whatever the vocabulary size.
+        :param sort_col: The display column to sort by: "bias", s1 or s2.
+        :param ascending: Whether to show the lowest scoring words first.
+        :param page: Which page of page_size words to show, from 0.
+        :return: DataFrame with the bias, s1 and s2 columns, as get_display,
+        (empty past the top-k words).
+        """
+        pair = tuple(sorted([s1, s2]))
+        if self.top_k_df is not None and not self.top_k_views:
+            self.top_k_views = group_top_k_views(self.top_k_df)
+        if (pair[0], pair[1], BIAS, False) not in self.top_k_views:
+            # Not precomputed (e.g., typed words): Make its views once.
+            pair_results = self._get_pair_results(pair)
+            if pair_results.empty:
+                return pair_results
+            self.top_k_views.update(group_top_k_views(
+                make_top_k_views(pair_results, pair)))
+        # The views are of the alphabetically ordered pair, where the bias
+        # is relative to pair[0].
+        flipped = s1 != pair[0]
+        if sort_col == s1:
+            view_col = SECOND if flipped else FIRST
+        elif sort_col == s2:
+            view_col = FIRST if flipped else SECOND
+        else:
+            view_col = BIAS
+            ascending = ascending != flipped
+        view = self.top_k_views[(pair[0], pair[1], view_col, ascending)]
+        display_df = view.iloc[page * page_size:(page + 1) * page_size].copy()
+        display_df.columns = ["bias", pair[0], pair[1]]
+        if flipped:
+            display_df["bias"] = -display_df["bias"]
+        return display_df[["bias", s1, s2]]
+
+    def _get_terms_df(self, terms):
+        """
+        The scores of the given terms: from the terms_df, or read from the
+        cache (out-of-core), or None if they weren't precomputed.
+        """
+        if self.terms_df is not None:
+            if all(term in get_terms(self.terms_df) for term in terms):
+                return self.terms_df
+        elif self.out_of_core and ds_utils.df_exists(self.terms_fid) and all(
+                term in self.avail_identity_terms for term in terms):
+            return ds_utils.read_df(self.terms_fid, columns=[
+                SCORE_COL % term for term in terms])
+        return None
 
     def get_filenames(self):
         filenames = {"available terms": self.avail_terms_json_fid,
@@ -283,7 +822,9 @@ class nPMI:
     co-occurrence statistics, PMI, and nPMI
     """
 
-    def __init__(self, vocab_counts_df, tokenized_sentence_df, given_id_terms):
+    def __init__(self, vocab_counts_df, tokenized_sentence_df, given_id_terms,
+                 corpus=None, cooc_counts=None, num_proc=None,
+                 measure=NPMI_MEASURE):
         logs.debug("Initiating assoc class.")
         self.vocab_counts_df = vocab_counts_df
         # TODO: Change this logic so just the vocabulary is given.
@@ -299,49 +840,92 @@ class nPMI:
         logs.info(self.given_id_terms)
         # Terms we calculate the difference between
         self.paired_terms = pair_terms(given_id_terms)
+        # Integer-encoded version of the tokenized sentences, if available.
+        self.corpus = corpus
+        # [vocabulary size x # identity terms] co-occurrence counts.
+        # These may be given (e.g., merged from shards, see nPMI.partial);
+        # then the sentences aren't needed.
+        self.cooc_counts = cooc_counts
+        self.sentence_matrix = None
+        # Number of processes to count the co-occurrences in; None is serial.
+        self.num_proc = num_proc
+        # The association measure the bias is the difference of (see MEASURES)
+        self.measure = measure
 
-        # Matrix of # sentences x vocabulary size
-        self.word_cnts_per_sentence = self.count_words_per_sentence()
+        if self.cooc_counts is None and self.num_proc is not None and \
+                self.num_proc > 1:
+            self.cooc_counts = self.count_cooccurrences_parallel()
+        elif self.cooc_counts is None:
+            # Sparse binary matrix of # sentences x vocabulary size
+            self.sentence_matrix = self.count_words_per_sentence()
+            # Co-occurrence counts of all the words with all the identity
+            # terms, from one sparse product.
+            self.cooc_counts = count_cooccurrences(
+                self.sentence_matrix,
+                [self.vocabulary.index(term) for term in given_id_terms])
         logs.info("Calculating results...")
         # Formatted as {subgroup:{"count":{...},"npmi":{...}}}
         self.assoc_results_dict = self.calc_measures()
         # Dictionary keyed by pair tuples. Each value is a dataframe with
         # vocab terms as the index, and columns of paired difference and
         # individual scores for the two identity terms.
-        self.bias_results_dict = self.calc_bias(self.assoc_results_dict)
+        self.bias_results_dict = self.calc_bias(self.assoc_results_dict,
+                                                measure=self.measure)
 
     def count_words_per_sentence(self):
-        # Counts the number of each vocabulary item per-sentence in batches.
+        """
+        Marks the vocabulary words occurring in each sentence.
+        :return: scipy.sparse.csr_matrix of # sentences x vocabulary size,
+        with 1 where the word occurs in the sentence.
+        """
         logs.info("Creating co-occurrence matrix for nPMI calculations.")
-        word_cnts_per_sentence = []
-        logs.info(self.tokenized_sentence_df)
-        batches = np.linspace(0, self.tokenized_sentence_df.shape[0],
-                              NUM_BATCHES).astype(int)
-        # Creates matrix of size # batches x # sentences
-        for batch_num in range(len(batches) - 1):
-            # Makes matrix shape: batch size (# sentences) x # words,
-            # with the occurrence of each word per sentence.
-            # vocab_counts_df.index is the vocabulary.
-            mlb = MultiLabelBinarizer(classes=self.vocabulary)
-            if batch_num % 100 == 0:
-                logs.debug(
-                    "%s of %s sentence binarize batches." % (
-                        str(batch_num), str(len(batches)))
-                )
-            # Per-sentence word counts
-            sentence_batch = self.tokenized_sentence_df[
-                             batches[batch_num]:batches[batch_num + 1]]
-            mlb_series = mlb.fit_transform(sentence_batch)
-            word_cnts_per_sentence.append(mlb_series)
-        return word_cnts_per_sentence
+        if self.corpus is not None:
+            # Built straight from the corpus token ids.
+            return self.corpus.to_csr(vocabulary=self.vocabulary, binary=True)
+        return make_sentence_matrix(self.tokenized_sentence_df,
+                                    self.vocabulary)
+
+    def count_cooccurrences_parallel(self, shard_size=SHARD_SIZE):
+        """
+        The co-occurrence counts of the identity terms, computed over shards
+        of the sentences in self.num_proc processes and summed; the same
+        counts as the serial, single matrix product.
+        Workers memory-map the corpus when it's saved, and are otherwise
+        sent their shard of the tokenized sentences.
+        """
+        term_cols = [self.vocabulary.index(term) for term in
+                     self.given_id_terms]
+        if self.corpus is not None and self.corpus.corpus_dir:
+            cooc_counts = np.zeros((len(self.vocabulary), len(term_cols)),
+                                   dtype=np.int64)
+            return count_corpus_cooccurrences(
+                self.corpus, term_cols, cooc_counts,
+                vocabulary=self.vocabulary, shard_size=shard_size,
+                num_proc=self.num_proc)
+        logs.info("Counting co-occurrences in %s processes" % self.num_proc)
+        sentences = list(self.tokenized_sentence_df)
+        batches = [{TOKENIZED_FIELD: sentences[start:start + shard_size]}
+                   for start in range(0, len(sentences), shard_size)]
+        count_batch = partial(nPMI.partial, vocabulary=self.vocabulary,
+                              identity_terms=self.given_id_terms)
+        with Pool(self.num_proc) as pool:
+            return reduce(nPMI.merge, pool.map(count_batch, batches))
 
     def calc_measures(self):
         id_results = {}
+        # PMI and its nPMI normalization for all the identity terms at once,
+        # as [vocabulary size x # identity terms] arrays.
+        word_probs = self.vocab_counts_df[PROP].to_numpy()
+        self.pmi, self.normalize_pmi = calc_pmi_arrays(
+            self.cooc_counts,
+            self.vocab_counts_df[CNT].to_numpy(),
+            word_probs,
+            word_probs[[self.vocabulary.index(term) for term in
+                        self.given_id_terms]])
         for subgroup in self.given_id_terms:
             logs.info("Calculating for %s " % subgroup)
             # Index of the identity term in the vocabulary
             subgroup_idx = self.vocabulary.index(subgroup)
-            print("idx is %s" % subgroup_idx)
             logs.debug("Calculating co-occurrences...")
             vocab_cooc_df = self.calc_cooccurrences(subgroup, subgroup_idx)
             logs.debug("Calculating PMI...")
@@ -356,80 +940,31 @@ class nPMI:
             id_results[subgroup] = {"count": vocab_cooc_df,
                                     "pmi": pmi_df,
                                     "npmi": npmi_df}
-            logs.debug("results_dict is:")
-            print(id_results)
         return id_results
 
     def calc_cooccurrences(self, subgroup, subgroup_idx):
-        initialize = True
-        coo_df = None
-        # Big computation here!  Should only happen once.
-        logs.debug(
-            "Approaching big computation! Here, we binarize all words in the "
-            "sentences, making a sparse matrix of sentences."
-        )
-        for batch_id in range(len(self.word_cnts_per_sentence)):
-            # Every 100 batches, print out the progress.
-            if not batch_id % 100:
-                logs.debug(
-                    "%s of %s co-occurrence count batches"
-                    % (str(batch_id), str(len(self.word_cnts_per_sentence)))
-                )
-            # List of all the sentences (list of vocab) in that batch
-            batch_sentence_row = self.word_cnts_per_sentence[batch_id]
-            # Dataframe of # sentences in batch x vocabulary size
-            sent_batch_df = pd.DataFrame(batch_sentence_row)
-            # Subgroup counts per-sentence for the given batch
-            subgroup_df = sent_batch_df[subgroup_idx]
-            subgroup_df.columns = [subgroup]
-            # Remove the sentences where the count of the subgroup is 0.
-            # This way we have less computation & resources needs.
-            subgroup_df = subgroup_df[subgroup_df > 0]
-            mlb_subgroup_only = sent_batch_df[sent_batch_df[subgroup_idx] > 0]
-            # Create cooccurrence matrix for the given subgroup and all words.
-            batch_coo_df = pd.DataFrame(mlb_subgroup_only.T.dot(subgroup_df))
-
-            # Creates a batch-sized dataframe of co-occurrence counts.
-            # Note these could just be summed rather than be batch size.
-            if initialize:
-                coo_df = batch_coo_df
-            else:
-                coo_df = coo_df.add(batch_coo_df, fill_value=0)
-            initialize = False
-        logs.debug("Made co-occurrence matrix")
-        logs.debug(coo_df)
-        count_df = coo_df.set_index(self.vocab_counts_df.index)
-        count_df.columns = ["count"]
-        count_df["count"] = count_df["count"].astype(int)
+        """
+        The number of sentences where each vocabulary word occurs with the
+        subgroup (including the subgroup itself).
+        """
+        count_df = pd.DataFrame(
+            {"count": self.cooc_counts[
+                :, self.given_id_terms.index(subgroup)].astype(int)},
+            index=self.vocab_counts_df.index)
         return count_df
 
     def calc_PMI(self, vocab_cooc_df, subgroup):
-        """A
+        """
         # PMI(x;y) = h(y) - h(y|x)
-        #          = h(subgroup) - h(subgroup|word)az
+        #          = h(subgroup) - h(subgroup|word)
         #          = log (p(subgroup|word) / p(subgroup))
-        # nPMI additionally divides by -log(p(x,y)) = -log(p(x|y)p(y))
+        Read from the PMI computed for all identity terms in calc_measures.
         """
-        print("vocab cooc df")
-        print(vocab_cooc_df)
-        print("vocab counts")
-        print(self.vocab_counts_df["count"])
-        # Calculation of p(subgroup)
-        subgroup_prob = self.vocab_counts_df.loc[subgroup]["proportion"]
-        # Calculation of p(subgroup|word) = count(subgroup,word) / count(word)
-        # Because the indices match (the vocab words),
-        # this division doesn't need to specify the index (I think?!)
         vocab_cooc_df.columns = ["cooc"]
-        p_subgroup_g_word = (
-                    vocab_cooc_df["cooc"] / self.vocab_counts_df["count"])
-        logs.info("p_subgroup_g_word is")
-        logs.info(p_subgroup_g_word)
+        pmi = pd.Series(self.pmi[:, self.given_id_terms.index(subgroup)],
+                        index=self.vocab_counts_df.index)
         pmi_df = pd.DataFrame()
-        pmi_df[subgroup] = np.log(p_subgroup_g_word / subgroup_prob).dropna()
-        # Note: A potentially faster solution for adding count, npmi,
-        # can be based on this zip idea:
-        # df_test['size_kb'],  df_test['size_mb'], df_test['size_gb'] =
-        # zip(*df_test['size'].apply(sizes))
+        pmi_df[subgroup] = pmi.dropna()
         return pmi_df
 
     def calc_nPMI(self, pmi_df, vocab_cooc_df, subgroup):
@@ -437,20 +972,15 @@ class nPMI:
         # nPMI additionally divides by -log(p(x,y)) = -log(p(x|y)p(y))
         #                                           = -log(p(word|subgroup)p(word))
         """
-        p_word_g_subgroup = vocab_cooc_df["cooc"] / sum(vocab_cooc_df["cooc"])
-        logs.debug("p_word_g_subgroup")
-        logs.debug(p_word_g_subgroup)
-        p_word = pmi_df.apply(
-            lambda x: self.vocab_counts_df.loc[x.name]["proportion"], axis=1
-        )
-        logs.debug("p word is")
-        logs.debug(p_word)
-        normalize_pmi = -np.log(p_word_g_subgroup * p_word)
+        normalize_pmi = pd.Series(
+            self.normalize_pmi[:, self.given_id_terms.index(subgroup)],
+            index=self.vocab_counts_df.index)
         npmi_df = pd.DataFrame()
+        # Aligned on the words with a PMI
         npmi_df[subgroup] = pmi_df[subgroup] / normalize_pmi
         return npmi_df.dropna()
 
-    def calc_bias(self, measurements_dict, measure="npmi"):
+    def calc_bias(self, measurements_dict, measure=NPMI_MEASURE):
         """Uses the subgroup dictionaries to compute the differences across pairs.
         Uses dictionaries rather than dataframes due to the fact that dicts seem
         to be preferred amongst evaluate users so far.
@@ -472,19 +1002,33 @@ class nPMI:
         logs.debug(paired_results_dict)
         return paired_results_dict
 
-    def _write_debug_msg(self, batch_id, subgroup_df=None,
-                         subgroup_sentences=None, msg_type="batching"):
-        if msg_type == "batching":
-            if not batch_id % 100:
-                logs.debug(
-                    "%s of %s co-occurrence count batches"
-                    % (str(batch_id), str(len(self.word_cnts_per_sentence)))
-                )
-        elif msg_type == "transpose":
-            if not batch_id % 100:
-                logs.debug("Removing 0 counts, subgroup_df is")
-                logs.debug(subgroup_df)
-                logs.debug("subgroup_sentences is")
-                logs.debug(subgroup_sentences)
-                logs.debug(
-                    "Now we do the transpose approach for co-occurrences")
+    # Sharded co-occurrence counts (see sharding.py): The number of sentences
+    # each vocabulary word shares with each identity term. The vocabulary
+    # must be the one of the full dataset, so that the counts of every shard
+    # line up.
+    @staticmethod
+    def partial(batch, vocabulary, identity_terms):
+        """
+        Co-occurrence counts of a batch of tokenized sentences.
+        :param batch: Dict with a list of tokenized sentences in
+        TOKENIZED_FIELD.
+        :param vocabulary: List of the vocabulary words (vocab_counts_df.index)
+        :param identity_terms: List of the identity terms (in the vocabulary)
+        :return: [vocabulary size x # identity terms] array of the number of
+        sentences where each word and identity term occur together.
+        """
+        sentence_matrix = make_sentence_matrix(batch[TOKENIZED_FIELD],
+                                               vocabulary)
+        return count_cooccurrences(
+            sentence_matrix, [vocabulary.index(term) for term in
+                              identity_terms])
+
+    @staticmethod
+    def merge(cooc_counts_a, cooc_counts_b):
+        return cooc_counts_a + cooc_counts_b
+
+    @staticmethod
+    def finalize(cooc_counts, vocab_counts_df, identity_terms):
+        """The nPMI object for the merged co-occurrence counts."""
+        return nPMI(vocab_counts_df, None, identity_terms,
+                    cooc_counts=cooc_counts)
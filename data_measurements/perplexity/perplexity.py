@@ -11,6 +11,8 @@ logs = utils.prepare_logging(__file__)
 TOK_MODEL = "gpt2"
 PERPLEXITY = load_metric("perplexity")
 PERPLEXITY_FIELD = "perplexity"
+# Version of the cached perplexity of each text instance (PERPLEXITY_CACHE)
+CACHE_VERSION = 1
 
 
 class DMTHelper:
@@ -25,14 +27,19 @@ class DMTHelper:
         # Cache file
         self.perplexities_df_fid = pjoin(self.dstats.dataset_cache_dir,
                                          "perplexities_df.json")
+        dstats.register_cache(ds_utils.PERPLEXITY_CACHE, CACHE_VERSION,
+                              params={"model_id": TOK_MODEL},
+                              depends_on=[ds_utils.TEXT_DSET_CACHE])
 
     def run_DMT_processing(self):
-        if self.dstats.use_cache and exists(self.perplexities_df_fid):
+        if (self.dstats.use_cache_for(ds_utils.PERPLEXITY_CACHE)
+                and ds_utils.df_exists(self.perplexities_df_fid)):
             self.df = ds_utils.read_df(self.perplexities_df_fid)
         elif not self.load_only:
             self.prepare_text_perplexities()
             if self.dstats.save:
                 ds_utils.write_df(self.df, self.perplexities_df_fid)
+                self.dstats.write_cache_key(ds_utils.PERPLEXITY_CACHE)
 
     def prepare_text_perplexities(self):
         texts = self.dstats.text_dset[self.text_field]
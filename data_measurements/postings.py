@@ -0,0 +1,129 @@
+# Copyright 2021 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import utils
+import utils.dataset_utils as ds_utils
+from os.path import exists
+from os.path import join as pjoin
+
+logs = utils.prepare_logging(__file__)
+
+# Cache filenames, within the postings cache directory.
+VOCAB_JSON = "vocab.json"
+WORD_OFFSETS_NPY = "word_offsets.npy"
+SENTENCE_IDS_NPY = "sentence_ids.npy"
+
+
+class Postings:
+    """
+    Inverted index of the corpus: for each word, the ids of the sentences it
+    occurs in. Together with the corpus (sentence -> words), it gives the
+    co-occurrences of any word without binarizing all the sentences again.
+    It holds:
+    - vocab: The vocabulary, in the corpus id order.
+    - sentence_ids: Flat array of the (sorted) sentence ids of every word.
+    - word_offsets: The sentences of word i are
+      sentence_ids[word_offsets[i]:word_offsets[i + 1]]; the differences are
+      the document frequencies.
+    The arrays are saved as .npy files, so they can be memory-mapped on load.
+    """
+
+    def __init__(self, vocab, word_offsets, sentence_ids):
+        self.vocab = vocab
+        self.word_offsets = word_offsets
+        self.sentence_ids = sentence_ids
+        self.word_ids = {word: word_id for word_id, word in enumerate(vocab)}
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        """Builds the postings from the integer-encoded corpus."""
+        # Columns of the binary # sentences x # words matrix are the postings.
+        word_matrix = corpus.to_csr(binary=True).tocsc()
+        word_matrix.sort_indices()
+        logs.info("Built the postings of %s words." % corpus.vocab_size)
+        return cls(list(corpus.vocab), word_matrix.indptr.astype(np.int64),
+                   word_matrix.indices.astype(np.int64))
+
+    @classmethod
+    def load(cls, postings_dir, mmap_mode="r"):
+        vocab = ds_utils.read_json(pjoin(postings_dir, VOCAB_JSON))
+        word_offsets = np.load(pjoin(postings_dir, WORD_OFFSETS_NPY),
+                               mmap_mode=mmap_mode)
+        sentence_ids = np.load(pjoin(postings_dir, SENTENCE_IDS_NPY),
+                               mmap_mode=mmap_mode)
+        return cls(vocab, word_offsets, sentence_ids)
+
+    @staticmethod
+    def exists(postings_dir):
+        return all(exists(pjoin(postings_dir, fid)) for fid in
+                   [VOCAB_JSON, WORD_OFFSETS_NPY, SENTENCE_IDS_NPY])
+
+    def save(self, postings_dir):
+        ds_utils.make_path(postings_dir)
+        ds_utils.write_json(self.vocab, pjoin(postings_dir, VOCAB_JSON))
+        np.save(pjoin(postings_dir, WORD_OFFSETS_NPY), self.word_offsets)
+        np.save(pjoin(postings_dir, SENTENCE_IDS_NPY), self.sentence_ids)
+
+    def __contains__(self, word):
+        return word in self.word_ids
+
+    def doc_freqs(self):
+        """Number of sentences each word occurs in, indexed by word id."""
+        return np.diff(self.word_offsets)
+
+    def doc_freq(self, word):
+        if word not in self.word_ids:
+            return 0
+        word_id = self.word_ids[word]
+        return int(self.word_offsets[word_id + 1] - self.word_offsets[word_id])
+
+    def get(self, word):
+        """The ids of the sentences the word occurs in."""
+        if word not in self.word_ids:
+            return np.zeros(0, dtype=np.int64)
+        word_id = self.word_ids[word]
+        return np.asarray(self.sentence_ids[
+                          self.word_offsets[word_id]:self.word_offsets[
+                              word_id + 1]])
+
+    def cooccurrences(self, terms, corpus, vocabulary):
+        """
+        Number of sentences where each word occurs together with each term,
+        counted over the sentences in the terms' postings only.
+        :param terms: List of words to get the co-occurrences of.
+        :param corpus: The Corpus the postings were built from.
+        :param vocabulary: Word order for the rows (e.g., the vocab_counts_df
+        index); words not in it are left out.
+        :return: [len(vocabulary) x len(terms)] numpy array
+        """
+        id_map = corpus.get_id_map(vocabulary)
+        cooc_counts = np.zeros((len(vocabulary), len(terms)), dtype=np.int64)
+        for term_col, term in enumerate(terms):
+            sentence_ids = self.get(term)
+            starts = np.asarray(corpus.offsets[sentence_ids])
+            lengths = np.asarray(corpus.offsets[sentence_ids + 1]) - starts
+            # Positions of all the tokens of those sentences, in order.
+            token_starts = np.cumsum(lengths) - lengths
+            positions = np.arange(lengths.sum()) + np.repeat(
+                starts - token_starts, lengths)
+            word_ids = np.asarray(corpus.token_ids[positions], dtype=np.int64)
+            # Each word is counted once per sentence.
+            sentence_words = np.unique(
+                np.repeat(np.arange(len(sentence_ids)), lengths) *
+                corpus.vocab_size + word_ids)
+            word_cols = id_map[sentence_words % corpus.vocab_size]
+            cooc_counts[:, term_col] = np.bincount(
+                word_cols[word_cols >= 0], minlength=len(vocabulary))
+        return cooc_counts
@@ -0,0 +1,265 @@
+# Copyright 2021 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import utils
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from utils.dataset_utils import (CORPUS_CACHE, TEXT_DSET_CACHE,
+                                 TOKENIZED_CACHE, VOCAB_CACHE)
+
+logs = utils.prepare_logging(__file__)
+
+## Names of the tasks in the DMT graph.
+# Prerequisites: The shared data the measurements are computed from.
+TEXT_DSET = TEXT_DSET_CACHE
+TOKENIZED = TOKENIZED_CACHE
+CORPUS = CORPUS_CACHE
+VOCAB = VOCAB_CACHE
+EMBEDDINGS = "embeddings"
+# The single pass computing the inputs of several measurements (opt-in).
+FUSED_SCAN = "fused_scan"
+# Measurements, as named in run_data_measurements.py --calculation
+GENERAL = "general"
+DUPLICATES = "duplicates"
+LENGTHS = "lengths"
+LABELS = "labels"
+LABEL_NPMI = "label_npmi"
+NPMI = "npmi"
+COLLOCATIONS = "collocations"
+ZIPF = "zipf"
+PERPLEXITIES = "perplexities"
+# What is calculated when no calculation is specified
+# (embeddings and perplexities are slow, and collocations and label nPMI
+# are extra analyses, so they must be asked for).
+DEFAULT_MEASUREMENTS = [GENERAL, DUPLICATES, LENGTHS, LABELS, NPMI, ZIPF]
+
+
+class Task:
+    """
+    A node in the measurement graph.
+    Args:
+        name (string): Name of the task.
+        fn: The function doing the task; called as fn(load_only=load_only).
+        requires (list): Names of the tasks whose outputs this one uses.
+          These are run first, even if they weren't asked for.
+        after (list): Names of tasks that, if they are run as well, must
+          finish first (e.g., because they set the same results).
+        prerequisite (bool): Whether this prepares shared data for other tasks
+          (rather than being a measurement). Prerequisites change the shared
+          state, so they are run one at a time, with nothing else running.
+    """
+
+    def __init__(self, name, fn, requires=(), after=(), prerequisite=False):
+        self.name = name
+        self.fn = fn
+        self.requires = list(requires)
+        self.after = list(after)
+        self.prerequisite = prerequisite
+
+
+class Scheduler:
+    """
+    Runs the measurements asked for, and only the prerequisites they need.
+    The prerequisites are prepared serially; once their inputs are ready,
+    independent measurements run concurrently in a pool of num_workers
+    threads. A measurement that fails is logged and does not stop the others;
+    only the tasks that require it are skipped.
+    """
+
+    def __init__(self, num_workers=1):
+        self.num_workers = max(num_workers or 1, 1)
+        self.tasks = {}
+
+    def __contains__(self, name):
+        return name in self.tasks
+
+    def add(self, name, fn, requires=(), after=(), prerequisite=False):
+        self.tasks[name] = Task(name, fn, requires=requires, after=after,
+                                prerequisite=prerequisite)
+
+    def resolve(self, names):
+        """
+        The tasks needed for the given task names, in an order that runs
+        every task after what it requires.
+        """
+        ordered = []
+        visiting = set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name in visiting:
+                raise ValueError("Measurement graph has a cycle at %s" % name)
+            if name not in self.tasks:
+                raise ValueError("Unknown measurement %s" % name)
+            visiting.add(name)
+            for required in self.tasks[name].requires:
+                visit(required)
+            visiting.remove(name)
+            ordered.append(name)
+
+        for name in names:
+            visit(name)
+        return ordered
+
+    def run(self, names, load_only=False):
+        """
+        Runs the given tasks and what they require.
+        Args:
+            names (list): Names of the tasks to run.
+            load_only (bool): Whether the tasks may only load cached results.
+              Nothing is computed then, so the prerequisites aren't prepared.
+        Returns:
+            dict: {name: exception} for the tasks that failed (or were
+            skipped because something they require failed).
+        """
+        pending = [self.tasks[name] for name in self.resolve(names)]
+        done = set()
+        if load_only:
+            done = {task.name for task in pending if task.prerequisite}
+            pending = [task for task in pending if not task.prerequisite]
+        # Tasks that failed or were skipped, with the reason.
+        failed = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            while pending or running:
+                self._skip_failed_requirements(pending, failed)
+                for task in self._get_ready(pending, done, running):
+                    if task.prerequisite or self.num_workers == 1:
+                        # Run it here, once nothing else is running.
+                        if running:
+                            continue
+                        pending.remove(task)
+                        self._record(task, self._run_task(task, load_only),
+                                     done, failed)
+                        # This may have made other tasks ready.
+                        break
+                    pending.remove(task)
+                    running[executor.submit(self._run_task, task,
+                                            load_only)] = task
+                else:
+                    # Nothing was run here: Wait for a running task to finish.
+                    if running:
+                        finished, _ = wait(running,
+                                           return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            self._record(running.pop(future), future.result(),
+                                         done, failed)
+                    elif pending:
+                        raise ValueError("Cannot schedule %s" % ", ".join(
+                            task.name for task in pending))
+        if failed:
+            logs.warning("Not computed: %s" % ", ".join(failed))
+        return failed
+
+    @staticmethod
+    def _get_ready(pending, done, running):
+        """
+        The pending tasks whose requirements are done, and that aren't
+        waiting on any of their `after` tasks.
+        """
+        waiting_on = {task.name for task in pending} | \
+                     {task.name for task in running.values()}
+        return [task for task in pending if
+                all(name in done for name in task.requires) and
+                not any(name in waiting_on for name in task.after)]
+
+    @staticmethod
+    def _skip_failed_requirements(pending, failed):
+        for task in list(pending):
+            failed_requirements = [name for name in task.requires if
+                                   name in failed]
+            if failed_requirements:
+                logs.warning("Skipping %s, since %s failed." % (
+                    task.name, ", ".join(failed_requirements)))
+                pending.remove(task)
+                failed[task.name] = failed[failed_requirements[0]]
+
+    @staticmethod
+    def _record(task, error, done, failed):
+        if error is None:
+            done.add(task.name)
+        else:
+            failed[task.name] = error
+
+    @staticmethod
+    def _run_task(task, load_only):
+        """Runs a task; returns the exception if it fails, else None."""
+        logs.info("Running %s." % task.name)
+        try:
+            task.fn(load_only=load_only)
+        except Exception as e:
+            logs.warning("Issue with %s." % task.name)
+            logs.exception(e)
+            return e
+        logs.info("Finished %s." % task.name)
+        return None
+
+
+def get_dmt_scheduler(dstats, num_workers=1):
+    """
+    The graph of the DMT measurements for a DatasetStatisticsCacheClass.
+    Args:
+        dstats: The DatasetStatisticsCacheClass to compute with.
+        num_workers (int): Number of measurements to run at the same time.
+    Returns:
+        Scheduler
+    """
+    scheduler = Scheduler(num_workers=num_workers)
+    # With the fused scan, the vocab, general stats, duplicates, lengths and
+    # labels are computed from its results instead of their own passes.
+    if dstats.fused_scan:
+        scanned = [FUSED_SCAN]
+    else:
+        scanned = []
+    # Shared data
+    scheduler.add(TEXT_DSET, dstats.load_or_prepare_text_dataset,
+                  prerequisite=True)
+    scheduler.add(TOKENIZED, dstats.load_or_prepare_tokenized_df,
+                  requires=[TEXT_DSET], prerequisite=True)
+    # Out-of-core, the corpus is tokenized straight from the text dataset to
+    # disk, and the vocab and nPMI are computed from it, so they don't need
+    # the (in-memory) tokenized text.
+    if dstats.npmi_out_of_core:
+        tokenized = []
+    else:
+        tokenized = [TOKENIZED]
+    scheduler.add(CORPUS, dstats.load_or_prepare_corpus,
+                  requires=tokenized or [TEXT_DSET], prerequisite=True)
+    scheduler.add(FUSED_SCAN, dstats.load_or_prepare_fused_scan,
+                  prerequisite=True)
+    scheduler.add(VOCAB, dstats.load_or_prepare_vocab,
+                  requires=scanned or tokenized + [CORPUS], prerequisite=True)
+    scheduler.add(EMBEDDINGS, dstats.load_or_prepare_embeddings,
+                  requires=[TEXT_DSET], prerequisite=True)
+    # Measurements
+    # The general stats also set the duplicates results (without the list
+    # of duplicates), so the full duplicates results come after them.
+    scheduler.add(GENERAL, dstats.load_or_prepare_general_stats,
+                  requires=(scanned or [TOKENIZED]) + [VOCAB])
+    scheduler.add(DUPLICATES, dstats.load_or_prepare_text_duplicates,
+                  requires=scanned or [TEXT_DSET], after=[GENERAL])
+    scheduler.add(LENGTHS, dstats.load_or_prepare_text_lengths,
+                  requires=scanned or [TOKENIZED, CORPUS])
+    # Labels are read from the dataset itself.
+    scheduler.add(LABELS, dstats.load_or_prepare_labels, requires=scanned)
+    scheduler.add(NPMI, dstats.load_or_prepare_npmi,
+                  requires=tokenized + [CORPUS, VOCAB])
+    scheduler.add(LABEL_NPMI, dstats.load_or_prepare_label_npmi,
+                  requires=tokenized + [CORPUS, VOCAB])
+    scheduler.add(COLLOCATIONS, dstats.load_or_prepare_collocations,
+                  requires=tokenized + [CORPUS, VOCAB])
+    scheduler.add(ZIPF, dstats.load_or_prepare_zipf, requires=[VOCAB])
+    scheduler.add(PERPLEXITIES, dstats.load_or_prepare_text_perplexities,
+                  requires=[TEXT_DSET])
+    return scheduler
@@ -0,0 +1,158 @@
+# Copyright 2021 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+import utils
+from data_measurements.dataset_statistics import IDENTITY_TERMS, VocabCounts
+from data_measurements.labels.labels import Labels
+from data_measurements.lengths.lengths import Lengths
+from data_measurements.npmi.npmi import nPMI
+from data_measurements.text_duplicates.text_duplicates import Duplicates
+from functools import partial, reduce
+from multiprocessing import Pool
+
+logs = utils.prepare_logging(__file__)
+
+# The mergeable measurements (Lengths, Labels, VocabCounts, Duplicates and
+# nPMI) can be computed on shards of a dataset, in other processes or
+# machines, and combined. Each has three staticmethods:
+# - partial(batch, **params): The sufficient statistics of a batch, given in
+#   the {column: list} format of a batched datasets.map.
+# - merge(stats_a, stats_b): The statistics of two batches together. Merging
+#   is associative, so the shards can be merged in any grouping, as long as
+#   they stay in the order of the dataset.
+# - finalize(stats, **params): The results of the measurement, the same as
+#   those computed in a single pass over the whole dataset.
+
+# Names of the measurements checked by check_sharded_measurements
+LENGTHS = "lengths"
+LABELS = "labels"
+VOCAB = "vocab"
+DUPLICATES = "duplicates"
+NPMI = "npmi"
+
+
+def make_batches(data, num_batches):
+    """
+    Splits data into contiguous batches, in the {column: list} format of a
+    batched datasets.map.
+    :param data: pandas DataFrame or HF Dataset
+    :param num_batches: Number of batches to split into.
+    :return: List of dicts of {column: list of values}
+    """
+    num_rows = len(data)
+    bounds = np.linspace(0, num_rows, max(num_batches, 1) + 1).astype(int)
+    batches = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if isinstance(data, pd.DataFrame):
+            batches += [data.iloc[start:end].to_dict("list")]
+        else:
+            batches += [data[int(start):int(end)]]
+    return batches
+
+
+def run_sharded(measurement, batches, num_proc=None, **params):
+    """
+    Computes a measurement's sufficient statistics for each batch, in
+    num_proc processes, and merges them (in the order of the batches).
+    :param measurement: Class with partial and merge staticmethods
+    (e.g., Lengths, Labels, VocabCounts, Duplicates, nPMI).
+    :param batches: List of batches, as from make_batches.
+    :param params: Further arguments to measurement.partial.
+    :return: The merged statistics, to pass to measurement.finalize.
+    """
+    partial_fn = partial(measurement.partial, **params)
+    if num_proc is not None and num_proc > 1:
+        with Pool(num_proc) as pool:
+            partials = pool.map(partial_fn, batches)
+    else:
+        partials = [partial_fn(batch) for batch in batches]
+    return reduce(measurement.merge, partials)
+
+
+def results_equal(results_a, results_b):
+    """Whether two (possibly nested) measurement results are the same."""
+    if isinstance(results_a, (pd.DataFrame, pd.Series)):
+        return results_a.equals(results_b)
+    if isinstance(results_a, np.ndarray):
+        return np.array_equal(results_a, results_b)
+    if isinstance(results_a, dict):
+        return isinstance(results_b, dict) and \
+               list(results_a) == list(results_b) and \
+               all(results_equal(results_a[key], results_b[key]) for key in
+                   results_a)
+    if isinstance(results_a, (list, tuple)):
+        return len(results_a) == len(results_b) and \
+               all(results_equal(value_a, value_b) for value_a, value_b in
+                   zip(results_a, results_b))
+    if isinstance(results_a, float) and np.isnan(results_a):
+        return isinstance(results_b, float) and np.isnan(results_b)
+    return results_a == results_b
+
+
+def check_sharded_measurements(dstats, num_proc=2, num_batches=None):
+    """
+    Computes the mergeable measurements on shards of the dataset, in num_proc
+    processes, and checks that the merged results equal the results computed
+    in a single process over the whole dataset.
+    Uses the tokenized text and the vocab of the dstats, which must be ready.
+    :param dstats: The DatasetStatisticsCacheClass to check.
+    :param num_proc: Number of processes to compute the shards in.
+    :param num_batches: Number of shards; defaults to 2 * num_proc.
+    :return: Dict of {measurement: whether the results are equal}
+    """
+    if num_batches is None:
+        num_batches = 2 * max(num_proc or 1, 1)
+    tokenized_df = dstats.tokenized_df
+    checks = {LENGTHS: (Lengths, tokenized_df, {}, {}),
+              VOCAB: (VocabCounts, tokenized_df, {}, {"doc_freq": True}),
+              DUPLICATES: (Duplicates, tokenized_df, {}, {})}
+    if dstats.label_field in dstats.get_dset_features():
+        checks[LABELS] = (Labels, dstats.dset,
+                          {"label_field": dstats.label_field}, {})
+    identity_terms = [term for term in IDENTITY_TERMS if
+                      term in dstats.vocab_counts_df.index]
+    if identity_terms:
+        checks[NPMI] = (nPMI, tokenized_df,
+                        {"vocabulary": list(dstats.vocab_counts_df.index),
+                         "identity_terms": identity_terms},
+                        {"vocab_counts_df": dstats.vocab_counts_df,
+                         "identity_terms": identity_terms})
+    checked = {}
+    for name, (measurement, data, params, finalize_params) in checks.items():
+        logs.info("Checking sharded %s." % name)
+        merged = run_sharded(measurement, make_batches(data, num_batches),
+                             num_proc=num_proc, **params)
+        single = measurement.partial(make_batches(data, 1)[0], **params)
+        merged_results = measurement.finalize(merged, **finalize_params)
+        single_results = measurement.finalize(single, **finalize_params)
+        if measurement is nPMI:
+            merged_results = merged_results.bias_results_dict
+            single_results = single_results.bias_results_dict
+        checked[name] = results_equal(merged, single) and \
+                        results_equal(merged_results, single_results)
+        if measurement is Lengths:
+            # The merged statistics must also be those of the single-pass
+            # lengths computation.
+            lengths_obj = Lengths(data)
+            lengths_obj.prepare_lengths()
+            checked[name] = checked[name] and results_equal(
+                merged_results, lengths_obj.length_stats_dict)
+        if checked[name]:
+            logs.info("Sharded %s equal the single-process results." % name)
+        else:
+            logs.warning("Sharded %s differ from the single-process results."
+                         % name)
+    return checked
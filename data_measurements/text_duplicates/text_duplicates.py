@@ -17,6 +17,9 @@ DUPS_FRAC = "duplicate_fraction"
 DUPS_DICT = "duplicates_dict"
 # This isn't in the evaluate measurement, but TODO to add that...
 # DUPS_SUM = "duplicate_sum"
+# Version of the cached duplicate fraction and list of duplicates
+# (DUPS_CACHE)
+CACHE_VERSION = 1
 
 logs = utils.prepare_logging(__file__)
 
@@ -28,12 +31,12 @@ class DMTHelper:
     """
 
     def __init__(self, dstats, load_only, save):
-        # Input HuggingFace Dataset.
-        self.dset = dstats.text_dset[TEXT]
-        if self.dset is None:
-            dstats.load_or_prepare_text_dset()
-            self.dset = dstats.text_dset
-        self.use_cache = dstats.use_cache
+        # The input HuggingFace Dataset is dstats.text_dset; it's only loaded
+        # if the duplicates need to be computed.
+        self.dstats = dstats
+        dstats.register_cache(ds_utils.DUPS_CACHE, CACHE_VERSION,
+                              depends_on=[ds_utils.TEXT_DSET_CACHE])
+        self.use_cache = dstats.use_cache_for(ds_utils.DUPS_CACHE)
         # Note: This is None as it can be called different times with different
         # settings, and so we want fresh results each time. With the evaluate
         # integration, results are different depending on whether
@@ -67,8 +70,13 @@ class DMTHelper:
 
     def _prepare_duplicates(self, list_duplicates=True):
         """Wraps the evaluate library."""
+        if self.dstats.scan is not None:
+            # The duplicates were hashed in the fused scan.
+            return self.dstats.scan.get_duplicates_results(
+                list_duplicates=list_duplicates)
         duplicates = evaluate.load("text_duplicates")
-        results = duplicates.compute(data=self.dset, list_duplicates=list_duplicates)
+        results = duplicates.compute(data=self.dstats.text_dset[TEXT],
+                                     list_duplicates=list_duplicates)
         return results
 
     def _load_duplicates_cache(self):
@@ -87,7 +95,41 @@ class DMTHelper:
             # this will make it possible to order the results.
             # But they must first be turned into a dataframe.
             ds_utils.write_json_as_html(self.duplicates_results, self.dups_result_html_fid)
+            self.dstats.write_cache_key(ds_utils.DUPS_CACHE)
 
     def get_duplicates_filenames(self):
         dups_fid_dict = {"statistics": self.dups_result_json_fid, "html":self.dups_result_html_fid}
         return dups_fid_dict
+
+
+class Duplicates:
+    """
+    The evaluate text_duplicates measurement of a sharded dataset (see
+    sharding.py), from the counts of each text instance. A text duplicated
+    across shards is only seen as such once they're merged.
+    """
+
+    @staticmethod
+    def partial(batch):
+        """
+        Text instance counts of a batch.
+        :param batch: Dict with a list of text instances in TEXT.
+        :return: Counter of {text: number of occurrences}
+        """
+        return Counter(batch[TEXT])
+
+    @staticmethod
+    def merge(text_counts_a, text_counts_b):
+        return text_counts_a + text_counts_b
+
+    @staticmethod
+    def finalize(text_counts, list_duplicates=True):
+        """The results of the evaluate text_duplicates measurement."""
+        num_texts = sum(text_counts.values())
+        # As in evaluate, texts are deduplicated after stripping whitespace.
+        num_dedup = len({text.strip() for text in text_counts})
+        results = {DUPS_FRAC: 1 - (num_dedup / num_texts)}
+        if list_duplicates:
+            results[DUPS_DICT] = {text: count for text, count in
+                                  text_counts.items() if count > 1}
+        return results
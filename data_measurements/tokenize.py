@@ -1,53 +1,190 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import utils
+from datasets import Dataset
+from datasets.table import InMemoryTable
 from sklearn.feature_extraction.text import CountVectorizer
 
 logs = utils.prepare_logging(__file__)
 
 TEXT = "text"
 TOKENIZED_TEXT = "tokenized_text"
+# Default number of examples handed to each call of the tokenizing function.
+# This is also the default used by the datasets library.
+BATCH_SIZE = 1000
+# Pattern for tokenization
+TOKEN_PATTERN = "(?u)\\b\\w+\\b"
+# Tokenizer backends.
+# The python backend is the reference implementation:
+# It applies the CountVectorizer regex to each string in turn.
+PYTHON_BACKEND = "python"
+# The arrow backend runs the lowercasing and splitting as pyarrow compute
+# kernels over whole batches, producing an Arrow list<string> column without
+# building Python objects per sentence.
+ARROW_BACKEND = "arrow"
+TOKENIZER_BACKENDS = (PYTHON_BACKEND, ARROW_BACKEND)
+# Splitting on runs of non-word characters finds the same word runs as the
+# "(?u)\b\w+\b" pattern used by the python backend. Written with unicode
+# classes, since \w is ASCII-only in RE2.
+# The tokens aren't always byte-identical, though: Arrow's utf8_lower only
+# applies the one-to-one case mappings, where str.lower also applies the
+# context-dependent and multi-character ones. E.g., "ΟΔΟΣ" is ['οδος'] in
+# python but ['οδοσ'] in arrow (no final sigma), and "İstanbul" is
+# ['i', 'stanbul'] in python (a combining dot splits it) but ['istanbul'] in
+# arrow. Unlowercased, and for text without such letters, they're the same.
+_ARROW_SPLIT_PATTERN = "[^\\p{L}\\p{N}_]+"
+
+
+def _tokenize_batch(examples, sent_tokenizer, feature, tok_feature, lowercase):
+    """
+    Tokenizes one batch of examples.
+    This lives at the module level (rather than as a closure over the Tokenize
+    object) so that it can be cheaply pickled and sent to worker processes.
+    """
+    if lowercase:
+        tok_sent = {
+            tok_feature: [tuple(sent_tokenizer(text.lower())) for text in
+                          examples[feature]]}
+    else:
+        tok_sent = {
+            tok_feature: [tuple(sent_tokenizer(text)) for text in
+                          examples[feature]]}
+    return tok_sent
+
+
+def arrow_tokenize(text_array, lowercase=True):
+    """
+    Tokenizes an Arrow string array with pyarrow compute kernels.
+    :param text_array: pyarrow StringArray of text instances.
+    :param lowercase: Whether to lowercase before splitting.
+    :return: pyarrow ListArray (list<string>) of tokens, one row per instance.
+    """
+    if lowercase:
+        text_array = pc.utf8_lower(text_array)
+    split_array = pc.split_pattern_regex(text_array,
+                                         pattern=_ARROW_SPLIT_PATTERN)
+    # Splitting leaves empty strings where the text starts or ends with a
+    # separator (and for empty text); drop them and rebuild the row offsets.
+    tokens = pc.list_flatten(split_array)
+    parents = pc.list_parent_indices(split_array)
+    keep = pc.not_equal(pc.binary_length(tokens), 0)
+    tokens = pc.filter(tokens, keep)
+    parents = pc.filter(parents, keep).to_numpy()
+    row_lengths = np.bincount(parents, minlength=len(split_array))
+    offsets = np.zeros(len(split_array) + 1, dtype=np.int32)
+    np.cumsum(row_lengths, out=offsets[1:])
+    return pa.ListArray.from_arrays(pa.array(offsets), tokens)
+
+
+def iter_tokenized_batches(text_dset, feature=TEXT, lowercase=True,
+                           batch_size=BATCH_SIZE, backend=PYTHON_BACKEND):
+    """
+    Tokenizes a Hugging Face dataset batch by batch, without keeping the
+    tokenized text in memory (e.g., to build the corpus on disk).
+    :return: Generator of the tokens of each batch: a pyarrow ListArray with
+    the arrow backend, else a list of token tuples.
+    """
+    if backend == ARROW_BACKEND:
+        arrow_dset = text_dset.with_format("arrow")
+        for start in range(0, len(arrow_dset), batch_size):
+            text_batch = arrow_dset[start:start + batch_size].column(
+                feature).combine_chunks()
+            yield arrow_tokenize(text_batch, lowercase)
+    else:
+        sent_tokenizer = CountVectorizer(token_pattern=TOKEN_PATTERN,
+                                         lowercase=lowercase).build_tokenizer()
+        for start in range(0, len(text_dset), batch_size):
+            yield _tokenize_batch(text_dset[start:start + batch_size],
+                                  sent_tokenizer, feature, TOKENIZED_TEXT,
+                                  lowercase)[TOKENIZED_TEXT]
 
 
 class Tokenize:
 
     def __init__(self, text_dset, feature=TEXT, tok_feature=TOKENIZED_TEXT,
-                 lowercase=True):
+                 lowercase=True, num_proc=None, batch_size=BATCH_SIZE,
+                 backend=PYTHON_BACKEND):
         self.text_dset = text_dset
         self.feature = feature
         self.tok_feature = tok_feature
         self.lowercase = lowercase
-        # Pattern for tokenization
-        self.cvec = CountVectorizer(token_pattern="(?u)\\b\\w+\\b",
+        # Number of processes to tokenize with; None (or 1) is serial.
+        self.num_proc = num_proc
+        # Number of examples per tokenizing batch.
+        self.batch_size = batch_size
+        if backend not in TOKENIZER_BACKENDS:
+            raise ValueError("Unknown tokenizer backend %s; choose from %s" % (
+                backend, ", ".join(TOKENIZER_BACKENDS)))
+        self.backend = backend
+        # Arrow table of the text and tokenized text (arrow backend only).
+        self.tokenized_table = None
+        self.cvec = CountVectorizer(token_pattern=TOKEN_PATTERN,
                                     lowercase=lowercase)
-        self.tokenized_dset = self.do_tokenization()
+        if self.backend == ARROW_BACKEND:
+            self.tokenized_dset = self.do_arrow_tokenization()
+        else:
+            self.tokenized_dset = self.do_tokenization()
 
     def do_tokenization(self):
         """
         Tokenizes a Hugging Face dataset in the self.feature field.
+        When self.num_proc > 1, the dataset is sharded across that many
+        processes; the shards are concatenated back in order, so the output
+        is the same as the serial output.
         :return: Hugging Face Dataset with tokenized text in self.tok_feature.
         """
         sent_tokenizer = self.cvec.build_tokenizer()
-
-        def tokenize_batch(examples):
-            if self.lowercase:
-                tok_sent = {
-                    self.tok_feature: [tuple(sent_tokenizer(text.lower())) for
-                                       text in examples[self.feature]]}
-            else:
-                tok_sent = {
-                    self.tok_feature: [tuple(sent_tokenizer(text)) for text in
-                                       examples[self.feature]]}
-            return tok_sent
-
+        num_proc = self.num_proc
+        if num_proc is not None and num_proc <= 1:
+            num_proc = None
+        if num_proc:
+            logs.info("Tokenizing with %s processes." % num_proc)
         tokenized_dset = self.text_dset.map(
-            tokenize_batch,
-            batched=True
+            _tokenize_batch,
+            batched=True,
+            batch_size=self.batch_size,
+            num_proc=num_proc,
+            fn_kwargs={"sent_tokenizer": sent_tokenizer,
+                       "feature": self.feature,
+                       "tok_feature": self.tok_feature,
+                       "lowercase": self.lowercase},
         )
         logs.info("Tokenized the dataset.")
         return tokenized_dset
 
+    def do_arrow_tokenization(self):
+        """
+        Tokenizes a Hugging Face dataset in the self.feature field using
+        pyarrow compute kernels, batch by batch, over the dataset's Arrow table.
+        :return: Hugging Face Dataset with tokenized text in self.tok_feature.
+        """
+        # Slicing in the arrow format gives pyarrow Tables directly.
+        arrow_dset = self.text_dset.with_format("arrow")
+        tokenized_batches = []
+        for start in range(0, len(arrow_dset), self.batch_size):
+            batch_table = arrow_dset[start:start + self.batch_size]
+            text_batch = batch_table.column(self.feature).combine_chunks()
+            tokenized_batch = arrow_tokenize(text_batch, self.lowercase)
+            tokenized_batches.append(
+                batch_table.append_column(self.tok_feature, tokenized_batch))
+        self.tokenized_table = pa.concat_tables(tokenized_batches)
+        logs.info("Tokenized the dataset with the arrow backend.")
+        return Dataset(InMemoryTable(self.tokenized_table))
+
     def get(self):
         return self.tokenized_dset
 
+    def get_table(self):
+        """Returns the tokenized dataset as a pyarrow Table."""
+        if self.tokenized_table is None:
+            self.tokenized_table = self.tokenized_dset.data.table
+        return self.tokenized_table
+
     def get_df(self):
+        if self.backend == ARROW_BACKEND:
+            # Converts straight from Arrow; tokens become numpy arrays rather
+            # than tuples of Python strings.
+            return self.get_table().to_pandas()
         return pd.DataFrame(self.tokenized_dset)
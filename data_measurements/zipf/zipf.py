@@ -18,9 +18,12 @@ import numpy as np
 import os
 import pandas as pd
 import plotly.graph_objects as go
-import powerlaw
+from math import ceil, log10
 from os.path import join as pjoin
 import utils
+from functools import partial
+from multiprocessing import Pool
+from scipy.special import zeta
 from scipy.stats import ks_2samp
 from scipy.stats import zipf as zipf_lib
 
@@ -30,6 +33,163 @@ pd.set_option("use_inf_as_na", True)
 
 logs = utils.prepare_logging(__file__)
 
+# Number of (xmin candidate, count value) pairs whose KS terms are computed
+# at a time when fitting.
+FIT_BLOCK_SIZE = 2 ** 22
+# Number of synthetic datasets fit for the bootstrap goodness-of-fit test
+BOOTSTRAP_REPLICATES = 1000
+# Most ranks (bars) in the figure; beyond it, ranks are put in log-spaced
+# bins, so the figure's size doesn't grow with the vocabulary.
+MAX_FIG_POINTS = 1000
+# Most words, and characters, in the hovertext of a bar of the figure.
+MAX_HOVER_WORDS = 20
+MAX_HOVER_CHARS = 200
+# Size budget of the figure: Each of its 2 traces has at most MAX_FIG_POINTS
+# points, of a hovertext of at most MAX_HOVER_CHARS characters plus about 60
+# of overhead (the "... (N words)" suffix, the rank, the count, and the JSON
+# punctuation), so the figure JSON (and the HTML page, which loads plotly.js
+# from its CDN) is at most about 2 * 1000 * (200 + 60) = 520k characters.
+# The Zipf stats JSON the app also reads holds only scalars; the data to
+# remake the figure, which grows with the vocabulary, is cached apart (see
+# Zipf.get_fig_data), and only read when the figure has to be remade.
+
+
+def fit_discrete_power_law(count_values, count_freqs,
+                           block_size=FIT_BLOCK_SIZE):
+    """
+    Fits a discrete power law to data given as a histogram, as
+    powerlaw.Fit(data, discrete=True) does for the full data:
+    For each candidate xmin (every value but the largest), alpha is the
+    approximate discrete MLE over the tail of values >= xmin,
+    alpha = 1 + n / sum(log(x / (xmin - 0.5))), and the KS distance is
+    between the tail's empirical CDF and the fitted CDF at the tail's values.
+    The xmin with the smallest KS distance is chosen (Clauset et al., 2009).
+    The tail sizes and sums of logs of all the candidates come from reverse
+    cumulative sums over the histogram; the KS distances are computed for
+    blocks of candidates at a time, so each is not a pass over the data.
+    :param count_values: The sorted unique values (e.g., the word counts).
+    :param count_freqs: How many times each value occurs.
+    :return: dict of the "alpha", "xmin" and "ks_distance" of the fit.
+    """
+    count_values = np.asarray(count_values, dtype=float)
+    count_freqs = np.asarray(count_freqs, dtype=float)
+    num_values = len(count_values)
+    if num_values < 2:
+        logs.warning("Less than 2 unique values; can't fit a power law.")
+        return {"alpha": np.nan, "xmin": np.nan, "ks_distance": np.nan}
+    # Number of data points below each value, and in each value's tail.
+    num_below = np.concatenate([[0.0], np.cumsum(count_freqs)[:-1]])
+    tail_sizes = np.cumsum(count_freqs[::-1])[::-1]
+    tail_log_sums = np.cumsum((count_freqs * np.log(count_values))[::-1])[
+                    ::-1]
+    # The largest value isn't a candidate: There are at least 2 tail values.
+    xmins = count_values[:-1]
+    alphas = 1 + tail_sizes[:-1] / (
+            tail_log_sums[:-1] - tail_sizes[:-1] * np.log(xmins - 0.5))
+    ks_distances = np.zeros(num_values - 1)
+    block_rows = max(1, block_size // num_values)
+    for start in range(0, num_values - 1, block_rows):
+        end = min(start + block_rows, num_values - 1)
+        block_alphas = alphas[start:end, np.newaxis]
+        # [candidates x values from the first candidate's xmin on]
+        values = count_values[np.newaxis, start:]
+        zeta_xmins = zeta(block_alphas, xmins[start:end, np.newaxis])
+        with np.errstate(divide="ignore", invalid="ignore",
+                         over="ignore"):
+            fitted_cdfs = 1 - zeta(block_alphas, values) / zeta_xmins
+        # Without the accuracy for the tail, its CDF is all ones.
+        fitted_cdfs = np.where(zeta_xmins == 0, 1.0, fitted_cdfs)
+        empirical_cdfs = (num_below[np.newaxis, start:] -
+                          num_below[start:end, np.newaxis]) / \
+                         tail_sizes[start:end, np.newaxis]
+        cdf_diffs = np.abs(fitted_cdfs - empirical_cdfs)
+        # Only the values in each candidate's tail.
+        in_tail = np.arange(start, num_values)[np.newaxis, :] >= \
+                  np.arange(start, end)[:, np.newaxis]
+        ks_distances[start:end] = np.where(in_tail, cdf_diffs, 0).max(axis=1)
+    best = int(np.argmin(ks_distances))
+    return {"alpha": float(alphas[best]), "xmin": float(xmins[best]),
+            "ks_distance": float(ks_distances[best])}
+
+
+def log_binned_pdf(count_values, count_freqs):
+    """
+    Normalized histogram of data given as a histogram, in the logarithmic
+    bins of powerlaw.pdf.
+    """
+    xmin = count_values[0]
+    xmax = count_values[-1]
+    number_of_bins = ceil((log10(xmax) - log10(xmin)) * 10)
+    bins = np.logspace(log10(xmin), log10(xmax), num=number_of_bins)
+    bins[:-1] = np.floor(bins[:-1])
+    bins[-1] = np.ceil(bins[-1])
+    bins = np.unique(bins)
+    pdf, _ = np.histogram(count_values, bins, weights=count_freqs,
+                          density=True)
+    return pdf
+
+
+def _bootstrap_ks_distance(seed, fit, body_values, body_freqs, num_points):
+    """
+    KS distance of the fit of one synthetic dataset, of num_points values
+    drawn as in Clauset et al. (2009): Each value is from the fitted power law
+    with the probability of a value being in the observed tail, and from the
+    observed values below xmin otherwise.
+    :param seed: numpy SeedSequence of this replicate.
+    :param fit: The fit of the observed data (see fit_discrete_power_law).
+    :param body_values: The observed unique values below xmin.
+    :param body_freqs: How many times each of them occurs.
+    :param num_points: Number of observed values.
+    """
+    rng = np.random.default_rng(seed)
+    num_tail = rng.binomial(num_points,
+                            1 - body_freqs.sum() / num_points)
+    # Discrete power law values, by rounding continuous ones (Clauset et al.,
+    # 2009, Appendix D), as the powerlaw package does.
+    tail = np.floor((fit["xmin"] - 0.5) * (1 - rng.random(num_tail)) ** (
+            -1 / (fit["alpha"] - 1)) + 0.5)
+    body = np.zeros(0)
+    if num_tail < num_points:
+        body = rng.choice(body_values, size=num_points - num_tail,
+                          p=body_freqs / body_freqs.sum())
+    count_values, count_freqs = np.unique(np.concatenate([body, tail]),
+                                          return_counts=True)
+    return fit_discrete_power_law(count_values, count_freqs)["ks_distance"]
+
+
+def bootstrap_p_value(count_values, count_freqs, fit,
+                      num_replicates=BOOTSTRAP_REPLICATES, seed=None,
+                      num_proc=None):
+    """
+    Semi-parametric bootstrap goodness-of-fit test of a power law fit
+    (Clauset et al., 2009): The fraction of synthetic datasets drawn from the
+    fit whose own fit has a KS distance at least the observed one. Small
+    values (e.g., < 0.1) rule the power law out.
+    :param count_values: The sorted unique observed values.
+    :param count_freqs: How many times each value occurs.
+    :param fit: Their fit (see fit_discrete_power_law).
+    :param num_replicates: Number of synthetic datasets.
+    :param seed: Seed of the random draws, for reproducible p-values.
+    :param num_proc: Number of processes fitting the synthetic datasets;
+    None means work serially.
+    """
+    in_body = count_values < fit["xmin"]
+    fit_replicate = partial(_bootstrap_ks_distance, fit=fit,
+                            body_values=count_values[in_body],
+                            body_freqs=count_freqs[in_body],
+                            num_points=int(count_freqs.sum()))
+    # Independent random streams for the replicates, whichever process
+    # draws them.
+    seeds = np.random.SeedSequence(seed).spawn(num_replicates)
+    logs.info("Fitting %s bootstrap replicates." % num_replicates)
+    if num_proc is not None and num_proc > 1:
+        with Pool(num_proc) as pool:
+            ks_distances = pool.map(fit_replicate, seeds)
+    else:
+        ks_distances = [fit_replicate(replicate_seed) for replicate_seed in
+                        seeds]
+    return float(np.mean(np.asarray(ks_distances) >= fit["ks_distance"]))
+
 
 class Zipf:
     def __init__(self, vocab_counts_df, count_str="count",
@@ -43,9 +203,15 @@ class Zipf:
         self.xmax = None
         self.p = None
         self.ks_distance = None
+        # p-value of the bootstrap goodness-of-fit test, when it was run.
+        self.bootstrap_p = None
+        self.bootstrap_replicates = None
         self.observed_counts = None
         self.word_counts_unique = None
         self.word_ranks_unique = None
+        # The words with each of the unique counts (see
+        # make_unique_rank_word_list), for the figure hovertext.
+        self.ranked_words = None
         if self.vocab_counts_df is not None:
             self.observed_counts = self.vocab_counts_df[self.cnt_str].values
             self.word_counts_unique = list(set(self.observed_counts))
@@ -53,8 +219,8 @@ class Zipf:
                 np.arange(1, len(self.word_counts_unique) + 1))
         self.zipf_dict = {"xmin": None, "xmax": None, "alpha": None,
                           "ks_distance": None, "p-value": None,
-                          "word_ranks_unique": self.word_ranks_unique,
-                          "word_counts_unique": self.word_counts_unique}
+                          "bootstrap p-value": None,
+                          "bootstrap replicates": None}
         self.fit = None
         self.predicted_counts = None
 
@@ -65,24 +231,59 @@ class Zipf:
         self.alpha = zipf_dict["alpha"]
         self.ks_distance = zipf_dict["ks_distance"]
         self.p = zipf_dict["p-value"]
-        self.word_ranks_unique = zipf_dict["word_ranks_unique"]
-        self.word_counts_unique = zipf_dict["word_counts_unique"]
+        # Not in the results cached before there was a bootstrap test.
+        self.bootstrap_p = zipf_dict.get("bootstrap p-value")
+        self.bootstrap_replicates = zipf_dict.get("bootstrap replicates")
+
+    def get_fig_data(self):
+        """
+        The data only needed to (re)make the figure, cached apart from the
+        stats, so that loading the stats doesn't read the whole vocabulary.
+        With the stats, it's all make_zipf_fig needs: neither the vocabulary
+        nor the fit are needed to remake the figure.
+        """
+        num_ranks = len(self.word_ranks_unique)
+        predicted_counts = None
+        if self.predicted_counts is not None:
+            predicted_counts = [int(count) for count in self.predicted_counts]
+        return {"word_counts_unique": [int(count) for count in
+                                       self.word_counts_unique],
+                "word_ranks_unique": [int(rank) for rank in
+                                      self.word_ranks_unique],
+                "ranked_words": make_unique_rank_word_list(self),
+                # The figure only shows the counts of the first words, one
+                # per rank.
+                "observed_counts": [int(count) for count in
+                                    self.observed_counts[:num_ranks]],
+                "predicted_counts": predicted_counts}
+
+    def load_fig_data(self, fig_data):
+        self.word_counts_unique = fig_data["word_counts_unique"]
+        self.word_ranks_unique = fig_data["word_ranks_unique"]
+        self.ranked_words = fig_data["ranked_words"]
+        self.observed_counts = np.asarray(fig_data["observed_counts"])
+        if fig_data["predicted_counts"] is not None:
+            self.predicted_counts = np.asarray(fig_data["predicted_counts"])
 
     def get_zipf_dict(self):
+        if self.alpha is None:
+            # There's no fit.
+            return {"xmin": None, "xmax": None, "alpha": None,
+                    "ks_distance": None, "p-value": None,
+                    "bootstrap p-value": None, "bootstrap replicates": None}
         zipf_dict = {"xmin": int(self.xmin), "xmax": int(self.xmax),
                      "alpha": float(self.alpha),
                      "ks_distance": float(self.ks_distance),
                      "p-value": float(self.ks_test.pvalue),
-                     "word_counts_unique": [int(count) for count in
-                                            self.word_counts_unique],
-                     "word_ranks_unique": [int(rank) for rank in
-                                           self.word_ranks_unique]}
+                     "bootstrap p-value": self.bootstrap_p,
+                     "bootstrap replicates": self.bootstrap_replicates}
         return zipf_dict
 
     def calc_fit(self):
         """
-        Uses the powerlaw package to fit the observed frequencies
-        to a zipfian distribution.
+        Fits the observed frequencies to a zipfian distribution, as the
+        powerlaw package does (see fit_discrete_power_law), but from the
+        counts of the word counts rather than from every word's count.
         We use the KS-distance to fit, as that seems more appropriate that MLE.
         """
         logs.info("Fitting based on input vocab counts.")
@@ -90,33 +291,59 @@ class Zipf:
         self._make_rank_column()
         # Note another method for determining alpha might be defined by
         # (Newman, 2005): alpha = 1 + n * sum(ln( xi / xmin )) ^ -1
-        self.fit = powerlaw.Fit(self.observed_counts, fit_method="KS",
-                                discrete=True)
-        # This should probably be a pmf (not pdf); using discrete=True above.
-        # original_data=False uses only the fitted data (within xmin and xmax).
-        # pdf_bin_edges: The portion of the data within the bin.
+        count_values, count_freqs = np.unique(
+            self.observed_counts[self.observed_counts > 0],
+            return_counts=True)
+        self.fit = fit_discrete_power_law(count_values, count_freqs)
+        if np.isnan(self.fit["alpha"]):
+            logs.warning("Fewer than 2 distinct word counts; there's no Zipf "
+                         "fit.")
+            return
+        # The fitted data: The counts within xmin and xmax.
+        in_fit = count_values >= self.fit["xmin"]
+        # This should probably be a pmf (not pdf).
         # observed_pdf: The probability density function (normalized histogram)
         # of the data.
-        pdf_bin_edges, observed_pdf = self.fit.pdf(original_data=False)
-        # See the 'Distribution' class described here for info:
-        # https://pythonhosted.org/powerlaw/#powerlaw.Fit.pdf
-        theoretical_distro = self.fit.power_law
-        # The probability density function (normalized histogram) of the
-        # theoretical distribution.
-        predicted_pdf = theoretical_distro.pdf()
-        self._set_fit_vars(observed_pdf, predicted_pdf, theoretical_distro)
-
-    def _set_fit_vars(self, observed_pdf, predicted_pdf, theoretical_distro):
+        observed_pdf = log_binned_pdf(count_values[in_fit], count_freqs[in_fit])
+        # The probability density function of the theoretical distribution,
+        # at each fitted data point.
+        predicted_pdf = np.repeat(
+            count_values[in_fit] ** -self.fit["alpha"] /
+            zeta(self.fit["alpha"], self.fit["xmin"]), count_freqs[in_fit])
+        self._set_fit_vars(observed_pdf, predicted_pdf, self.fit)
+
+    def calc_bootstrap_p(self, num_replicates=BOOTSTRAP_REPLICATES, seed=None,
+                         num_proc=None):
+        """
+        Tests the goodness of the fit with a bootstrap (see
+        bootstrap_p_value); much slower than the fit itself, and more
+        reliable than its KS test p-value.
+        """
+        if self.fit is None:
+            self.calc_fit()
+        if np.isnan(self.fit["alpha"]):
+            logs.warning("No fit to test.")
+            return
+        count_values, count_freqs = np.unique(
+            self.observed_counts[self.observed_counts > 0],
+            return_counts=True)
+        self.bootstrap_p = bootstrap_p_value(count_values, count_freqs,
+                                             self.fit,
+                                             num_replicates=num_replicates,
+                                             seed=seed, num_proc=num_proc)
+        self.bootstrap_replicates = num_replicates
+        logs.info("Bootstrap p-value: %s" % self.bootstrap_p)
+
+    def _set_fit_vars(self, observed_pdf, predicted_pdf, fit):
         # !!!! CRITICAL VALUE FOR ZIPF !!!!
-        self.alpha = theoretical_distro.alpha
+        self.alpha = fit["alpha"]
         # Exclusive xmin: The optimal xmin *beyond which* the scaling regime of
         # the power law fits best.
-        self.xmin = int(theoretical_distro.xmin)
-        self.xmax = theoretical_distro.xmax
-        # Can be None if there isn't an xmax returned;
-        # this handles that.
+        self.xmin = int(fit["xmin"])
+        # There's no xmax in the fit; this sets it.
+        self.xmax = None
         self._set_xmax()
-        self.ks_distance = theoretical_distro.KS()
+        self.ks_distance = fit["ks_distance"]
         self.ks_test = ks_2samp(observed_pdf, predicted_pdf)
         self.p = self.ks_test[1]
         logs.info("KS test:")
@@ -187,30 +414,89 @@ def get_zipf_fids(cache_path):
     return zipf_fid, zipf_fig_fid, zipf_fig_html_fid
 
 
+def get_zipf_fig_data_fid(cache_path):
+    """Cache file of the data to remake the figure (see Zipf.get_fig_data)."""
+    return pjoin(cache_path, "zipf", "zipf_fig_data.json")
+
+
 def make_unique_rank_word_list(z):
     """
-    Function to help with the figure, creating strings for the hovertext.
+    Function to help with the figure, creating strings for the hovertext:
+    The comma-separated words with each of the unique counts, in the order of
+    z.word_counts_unique. They are grouped in one pass over the vocabulary,
+    and cached with the figure data (see Zipf.get_fig_data), so they're only
+    grouped once.
     """
-    ranked_words = {}
-    word_counts = z.word_counts_unique
-    word_ranks = z.word_ranks_unique
-    for count, rank in zip(word_counts, word_ranks):
-        z.vocab_counts_df[z.vocab_counts_df[z.cnt_str] == count]["rank"] = rank
-        ranked_words[rank] = ",".join(
-            z.vocab_counts_df[
-                z.vocab_counts_df[z.cnt_str] == count].index.astype(str)
-        )  # Use the hovertext kw argument for hover text
-    ranked_words_list = [wrds for rank, wrds in
-                         sorted(ranked_words.items())]
-    return ranked_words_list
+    if z.ranked_words is None:
+        words = z.vocab_counts_df.index.astype(str).to_series(index=None)
+        words_by_count = words.groupby(
+            z.vocab_counts_df[z.cnt_str].to_numpy(), sort=False).agg(",".join)
+        z.ranked_words = [words_by_count[count] for count in
+                          z.word_counts_unique]
+    return z.ranked_words
 
 
-def make_zipf_fig(z):
+def truncate_hover_words(words, max_words=MAX_HOVER_WORDS,
+                         max_chars=MAX_HOVER_CHARS):
+    """
+    Shortens a hovertext list of words to its first max_words words (and
+    max_chars characters), saying how many more there are.
+    """
+    words = words.split(",")
+    hovertext = ",".join(words[:max_words])[:max_chars]
+    if len(words) > max_words or len(hovertext) < len(",".join(words)):
+        hovertext += "... (%s words)" % len(words)
+    return hovertext
+
+
+def bin_ranks(word_ranks, observed_counts, zipf_counts, ranked_words,
+              max_points=MAX_FIG_POINTS):
+    """
+    Puts the ranks of the figure in at most max_points log-spaced bins: The
+    first ranks, which Zipf's law is about, stay one per bin; the long tail
+    of rare ranks is summarized.
+    :return: (the first rank of each bin, the mean observed and predicted
+    counts of its ranks, and the hovertext of its words)
+    """
+    num_ranks = len(word_ranks)
+    bin_starts = np.unique(np.floor(
+        np.logspace(0, np.log10(num_ranks), num=max_points,
+                    endpoint=False)).astype(int) - 1)
+    bin_sizes = np.diff(np.append(bin_starts, num_ranks))
+    observed_means = np.add.reduceat(
+        np.asarray(observed_counts[:num_ranks], dtype=float),
+        bin_starts) / bin_sizes
+    zipf_means = np.add.reduceat(np.asarray(zipf_counts, dtype=float),
+                                 bin_starts) / bin_sizes
+    hovertext = [truncate_hover_words(",".join(ranked_words[start:end]))
+                 for start, end in zip(bin_starts, bin_starts + bin_sizes)]
+    first_ranks = [word_ranks[start] for start in bin_starts]
+    return first_ranks, observed_means, zipf_means, hovertext
+
+
+def make_zipf_fig(z, max_points=MAX_FIG_POINTS):
+    """
+    Figure of the observed and the predicted word counts by rank.
+    :param max_points: Most bars in the figure; with more ranks, they are
+    log-binned (see bin_ranks). None keeps every rank.
+    """
+    if z.alpha is None:
+        return go.Figure(layout=go.Layout(
+            title_text="Too few distinct word counts to fit Zipf's law"))
     xmin = z.xmin
     word_ranks_unique = z.word_ranks_unique
     observed_counts = z.observed_counts
     zipf_counts = z.predicted_counts  # "] #self.calc_zipf_counts()
     ranked_words_list = make_unique_rank_word_list(z)
+    if max_points is not None and len(word_ranks_unique) > max_points:
+        logs.info("Binning the %s ranks of the Zipf figure." %
+                  len(word_ranks_unique))
+        word_ranks_unique, observed_counts, zipf_counts, ranked_words_list = \
+            bin_ranks(word_ranks_unique, observed_counts, zipf_counts,
+                      ranked_words_list, max_points=max_points)
+        # The fit is drawn from the bin of the first rank beyond xmin.
+        xmin = int(np.searchsorted(word_ranks_unique, xmin + 1,
+                                   side="right") - 1)
     layout = go.Layout(xaxis=dict(range=[0, 100]))
     fig = go.Figure(
         data=[
@@ -52,9 +52,6 @@ np.seterr(divide="ignore")
 # treating inf values as NaN as well
 pd.set_option("use_inf_as_na", True)
 
-# This can be changed to whatever a person likes;
-# it is the number of batches to use when iterating through the vocabulary.
-_NUM_BATCHES = 500
 PROP = "proportion"
 CNT = "count"
 
@@ -91,8 +88,8 @@ class nPMI(evaluate.Measurement):
         self.vocab_counts_df = vocab_counts_df
         self.vocab_counts_df[PROP] = vocab_counts_df[CNT] / sum(
             vocab_counts_df[CNT])
-        # self.mlb_list holds num batches x num_sentences
-        self.mlb_list = []
+        # Sparse binary matrix of # sentences x # words
+        self.sentence_matrix = None
         # Index of the subgroup word in the sparse vector
         subgroup_idx = vocab_counts_df.index.get_loc(subgroup)
         print("Calculating co-occurrences...")
@@ -108,61 +105,22 @@ class nPMI(evaluate.Measurement):
 
     def _binarize_words_in_sentence(self):
         print("Creating co-occurrence matrix for PMI calculations.")
-        batches = np.linspace(0, len(self.references), _NUM_BATCHES).astype(int)
-        i = 0
-        # Creates list of size (# batches x # sentences)
-        while i < len(batches) - 1:
-            # Makes a sparse matrix (shape: # sentences x # words),
-            # with the occurrence of each word per sentence.
-            mlb = MultiLabelBinarizer(classes=self.vocab_counts_df.index)
-            print(
-                "%s of %s sentence binarize batches." % (
-                str(i), str(len(batches)))
-            )
-            # Returns series: batch size x num_words
-            mlb_series = mlb.fit_transform(
-                self.references[batches[i]:batches[i + 1]]
-            )
-            i += 1
-            self.mlb_list.append(mlb_series)
+        # Makes a sparse matrix (shape: # sentences x # words),
+        # with the occurrence of each word per sentence.
+        mlb = MultiLabelBinarizer(classes=self.vocab_counts_df.index,
+                                  sparse_output=True)
+        # Columns are sliced for the subgroups.
+        self.sentence_matrix = mlb.fit_transform(self.references).tocsc()
 
     def calc_cooccurrences(self, subgroup, subgroup_idx):
-        initialize = True
-        coo_df = None
-        # Big computation here!  Should only happen once.
-        print(
-            "Approaching big computation! Here, we binarize all words in the sentences, making a sparse matrix of sentences."
-        )
-        if not self.mlb_list:
+        if self.sentence_matrix is None:
             self._binarize_words_in_sentence()
-        for batch_id in range(len(self.mlb_list)):
-            print(
-                "%s of %s co-occurrence count batches"
-                % (str(batch_id), str(len(self.mlb_list)))
-            )
-            # List of all the sentences (list of vocab) in that batch
-            batch_sentence_row = self.mlb_list[batch_id]
-            # Dataframe of # sentences in batch x vocabulary size
-            sent_batch_df = pd.DataFrame(batch_sentence_row)
-            # Subgroup counts per-sentence for the given batch
-            subgroup_df = sent_batch_df[subgroup_idx]
-            subgroup_df.columns = [subgroup]
-            # Remove the sentences where the count of the subgroup is 0.
-            # This way we have less computation & resources needs.
-            subgroup_df = subgroup_df[subgroup_df > 0]
-            mlb_subgroup_only = sent_batch_df[sent_batch_df[subgroup_idx] > 0]
-            # Create cooccurrence matrix for the given subgroup and all words.
-            batch_coo_df = pd.DataFrame(mlb_subgroup_only.T.dot(subgroup_df))
-
-            # Creates a batch-sized dataframe of co-occurrence counts.
-            # Note these could just be summed rather than be batch size.
-            if initialize:
-                coo_df = batch_coo_df
-            else:
-                coo_df = coo_df.add(batch_coo_df, fill_value=0)
-            initialize = False
+        # Number of sentences with both the subgroup and each word, from one
+        # sparse product: X^T X[:, subgroup_idx]
+        subgroup_col = self.sentence_matrix[:, [subgroup_idx]]
+        coo_counts = self.sentence_matrix.T @ subgroup_col
         print("Returning co-occurrence matrix")
-        return pd.DataFrame(coo_df)
+        return pd.DataFrame(np.asarray(coo_counts.todense()).ravel())
 
     def set_idx_cols(self, df_coo, subgroup):
         """
@@ -210,9 +168,7 @@ class nPMI(evaluate.Measurement):
         p_word_g_subgroup = vocab_cooc_df[subgroup + "-count"] / sum(
             vocab_cooc_df[subgroup + "-count"]
         )
-        p_word = pmi_df.apply(
-            lambda x: self.vocab_counts_df.loc[x.name][PROP], axis=1
-        )
+        p_word = self.vocab_counts_df.loc[pmi_df.index, PROP]
         normalize_pmi = -np.log(p_word_g_subgroup * p_word)
         npmi_df = pd.DataFrame()
         npmi_df[subgroup + "-npmi"] = pmi_df[subgroup + "-pmi"] / normalize_pmi
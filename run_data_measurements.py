@@ -7,7 +7,10 @@ import smtplib
 import ssl
 import sys
 import textwrap
-from data_measurements import dataset_statistics
+from data_measurements import dataset_statistics, scheduler, sharding
+from data_measurements.npmi.npmi import MEASURES, NPMI_MEASURE
+from data_measurements.tokenize import BATCH_SIZE, PYTHON_BACKEND, \
+    TOKENIZER_BACKENDS
 from data_measurements.zipf import zipf
 from huggingface_hub import create_repo, Repository, hf_api
 from os import getenv
@@ -19,7 +22,8 @@ from utils import dataset_utils
 logs = utils.prepare_logging(__file__)
 
 def load_or_prepare_widgets(ds_args, show_embeddings=False,
-                            show_perplexities=False, use_cache=False):
+                            show_perplexities=False, use_cache=False,
+                            num_workers=1):
     """
     Loader specifically for the widgets used in the app.
     Args:
@@ -27,6 +31,7 @@ def load_or_prepare_widgets(ds_args, show_embeddings=False,
         show_embeddings:
         show_perplexities:
         use_cache:
+        num_workers: Number of measurements to compute at the same time.
 
     Returns:
 
@@ -34,81 +39,75 @@ def load_or_prepare_widgets(ds_args, show_embeddings=False,
     dstats = dataset_statistics.DatasetStatisticsCacheClass(**ds_args, use_cache=use_cache)
     # Header widget
     dstats.load_or_prepare_dset_peek()
-    # General stats widget
-    dstats.load_or_prepare_general_stats()
-    # Labels widget
-    dstats.load_or_prepare_labels()
-    # Text lengths widget
-    dstats.load_or_prepare_text_lengths()
+    # General stats, labels, text lengths, text duplicates, nPMI and Zipf
+    # widgets, and the collocations widget, which the app also shows
+    measurements = list(scheduler.DEFAULT_MEASUREMENTS) + [
+        scheduler.COLLOCATIONS]
     if show_embeddings:
         # Embeddings widget
-        dstats.load_or_prepare_embeddings()
+        measurements += [scheduler.EMBEDDINGS]
     if show_perplexities:
         # Text perplexities widget
-        dstats.load_or_prepare_text_perplexities()
-    # Text duplicates widget
-    dstats.load_or_prepare_text_duplicates()
-    # nPMI widget
-    dstats.load_or_prepare_npmi()
-     # Zipf widget
-    dstats.load_or_prepare_zipf()
+        measurements += [scheduler.PERPLEXITIES]
+    dmt_scheduler = scheduler.get_dmt_scheduler(dstats,
+                                                num_workers=num_workers)
+    dmt_scheduler.run(measurements)
 
 
-def load_or_prepare(dataset_args, calculation=False, use_cache=False):
-    # TODO: Catch error exceptions for each measurement, so that an error
-    # for one measurement doesn't break the calculation of all of them.
-
-    do_all = False
+def load_or_prepare(dataset_args, calculation=False, use_cache=False,
+                    num_workers=1, check_sharding=False):
+    # Each measurement is computed with only the prerequisites it needs
+    # (e.g., labels don't need the tokenized text or the vocab);
+    # an error for one measurement doesn't break the calculation of the others.
     dstats = dataset_statistics.DatasetStatisticsCacheClass(**dataset_args,
                                                             use_cache=use_cache)
-    logs.info("Tokenizing dataset.")
-    dstats.load_or_prepare_tokenized_df()
-    logs.info("Calculating vocab.")
-    dstats.load_or_prepare_vocab()
-
     if not calculation:
-        do_all = True
-
-    if do_all or calculation == "general":
-        logs.info("\n* Calculating general statistics.")
-        dstats.load_or_prepare_general_stats()
-        logs.info("Done!")
+        measurements = list(scheduler.DEFAULT_MEASUREMENTS)
+    else:
+        measurements = [calculation]
+    if dstats.label_field not in dstats.get_dset_features():
+        for label_measurement in [scheduler.LABELS, scheduler.LABEL_NPMI]:
+            if label_measurement in measurements:
+                logs.warning("No label field found.")
+                logs.info("No label statistics to calculate.")
+                measurements.remove(label_measurement)
+    dmt_scheduler = scheduler.get_dmt_scheduler(dstats,
+                                                num_workers=num_workers)
+    failed = dmt_scheduler.run(measurements)
+    measurements = [measurement for measurement in measurements if
+                    measurement not in failed]
+
+    if scheduler.GENERAL in measurements:
         logs.info(
             "Basic text statistics now available at %s." % dstats.general_stats_json_fid)
 
-    if do_all or calculation == "duplicates":
-        logs.info("\n* Calculating text duplicates.")
-        dstats.load_or_prepare_text_duplicates()
+    if scheduler.DUPLICATES in measurements:
         duplicates_fid_dict = dstats.duplicates_files
         logs.info("If all went well, then results are in the following files:")
         for key, value in duplicates_fid_dict.items():
             logs.info("%s: %s" % (key, value))
 
-    if do_all or calculation == "lengths":
-        logs.info("\n* Calculating text lengths.")
-        dstats.load_or_prepare_text_lengths()
+    if scheduler.LENGTHS in measurements:
         length_fid_dict = dstats.length_obj.get_filenames()
         print("If all went well, then results are in the following files:")
         for key, value in length_fid_dict.items():
             print("%s: %s" % (key, value))
         print()
 
-    if do_all or calculation == "labels":
-        logs.info("\n* Calculating label statistics.")
-        if dstats.label_field not in dstats.dset.features:
-            logs.warning("No label field found.")
-            logs.info("No label statistics to calculate.")
-        else:
-            dstats.load_or_prepare_labels()
-            npmi_fid_dict = dstats.label_files
-            print("If all went well, then results are in the following files:")
-            for key, value in npmi_fid_dict.items():
-                print("%s: %s" % (key, value))
-            print()
+    if scheduler.LABELS in measurements:
+        npmi_fid_dict = dstats.label_files
+        print("If all went well, then results are in the following files:")
+        for key, value in npmi_fid_dict.items():
+            print("%s: %s" % (key, value))
+        print()
+
+    if scheduler.LABEL_NPMI in measurements:
+        print("If all went well, then results are in the following files:")
+        for key, value in dstats.label_npmi_files.items():
+            print("%s: %s" % (key, value))
+        print()
 
-    if do_all or calculation == "npmi":
-        print("\n* Preparing nPMI.")
-        dstats.load_or_prepare_npmi()
+    if scheduler.NPMI in measurements:
         npmi_fid_dict = dstats.npmi_files
         print("If all went well, then results are in the following files:")
         for key, value in npmi_fid_dict.items():
@@ -120,10 +119,13 @@ def load_or_prepare(dataset_args, calculation=False, use_cache=False):
                 print("%s: %s" % (key, value))
         print()
 
-    if do_all or calculation == "zipf":
-        logs.info("\n* Preparing Zipf.")
-        dstats.load_or_prepare_zipf()
-        logs.info("Done!")
+    if scheduler.COLLOCATIONS in measurements:
+        print("If all went well, then results are in the following files:")
+        for key, value in dstats.collocations_files.items():
+            print("%s: %s" % (key, value))
+        print()
+
+    if scheduler.ZIPF in measurements:
         zipf_json_fid, zipf_fig_json_fid, zipf_fig_html_fid = zipf.get_zipf_fids(
             dstats.dataset_cache_dir)
         logs.info("Zipf results now available at %s." % zipf_json_fid)
@@ -132,17 +134,17 @@ def load_or_prepare(dataset_args, calculation=False, use_cache=False):
             % (zipf_fig_html_fid, zipf_fig_json_fid)
         )
 
-    # Don't do this one until someone specifically asks for it -- takes awhile.
-    if calculation == "embeddings":
-        logs.info("\n* Preparing text embeddings.")
-        dstats.load_or_prepare_embeddings()
-
-    # Don't do this one until someone specifically asks for it -- takes awhile.
-    if calculation == "perplexities":
-        logs.info("\n* Preparing text perplexities.")
-        dstats.load_or_prepare_text_perplexities()
-
-def pass_args_to_DMT(dset_name, dset_config, split_name, text_field, label_field, label_names, calculation, dataset_cache_dir, prepare_gui=False, use_cache=True):
+    if check_sharding:
+        # Shows that the measurements computed on shards in separate
+        # processes and merged match the single-process results.
+        dmt_scheduler.run([scheduler.TOKENIZED, scheduler.VOCAB])
+        checked = sharding.check_sharded_measurements(
+            dstats, num_proc=max(dstats.num_proc or 2, 2))
+        for name, is_equal in checked.items():
+            print("Sharded %s: %s" % (name, "equal" if is_equal else
+                                      "DIFFERENT"))
+
+def pass_args_to_DMT(dset_name, dset_config, split_name, text_field, label_field, label_names, calculation, dataset_cache_dir, prepare_gui=False, use_cache=True, num_proc=None, batch_size=BATCH_SIZE, tokenizer_backend=PYTHON_BACKEND, num_workers=1, fused_scan=False, check_sharding=False, npmi_out_of_core=False, npmi_measure=NPMI_MEASURE, max_rows=dataset_utils._MAX_ROWS, zipf_bootstrap_replicates=0, zipf_bootstrap_seed=0):
     if not use_cache:
         logs.info("Not using any cache; starting afresh")
     dataset_args = {
@@ -152,12 +154,24 @@ def pass_args_to_DMT(dset_name, dset_config, split_name, text_field, label_field
         "text_field": text_field,
         "label_field": label_field,
         "label_names": label_names,
-        "dataset_cache_dir": dataset_cache_dir
+        "dataset_cache_dir": dataset_cache_dir,
+        "num_proc": num_proc,
+        "batch_size": batch_size,
+        "tokenizer_backend": tokenizer_backend,
+        "fused_scan": fused_scan,
+        "npmi_out_of_core": npmi_out_of_core,
+        "npmi_measure": npmi_measure,
+        "max_rows": max_rows,
+        "zipf_bootstrap_replicates": zipf_bootstrap_replicates,
+        "zipf_bootstrap_seed": zipf_bootstrap_seed,
     }
     if prepare_gui:
-        load_or_prepare_widgets(dataset_args, use_cache=use_cache)
+        load_or_prepare_widgets(dataset_args, use_cache=use_cache,
+                                num_workers=num_workers)
     else:
-        load_or_prepare(dataset_args, calculation=calculation, use_cache=use_cache)
+        load_or_prepare(dataset_args, calculation=calculation,
+                        use_cache=use_cache, num_workers=num_workers,
+                        check_sharding=check_sharding)
 
 def set_defaults(args):
     if not args.config:
@@ -213,7 +227,7 @@ def main():
     parser.add_argument(
         "-w",
         "--calculation",
-        help="""What to calculate (defaults to everything except embeddings and perplexities).\n
+        help="""What to calculate (defaults to everything except embeddings, perplexities, label_npmi and collocations).\n
                                                     Options are:\n
 
                                                     - `general` (for duplicate counts, missing values, length statistics.)\n
@@ -224,12 +238,16 @@ def main():
 
                                                     - `labels` for label distribution\n
 
+                                                    - `label_npmi` for the words most associated with each label (opt-in)\n
+
                                                     - `embeddings` (Warning: Slow.)\n
 
                                                     - `perplexities` (Warning: Slow.)\n
 
                                                     - `npmi` for word associations\n
 
+                                                    - `collocations` for the most associated word pairs (opt-in)\n
+
                                                     - `zipf` for zipfian statistics
                                                     """,
     )
@@ -275,10 +293,96 @@ def main():
     parser.add_argument("--keep_local", default=True, required=False,
                         action="store_true",
                         help="Whether to save the data locally.")
+    parser.add_argument(
+        "--num_proc",
+        type=int,
+        default=None,
+        required=False,
+        help="Number of processes to use for the parallelizable calculations, such as tokenization and the nPMI co-occurrence counts (Optional; default is serial)",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=BATCH_SIZE,
+        required=False,
+        help="Number of examples per batch when processing the dataset (Optional)",
+    )
+    parser.add_argument(
+        "--tokenizer_backend",
+        default=PYTHON_BACKEND,
+        choices=TOKENIZER_BACKENDS,
+        required=False,
+        help="Tokenizer implementation: `python` (reference) or `arrow` (pyarrow compute kernels; faster and lighter on large splits). When lowercasing, the arrow tokens are not byte-identical to the python ones for some letters (e.g., a final sigma, or a dotted capital I) (Optional)",
+    )
+    parser.add_argument(
+        "--fused_scan",
+        default=False,
+        required=False,
+        action="store_true",
+        help="Compute the vocab, text lengths, duplicates, label and missing value counts in a single pass over the dataset, rather than a pass for each (Optional)",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of independent measurements (labels, duplicates, lengths, Zipf, nPMI) to compute at the same time, once the data they share is prepared (Optional; default is one at a time)",
+    )
+    parser.add_argument(
+        "--npmi_out_of_core",
+        default=False,
+        required=False,
+        action="store_true",
+        help="Build the corpus on disk and compute the vocab and nPMI from it with bounded memory, for datasets too large to tokenize in memory; use with `-w npmi` (Optional)",
+    )
+    parser.add_argument(
+        "--npmi_measure",
+        default=NPMI_MEASURE,
+        choices=MEASURES,
+        required=False,
+        help="Word association measure of the `npmi` calculation: `npmi` or `pmi`. Both are computed from the same cached co-occurrence counts, so switching doesn't recount them (Optional; default is %s)" % NPMI_MEASURE,
+    )
+    parser.add_argument(
+        "--max_rows",
+        type=int,
+        default=dataset_utils._MAX_ROWS,
+        required=False,
+        help="Number of rows of the dataset to analyze (Optional; default is %s)" % dataset_utils._MAX_ROWS,
+    )
+    parser.add_argument(
+        "--zipf_bootstrap_replicates",
+        type=int,
+        default=0,
+        required=False,
+        help="Number of synthetic datasets to fit in a bootstrap goodness-of-fit test of the Zipf fit, run in --num_proc processes (Optional; default is no test; %s is typical)" % zipf.BOOTSTRAP_REPLICATES,
+    )
+    parser.add_argument(
+        "--zipf_bootstrap_seed",
+        type=int,
+        default=0,
+        required=False,
+        help="Random seed of the Zipf bootstrap test (Optional)",
+    )
+    parser.add_argument(
+        "--check_sharding",
+        default=False,
+        required=False,
+        action="store_true",
+        help="Also compute the mergeable measurements on shards of the dataset in separate processes (--num_proc, at least 2), and check that the merged results equal the single-process results (Optional)",
+    )
+    parser.add_argument(
+        "--cache_format",
+        default=None,
+        choices=dataset_utils.CACHE_FORMATS,
+        required=False,
+        help="Format to cache dataframes in (Optional; defaults to the DMT_CACHE_FORMAT environment variable, or parquet). Existing caches in either format can be read.",
+    )
     orig_args = parser.parse_args()
     args = set_defaults(orig_args)
     logs.info("Proceeding with the following arguments:")
     logs.info(args)
+    if args.cache_format:
+        dataset_utils.set_cache_format(args.cache_format)
     # run_data_measurements.py -d hate_speech18 -c default -s train -f text -w npmi
     if args.email is not None:
         if Path(".env").is_file():
@@ -317,6 +421,17 @@ def main():
             dataset_cache_dir=local_dataset_cache_dir,
             prepare_gui=args.prepare_GUI_data,
             use_cache=args.use_cache,
+            num_proc=args.num_proc,
+            batch_size=args.batch_size,
+            tokenizer_backend=args.tokenizer_backend,
+            num_workers=args.num_workers,
+            fused_scan=args.fused_scan,
+            check_sharding=args.check_sharding,
+            npmi_out_of_core=args.npmi_out_of_core,
+            npmi_measure=args.npmi_measure,
+            max_rows=args.max_rows,
+            zipf_bootstrap_replicates=args.zipf_bootstrap_replicates,
+            zipf_bootstrap_seed=args.zipf_bootstrap_seed,
         )
         if args.push_cache_to_hub:
             repo.push_to_hub(commit_message="Added dataset cache.")
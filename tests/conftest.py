@@ -0,0 +1,6 @@
+import sys
+from os.path import abspath, dirname
+
+# The tests import the tool's packages (data_measurements, utils) as the
+# scripts do, from the root of the repository.
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
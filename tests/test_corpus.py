@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from collections import Counter
+
+from data_measurements.corpus import Corpus
+from data_measurements.npmi.npmi import (count_cooccurrences,
+                                         make_sentence_matrix)
+from data_measurements.postings import Postings
+
+SENTENCES = [("the", "cat", "sat"), ("the", "dog", "sat", "the"), (),
+             ("a", "cat", "and", "a", "dog"), ("she", "sat"), ("he", "ran"),
+             ("she", "and", "he", "ran")]
+
+
+def test_corpus_from_tokenized():
+    corpus = Corpus.from_tokenized(SENTENCES)
+    assert corpus.vocab == sorted({word for sentence in SENTENCES for word in
+                                   sentence})
+    assert corpus.num_sentences == len(SENTENCES)
+    assert corpus.sentence_lengths().tolist() == [len(sentence) for sentence
+                                                  in SENTENCES]
+    for i, sentence in enumerate(SENTENCES):
+        assert [corpus.vocab[word_id] for word_id in corpus.token_ids[
+            corpus.offsets[i]:corpus.offsets[i + 1]]] == list(sentence)
+    word_counts = Counter(word for sentence in SENTENCES for word in sentence)
+    assert corpus.word_counts().tolist() == [word_counts[word] for word in
+                                             corpus.vocab]
+
+
+def test_corpus_on_disk_matches_in_memory(tmp_path):
+    corpus = Corpus.from_tokenized(SENTENCES)
+    batches = [SENTENCES[start:start + 3] for start in range(0, 7, 3)]
+    disk_corpus = Corpus.build_on_disk(batches, str(tmp_path / "corpus"))
+    assert Corpus.exists(str(tmp_path / "corpus"))
+    assert disk_corpus.vocab == corpus.vocab
+    assert np.array_equal(disk_corpus.token_ids, corpus.token_ids)
+    assert np.array_equal(disk_corpus.offsets, corpus.offsets)
+    corpus.save(str(tmp_path / "saved"))
+    loaded = Corpus.load(str(tmp_path / "saved"))
+    assert loaded.vocab == corpus.vocab
+    assert np.array_equal(loaded.token_ids, corpus.token_ids)
+
+
+@pytest.mark.parametrize("start, end", [(0, None), (1, 4)])
+def test_corpus_csr_matches_sentence_matrix(start, end):
+    corpus = Corpus.from_tokenized(SENTENCES)
+    # Another vocabulary order, without some of the words.
+    vocabulary = ["she", "he", "the", "sat", "cat", "dog", "ran"]
+    expected = make_sentence_matrix(SENTENCES[start:end], vocabulary)
+    matrix = corpus.to_csr(vocabulary=vocabulary, binary=True, start=start,
+                           end=end)
+    assert (matrix != expected).nnz == 0
+
+
+def test_postings():
+    corpus = Corpus.from_tokenized(SENTENCES)
+    postings = Postings.from_corpus(corpus)
+    assert "cat" in postings and "bird" not in postings
+    assert postings.get("the").tolist() == [0, 1]
+    assert postings.get("bird").tolist() == []
+    assert postings.doc_freq("sat") == 3
+    assert postings.doc_freqs().tolist() == [
+        sum(word in sentence for sentence in SENTENCES) for word in
+        corpus.vocab]
+
+
+def test_postings_cooccurrences_match_matrix_product(tmp_path):
+    corpus = Corpus.from_tokenized(SENTENCES)
+    postings = Postings.from_corpus(corpus)
+    postings.save(str(tmp_path))
+    postings = Postings.load(str(tmp_path))
+    vocabulary = ["she", "he", "the", "sat", "cat", "dog", "ran", "and"]
+    terms = ["she", "he"]
+    expected = count_cooccurrences(make_sentence_matrix(SENTENCES, vocabulary),
+                                   [vocabulary.index(term) for term in terms])
+    assert np.array_equal(postings.cooccurrences(terms, corpus, vocabulary),
+                          expected)
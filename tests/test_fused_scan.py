@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+from datasets import Dataset
+
+from data_measurements.fused_scan import FusedScan
+from data_measurements.lengths.lengths import Lengths
+from data_measurements.tokenize import (ARROW_BACKEND, PYTHON_BACKEND,
+                                        Tokenize)
+from utils.dataset_utils import TEXT_FIELD, TOKENIZED_FIELD
+
+TEXTS = ["The cat sat.", "Ünïcode text, with ümlauts", "The cat sat.", "",
+         "a b c d e f", "日本語のテキスト"]
+
+
+@pytest.mark.parametrize("backend", [PYTHON_BACKEND, ARROW_BACKEND])
+def test_scan_lengths_match_tokenized_lengths(backend):
+    dset = Dataset.from_dict({TEXT_FIELD: TEXTS})
+    scan = FusedScan(dset, TEXT_FIELD, batch_size=3, backend=backend).run()
+    assert not hasattr(scan, "texts")
+    tokenized_df = Tokenize(dset, feature=TEXT_FIELD,
+                            tok_feature=TOKENIZED_FIELD, batch_size=3,
+                            backend=backend).get_df()
+    expected = Lengths(dataset=tokenized_df)
+    expected.prepare_lengths()
+    scanned = Lengths(dataset=pd.DataFrame({TEXT_FIELD: TEXTS}),
+                      lengths=scan.lengths,
+                      char_length_counts=scan.char_length_counts,
+                      byte_length_counts=scan.byte_length_counts)
+    scanned.prepare_lengths()
+    assert scanned.length_stats_dict == pytest.approx(
+        expected.length_stats_dict)
+
+
+def test_scan_missing_text_lengths():
+    dset = Dataset.from_dict({TEXT_FIELD: ["ab", None, "é"]})
+    scan = FusedScan(dset, TEXT_FIELD).run()
+    assert scan.text_nan_count == 1
+    assert scan.lengths.tolist() == [1, 0, 1]
+    assert scan.char_length_counts == {2: 1, 0: 1, 1: 1}
+    assert scan.byte_length_counts == {2: 2, 0: 1}
+
+
+def test_scan_empty_split_has_no_duplicates():
+    scan = FusedScan(Dataset.from_dict({TEXT_FIELD: []}), TEXT_FIELD).run()
+    assert scan.get_duplicates_results()["duplicate_fraction"] == 0.0
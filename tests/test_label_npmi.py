@@ -0,0 +1,24 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from data_measurements.label_npmi import label_npmi
+
+
+def test_make_label_matrix_missing_labels():
+    label_matrix, labels = label_npmi.make_label_matrix([0, None, 1])
+    assert labels == [0, 1]
+    assert label_matrix.toarray().tolist() == [[1, 0], [0, 0], [0, 1]]
+
+
+def test_calc_label_npmi_missing_labels():
+    # Sentences x ["a", "b"]; the second sentence has no label.
+    sentence_matrix = csr_matrix(np.array([[1, 0], [1, 1], [0, 1]]))
+    results_df = label_npmi.calc_label_npmi(
+        sentence_matrix, ["x", np.nan, "y"], ["a", "b"],
+        label_names=("x name", "y name"))
+    assert set(results_df[label_npmi.LABEL]) == {"x", "y"}
+    # The label names are only used for the label ids.
+    assert label_npmi.LABEL_NAME not in results_df
+    counts = results_df.set_index(
+        [label_npmi.LABEL, label_npmi.WORD])[label_npmi.COOC_CNT]
+    assert counts.to_dict() == {("x", "a"): 1, ("y", "b"): 1}
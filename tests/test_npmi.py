@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+from collections import Counter
+
+import utils.dataset_utils as ds_utils
+from data_measurements.corpus import Corpus
+from data_measurements.dataset_statistics import calc_p_word
+from data_measurements.npmi import npmi
+from utils.dataset_utils import CNT, TOKENIZED_FIELD
+
+SENTENCES = [("she", "ran", "home"), ("he", "ran"), ("she", "and", "he"),
+             ("the", "cat", "sat"), ("she", "sat")]
+
+
+class Dstats:
+    """The parts of the DatasetStatisticsCacheClass the nPMI helper uses."""
+
+    def __init__(self, cache_dir):
+        word_counts = Counter(word for sentence in SENTENCES for word in
+                              sentence)
+        self.vocab_counts_df = calc_p_word(
+            pd.DataFrame({CNT: pd.Series(word_counts)}))
+        self.tokenized_df = pd.DataFrame({TOKENIZED_FIELD: SENTENCES})
+        self.corpus = None
+        self.num_proc = None
+        self.min_vocab_count = 1
+        self.npmi_out_of_core = False
+        self.dataset_cache_dir = cache_dir
+
+    def register_cache(self, name, version, params=None, depends_on=()):
+        pass
+
+    def is_cache_valid(self, name):
+        return True
+
+    def write_cache_key(self, name):
+        pass
+
+
+@pytest.mark.parametrize("identity_terms", [["she"], ["she", "he"]])
+def test_results_are_loaded_from_cache(tmp_path, monkeypatch, identity_terms):
+    dstats = Dstats(str(tmp_path))
+    helper = npmi.DMTHelper(dstats, identity_terms, use_cache=True)
+    helper.run_DMT_processing()
+    num_pairs = len(npmi.pair_terms(identity_terms))
+    assert len(npmi.group_top_k_views(helper.top_k_df)) == 6 * num_pairs
+
+    def prepare_results(self):
+        raise AssertionError("The cached results weren't used.")
+
+    monkeypatch.setattr(npmi.DMTHelper, "prepare_results", prepare_results)
+    cached = npmi.DMTHelper(dstats, identity_terms, use_cache=True)
+    cached.run_DMT_processing()
+    assert cached.avail_identity_terms == identity_terms
+    assert list(cached.top_k_df.columns) == list(helper.top_k_df.columns)
+    assert len(cached.top_k_df) == len(helper.top_k_df)
+
+
+def test_measures_share_the_counts(tmp_path, monkeypatch):
+    dstats = Dstats(str(tmp_path))
+    identity_terms = ["he", "she"]
+    npmi_helper = npmi.DMTHelper(dstats, identity_terms, use_cache=True)
+    npmi_helper.run_DMT_processing()
+
+    def count_cooccurrences(*args, **kwargs):
+        raise AssertionError("The cached counts weren't used.")
+
+    monkeypatch.setattr(npmi, "count_cooccurrences", count_cooccurrences)
+    pmi_helper = npmi.DMTHelper(dstats, identity_terms, use_cache=True,
+                                measure=npmi.PMI_MEASURE)
+    pmi_helper.run_DMT_processing()
+    assert pmi_helper.terms_fid != npmi_helper.terms_fid
+    # The PMI is the log of p(term|word) / p(term), without the nPMI's
+    # normalization.
+    vocab_counts_df = dstats.vocab_counts_df
+    cooc_counts = npmi_helper.terms_df[npmi.COUNT_COL % "she"]
+    p_she = vocab_counts_df.loc["she", "proportion"]
+    expected = np.log(cooc_counts / vocab_counts_df[CNT] / p_she)
+    pmi_scores = pmi_helper.terms_df[npmi.SCORE_COL % "she"]
+    assert np.allclose(pmi_scores.dropna(),
+                       expected[np.isfinite(expected)].loc[
+                           pmi_scores.dropna().index])
+    assert not np.allclose(
+        npmi_helper.terms_df[npmi.SCORE_COL % "she"].dropna(),
+        pmi_scores.dropna())
+
+
+@pytest.mark.parametrize("measure", npmi.MEASURES)
+def test_out_of_core_matches_in_memory(tmp_path, measure):
+    dstats = Dstats(str(tmp_path))
+    identity_terms = ["he", "she"]
+    corpus = Corpus.from_tokenized(SENTENCES)
+    # The out-of-core results are in the corpus vocab order.
+    vocab_counts_df = calc_p_word(pd.DataFrame(
+        {CNT: corpus.word_counts()}, index=pd.Index(corpus.vocab)))
+    vocab_counts_df = vocab_counts_df.loc[corpus.vocab]
+    assoc_obj = npmi.nPMI(vocab_counts_df, dstats.tokenized_df[
+        TOKENIZED_FIELD], identity_terms, measure=measure)
+    expected = npmi.make_terms_df(assoc_obj.assoc_results_dict, measure)
+    terms_fid = str(tmp_path / measure / "associations.json")
+    npmi.calc_npmi_out_of_core(corpus, identity_terms, terms_fid,
+                               measure=measure,
+                               counts_dir=str(tmp_path / "counts"))
+    terms_df = ds_utils.read_df(terms_fid)
+    for term in identity_terms:
+        assert np.allclose(terms_df[npmi.SCORE_COL % term],
+                           expected[npmi.SCORE_COL % term].reindex(
+                               terms_df.index), equal_nan=True)
+        assert terms_df[npmi.COUNT_COL % term].tolist() == \
+               expected[npmi.COUNT_COL % term].tolist()
+
+
+def test_unknown_measure(tmp_path):
+    with pytest.raises(ValueError):
+        npmi.DMTHelper(Dstats(str(tmp_path)), ["she"], measure="ppmi")
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+from collections import Counter
+
+from data_measurements import sharding
+from data_measurements.corpus import Corpus
+from data_measurements.dataset_statistics import VocabCounts, calc_p_word
+from data_measurements.labels.labels import Labels
+from data_measurements.lengths.lengths import Lengths
+from data_measurements.npmi.npmi import nPMI
+from data_measurements.text_duplicates.text_duplicates import Duplicates
+from utils.dataset_utils import CNT, TEXT_FIELD, TOKENIZED_FIELD
+
+TEXTS = ["she ran home", "he ran", "she and he sat", "the cat sat",
+         "she ran home", "a dog", "he and the dog ran", "",
+         "she sat with the cat", "he ran home"]
+IDENTITY_TERMS = ["she", "he"]
+
+
+@pytest.fixture
+def tokenized_df():
+    return pd.DataFrame({
+        TEXT_FIELD: TEXTS,
+        TOKENIZED_FIELD: [tuple(text.split()) for text in TEXTS],
+        "label": [0, 1, 0, 2, 0, 2, 1, 2, 0, 1]})
+
+
+@pytest.fixture
+def vocab_counts_df(tokenized_df):
+    word_counts = Counter(word for tokens in tokenized_df[TOKENIZED_FIELD] for
+                          word in tokens)
+    return calc_p_word(pd.DataFrame({CNT: pd.Series(word_counts)}))
+
+
+def check_sharded(measurement, data, params=None, finalize_params=None,
+                  num_proc=2):
+    params = params or {}
+    finalize_params = finalize_params or {}
+    merged = sharding.run_sharded(measurement,
+                                  sharding.make_batches(data, 4),
+                                  num_proc=num_proc, **params)
+    single = measurement.partial(sharding.make_batches(data, 1)[0], **params)
+    assert sharding.results_equal(merged, single)
+    merged_results = measurement.finalize(merged, **finalize_params)
+    single_results = measurement.finalize(single, **finalize_params)
+    if measurement is nPMI:
+        assert sharding.results_equal(merged_results.bias_results_dict,
+                                      single_results.bias_results_dict)
+    else:
+        assert sharding.results_equal(merged_results, single_results)
+    return merged_results
+
+
+@pytest.mark.parametrize("num_proc", [None, 2])
+def test_sharded_lengths(tokenized_df, num_proc):
+    merged_results = check_sharded(Lengths, tokenized_df, num_proc=num_proc)
+    lengths_obj = Lengths(tokenized_df)
+    lengths_obj.prepare_lengths()
+    assert sharding.results_equal(merged_results,
+                                  lengths_obj.length_stats_dict)
+
+
+def test_sharded_vocab(tokenized_df, vocab_counts_df):
+    word_count_df = check_sharded(VocabCounts, tokenized_df,
+                                  finalize_params={"doc_freq": True})
+    assert word_count_df[CNT].to_dict() == vocab_counts_df[CNT].to_dict()
+
+
+def test_sharded_duplicates(tokenized_df):
+    results = check_sharded(Duplicates, tokenized_df)
+    assert results["duplicates_dict"] == {"she ran home": 2}
+
+
+def test_sharded_labels(tokenized_df):
+    check_sharded(Labels, tokenized_df, params={"label_field": "label"})
+
+
+def test_sharded_npmi(tokenized_df, vocab_counts_df):
+    npmi_obj = check_sharded(
+        nPMI, tokenized_df,
+        params={"vocabulary": list(vocab_counts_df.index),
+                "identity_terms": IDENTITY_TERMS},
+        finalize_params={"vocab_counts_df": vocab_counts_df,
+                         "identity_terms": IDENTITY_TERMS})
+    serial = nPMI(vocab_counts_df, tokenized_df[TOKENIZED_FIELD],
+                  IDENTITY_TERMS)
+    assert np.array_equal(npmi_obj.cooc_counts, serial.cooc_counts)
+    assert sharding.results_equal(npmi_obj.bias_results_dict,
+                                  serial.bias_results_dict)
+
+
+@pytest.mark.parametrize("saved_corpus", [False, True])
+def test_parallel_cooccurrences_match_serial(tokenized_df, vocab_counts_df,
+                                             tmp_path, saved_corpus):
+    tokenized_sentences = tokenized_df[TOKENIZED_FIELD]
+    serial = nPMI(vocab_counts_df, tokenized_sentences, IDENTITY_TERMS)
+    corpus = None
+    if saved_corpus:
+        # Workers memory-map the saved corpus.
+        corpus = Corpus.from_tokenized(tokenized_sentences)
+        corpus.save(str(tmp_path))
+    parallel = nPMI(vocab_counts_df, tokenized_sentences, IDENTITY_TERMS,
+                    corpus=corpus, num_proc=2)
+    for shard_size in [3, len(TEXTS)]:
+        assert np.array_equal(
+            parallel.count_cooccurrences_parallel(shard_size=shard_size),
+            serial.cooc_counts)
+    assert sharding.results_equal(parallel.bias_results_dict,
+                                  serial.bias_results_dict)
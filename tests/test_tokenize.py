@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+from datasets import Dataset
+
+from data_measurements.tokenize import (ARROW_BACKEND, PYTHON_BACKEND,
+                                        Tokenize, iter_tokenized_batches)
+from utils.dataset_utils import TEXT_FIELD, TOKENIZED_FIELD
+
+TEXTS = ["The cat sat on the mat.", "Don't panic!", "", "   ",
+         "snake_case and CamelCase words", "Numbers: 3.14, 42 and 1e10",
+         "Ünïcode: Café, naïve façade", "日本語のテキスト、そして English",
+         "tabs\tand\nnewlines", "(parenthesized) [bracketed] {braced}"] * 3
+
+
+def tokenize(backend, **kwargs):
+    tokenizer = Tokenize(Dataset.from_dict({TEXT_FIELD: TEXTS}),
+                         feature=TEXT_FIELD, tok_feature=TOKENIZED_FIELD,
+                         batch_size=4, backend=backend, **kwargs)
+    return [list(tokens) for tokens in tokenizer.get_df()[TOKENIZED_FIELD]]
+
+
+@pytest.mark.parametrize("lowercase", [True, False])
+def test_parallel_tokenization_matches_serial(lowercase):
+    assert tokenize(PYTHON_BACKEND, num_proc=2, lowercase=lowercase) == \
+           tokenize(PYTHON_BACKEND, lowercase=lowercase)
+
+
+@pytest.mark.parametrize("lowercase", [True, False])
+def test_arrow_tokenizer_matches_python(lowercase):
+    assert tokenize(ARROW_BACKEND, lowercase=lowercase) == \
+           tokenize(PYTHON_BACKEND, lowercase=lowercase)
+
+
+@pytest.mark.parametrize("backend", [PYTHON_BACKEND, ARROW_BACKEND])
+def test_tokenized_batches_match_tokenize(backend):
+    batches = iter_tokenized_batches(Dataset.from_dict({TEXT_FIELD: TEXTS}),
+                                     feature=TEXT_FIELD, batch_size=4,
+                                     backend=backend)
+    tokens = []
+    for batch in batches:
+        if backend == ARROW_BACKEND:
+            batch = batch.to_pylist()
+        tokens += [list(sentence_tokens) for sentence_tokens in batch]
+    assert tokens == tokenize(backend)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Tokenize(Dataset.from_dict({TEXT_FIELD: TEXTS}), feature=TEXT_FIELD,
+                 backend="regex")
+
+
+@pytest.mark.parametrize("text, python_tokens, arrow_tokens", [
+    ("ΟΔΟΣ", ["οδος"], ["οδοσ"]),
+    ("İstanbul", ["i", "stanbul"], ["istanbul"])])
+def test_arrow_lowercasing_differences(text, python_tokens, arrow_tokens):
+    dset = Dataset.from_dict({TEXT_FIELD: [text]})
+    for backend, tokens in [(PYTHON_BACKEND, python_tokens),
+                            (ARROW_BACKEND, arrow_tokens)]:
+        tokenizer = Tokenize(dset, feature=TEXT_FIELD,
+                             tok_feature=TOKENIZED_FIELD, backend=backend)
+        assert list(tokenizer.get_df()[TOKENIZED_FIELD][0]) == tokens
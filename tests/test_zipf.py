@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_measurements.zipf import zipf
+
+
+def make_vocab_counts_df(counts):
+    """Vocabulary in the format of count_vocab_frequencies, by count."""
+    counts = np.sort(np.asarray(counts))[::-1]
+    return pd.DataFrame({"count": counts},
+                        index=pd.Index(["w%s" % i for i in range(len(counts))],
+                                       name="word"))
+
+
+def json_round_trip(data):
+    return json.loads(json.dumps(data))
+
+
+def make_reference_counts():
+    """
+    Word counts of a reference vocabulary: a power law tail (alpha of 2.2),
+    under a head of more words with the lowest counts than it predicts.
+    """
+    count_values = np.arange(1, 301)
+    count_freqs = np.round(20000.0 * count_values ** -2.2).astype(int)
+    count_freqs[:4] = [9000, 3500, 1400, 700]
+    return np.repeat(count_values, count_freqs)
+
+
+def test_reference_fit():
+    # The fit of the reference vocabulary by powerlaw 1.5's
+    # powerlaw.Fit(counts, discrete=True, fit_method="KS"), and the KS test
+    # p-value of calc_fit as computed from it.
+    z = zipf.Zipf(make_vocab_counts_df(make_reference_counts()))
+    z.calc_fit()
+    assert z.alpha == pytest.approx(2.2760289558936497, rel=1e-9)
+    assert z.xmin == 5
+    assert z.ks_distance == pytest.approx(0.014470940170767221, rel=1e-9)
+    assert z.p == pytest.approx(0.005343692721935969, rel=1e-9)
+
+
+def test_one_distinct_count():
+    z = zipf.Zipf(make_vocab_counts_df([3] * 10))
+    z.calc_fit()
+    assert z.alpha is None
+    assert all(value is None for value in z.get_zipf_dict().values())
+    z.calc_bootstrap_p(num_replicates=10, seed=0)
+    assert z.bootstrap_p is None
+    loaded = zipf.Zipf(None)
+    loaded.load(json_round_trip(z.get_zipf_dict()))
+    loaded.load_fig_data(json_round_trip(z.get_fig_data()))
+    assert len(zipf.make_zipf_fig(loaded).data) == 0
+
+
+def test_two_distinct_counts():
+    z = zipf.Zipf(make_vocab_counts_df([10] * 5 + [1] * 20))
+    z.calc_fit()
+    # The only xmin candidate is the smaller count, so all counts are fit.
+    assert z.xmin == 1
+    assert np.isfinite(z.alpha) and z.alpha > 1
+    assert 0 <= z.ks_distance <= 1
+    assert len(z.predicted_counts) == 2
+    z.calc_bootstrap_p(num_replicates=10, seed=0)
+    assert 0 <= z.bootstrap_p <= 1
+    assert len(zipf.make_zipf_fig(z).data) == 2
+
+
+@pytest.mark.parametrize("max_points", [None, 10])
+def test_remake_figure_from_cache(max_points):
+    rng = np.random.default_rng(0)
+    z = zipf.Zipf(make_vocab_counts_df(rng.zipf(1.8, 3000)))
+    z.calc_fit()
+    fig = zipf.make_zipf_fig(z, max_points=max_points)
+    # As load_or_prepare_zipf does, without the vocabulary.
+    loaded = zipf.Zipf(None)
+    loaded.load(json_round_trip(z.get_zipf_dict()))
+    loaded.load_fig_data(json_round_trip(z.get_fig_data()))
+    remade = zipf.make_zipf_fig(loaded, max_points=max_points)
+    assert len(remade.data) == len(fig.data) == 2
+    for remade_trace, trace in zip(remade.data, fig.data):
+        num_points = len(trace.x)
+        assert list(remade_trace.x) == list(trace.x)
+        # The bars only show a value for each rank.
+        assert list(remade_trace.y[:num_points]) == list(trace.y[:num_points])
+        assert list(remade_trace.hovertext) == list(trace.hovertext)
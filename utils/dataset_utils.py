@@ -12,20 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import json
+import numpy as np
 import os
 import pandas as pd
 import plotly
 import pyarrow.feather as feather
 import utils
 from dataclasses import asdict
-from datasets import Dataset, get_dataset_infos, load_dataset, load_from_disk, \
-    NamedSplit
+from datasets import Dataset, Features, get_dataset_infos, load_dataset, \
+    load_from_disk, NamedSplit
 from dotenv import load_dotenv
 from huggingface_hub import Repository, list_datasets
 from json2html import *
 from os import getenv
-from os.path import exists, isdir, join as pjoin
+from os.path import exists, isdir, join as pjoin, splitext
 from pathlib import Path
 
 # treating inf values as NaN as well
@@ -48,12 +50,37 @@ LENGTH_FIELD = "length"
 VOCAB = "vocab"
 WORD = "word"
 CNT = "count"
+# Number of sentences a word occurs in
+DOC_CNT = "document count"
 PROP = "proportion"
 TEXT_NAN_CNT = "text_nan_count"
 TXT_LEN = "text lengths"
 TOT_WORDS = "total words"
 TOT_OPEN_WORDS = "total open words"
 
+## Names of the cached results that have cache keys (see make_cache_key).
+# Each is registered (DatasetStatisticsCacheClass.register_cache) with the
+# version of the code computing it: the CACHE_VERSION of its measurement
+# module, or a _*_VERSION in dataset_statistics.py. The version is part of the
+# key, so bumping it when the computation changes has the results cached by
+# older code redone.
+# Results computed from the same cached inputs list them as dependencies,
+# so that recomputing an input also invalidates what was computed from it.
+TEXT_DSET_CACHE = "text_dset"
+TOKENIZED_CACHE = "tokenized"
+CORPUS_CACHE = "corpus"
+VOCAB_CACHE = "vocab"
+GENERAL_CACHE = "general_stats"
+ZIPF_CACHE = "zipf"
+LENGTHS_CACHE = "lengths"
+LABELS_CACHE = "labels"
+DUPS_CACHE = "text_duplicates"
+NPMI_CACHE = "npmi"
+NPMI_COUNTS_CACHE = "npmi_counts"
+COLLOCATIONS_CACHE = "collocations"
+LABEL_NPMI_CACHE = "label_npmi"
+PERPLEXITY_CACHE = "perplexity"
+
 _DATASET_LIST = [
     "c4",
     "squad",
@@ -73,6 +100,20 @@ _STREAMABLE_DATASET_LIST = [
 
 _MAX_ROWS = 200000
 
+## Metadata files written by Dataset.save_to_disk
+HF_STATE_JSON = "state.json"
+HF_INFO_JSON = "dataset_info.json"
+
+## Cache formats for dataframes.
+# Row-oriented json, readable by anyone (the original format).
+JSON_FORMAT = "json"
+# Columnar parquet, which keeps the index and is much faster to load.
+PARQUET_FORMAT = "parquet"
+CACHE_FORMATS = (JSON_FORMAT, PARQUET_FORMAT)
+# The format that write_df uses. Configurable with the DMT_CACHE_FORMAT
+# environment variable or set_cache_format; read_df handles both formats.
+_CACHE_FORMAT = getenv("DMT_CACHE_FORMAT", PARQUET_FORMAT)
+
 logs = utils.prepare_logging(__file__)
 
 def _load_dotenv_for_cache_on_hub():
@@ -97,6 +138,63 @@ def get_cache_dir_naming(out_dir, dataset, config, split, feature):
     local_dataset_cache_dir = out_dir + "/" + dataset_cache_name
     return dataset_cache_name, local_dataset_cache_dir
 
+def make_cache_key(fingerprint, params, version, dependency_keys=()):
+    """
+    Content-addressed key for a cached result: A hash of the fingerprint of
+    the dataset it was computed from, the parameters and version of its
+    computation, and the keys of the cached results it was computed from.
+    Args:
+        fingerprint (string): The Hugging Face dataset fingerprint.
+        params (dict): JSON-able parameters of the computation.
+        version (int or string): Version of the computation.
+        dependency_keys (list): Cache keys of the inputs to the computation.
+    Returns:
+        string: the hex digest key.
+    """
+    key_dict = {"fingerprint": fingerprint,
+                "params": params,
+                "version": version,
+                "dependencies": list(dependency_keys)}
+    key_str = json.dumps(key_dict, sort_keys=True, default=str)
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+def read_cache_key(key_fid):
+    """Returns the stored cache key, or None when there isn't one."""
+    if exists(key_fid):
+        return read_json(key_fid)["key"]
+    return None
+
+def write_cache_key(cache_key, key_fid):
+    make_path(os.path.dirname(key_fid))
+    write_json({"key": cache_key}, key_fid)
+
+def read_saved_dataset_fingerprint(dset_dir):
+    """
+    Reads the fingerprint of a dataset saved with save_to_disk from its
+    metadata, without loading the dataset.
+    Returns:
+        string: the fingerprint, or None when the dataset isn't saved there.
+    """
+    state_fid = pjoin(dset_dir, HF_STATE_JSON)
+    if exists(state_fid):
+        return read_json(state_fid).get("_fingerprint")
+    return None
+
+def read_saved_dataset_features(dset_dir):
+    """
+    Reads the features of a dataset saved with save_to_disk from its
+    metadata, without loading the dataset.
+    Returns:
+        Features: the dataset features, or None when the dataset isn't saved
+        there.
+    """
+    info_fid = pjoin(dset_dir, HF_INFO_JSON)
+    if exists(info_fid):
+        features_dict = read_json(info_fid).get(HF_FEATURE_FIELD)
+        if features_dict is not None:
+            return Features.from_dict(features_dict)
+    return None
+
 def initialize_cache_hub_repo(local_cache_dir, dataset_cache_name):
     """
     This function tries to initialize a dataset cache on the huggingface hub. The
@@ -115,7 +213,7 @@ def initialize_cache_hub_repo(local_cache_dir, dataset_cache_name):
     repo = Repository(local_dir=local_cache_dir,
                       clone_from=clone_source,
                       repo_type="dataset", use_auth_token=hf_token)
-    repo.lfs_track(["*.feather"])
+    repo.lfs_track(["*.feather", "*.parquet", "*.npy"])
     return repo
 
 def pull_cache_from_hub(cache_path, dataset_cache_dir):
@@ -399,19 +497,74 @@ def df_to_write_html(input_df, html_fid):
     """Writes a dataframe to an HTML file"""
     input_df.to_HTML(html_fid)
 
-def read_df(df_fid):
-    return pd.DataFrame.from_dict(read_json(df_fid), orient="index")
-
-def write_df(df, df_fid):
+def set_cache_format(cache_format):
+    """Sets the format that dataframes are cached in (see CACHE_FORMATS)."""
+    global _CACHE_FORMAT
+    if cache_format not in CACHE_FORMATS:
+        raise ValueError("Unknown cache format %s; choose from %s" % (
+            cache_format, ", ".join(CACHE_FORMATS)))
+    _CACHE_FORMAT = cache_format
+
+def _get_df_fids(df_fid):
+    """Dataframe caches are named as .json files throughout the code;
+    the parquet version of the cache sits next to it, as .parquet."""
+    base_fid = splitext(df_fid)[0]
+    return {PARQUET_FORMAT: base_fid + ".parquet",
+            JSON_FORMAT: base_fid + ".json"}
+
+def df_exists(df_fid):
+    """Whether a dataframe has been cached under df_fid, in any format."""
+    return any(exists(fid) for fid in _get_df_fids(df_fid).values())
+
+def read_df(df_fid, columns=None):
+    """Reads a cached dataframe, preferring the columnar parquet file and
+    falling back to json (e.g., for caches made before parquet support).
+    When columns are given, only those are read (from parquet)."""
+    df_fids = _get_df_fids(df_fid)
+    if exists(df_fids[PARQUET_FORMAT]):
+        return pd.read_parquet(df_fids[PARQUET_FORMAT], columns=columns)
+    df = pd.DataFrame.from_dict(read_json(df_fids[JSON_FORMAT]),
+                                orient="index")
+    if columns is not None:
+        df = df[columns]
+    return df
+
+def write_df(df, df_fid, cache_format=None):
     """In order to preserve the index of our dataframes, we can't
     use the compressed pandas dataframe file format .feather.
-    There's a preference for json amongst HF devs, so we use that here."""
-    df_dict = df.to_dict('index')
-    write_json(df_dict, df_fid)
+    Parquet keeps the index, so it's used by default; there's also a
+    preference for json amongst HF devs, so that can be used too."""
+    if cache_format is None:
+        cache_format = _CACHE_FORMAT
+    df_fids = _get_df_fids(df_fid)
+    if cache_format == PARQUET_FORMAT and \
+            not all(isinstance(col, str) for col in df.columns):
+        logs.warning("Parquet needs string column names; writing %s as json."
+                     % df_fid)
+        cache_format = JSON_FORMAT
+    if cache_format == PARQUET_FORMAT:
+        df.to_parquet(df_fids[PARQUET_FORMAT], index=True)
+    else:
+        df_dict = df.to_dict('index')
+        write_json(df_dict, df_fids[JSON_FORMAT])
+    # Don't leave a stale copy in the other format to be read later.
+    for other_format, other_fid in df_fids.items():
+        if other_format != cache_format and exists(other_fid):
+            os.remove(other_fid)
+
+def _json_default(obj):
+    """Handles the numpy values json can't serialize on its own, such as the
+    token arrays that come from the arrow tokenizer."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("Object of type %s is not JSON serializable" %
+                    type(obj).__name__)
 
 def write_json(json_dict, json_fid):
     with open(json_fid, "w", encoding="utf-8") as f:
-        json.dump(json_dict, f)
+        json.dump(json_dict, f, default=_json_default)
 
 def read_json(json_fid):
     json_dict = json.load(open(json_fid, encoding="utf-8"))
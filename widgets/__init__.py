@@ -3,6 +3,7 @@ from widgets.dataset_description import DatasetDescription
 from widgets.general_stats import GeneralStats
 from widgets.label_distribution import LabelDistribution
 from widgets.npmi import Npmi
+from widgets.collocations import Collocations
 from widgets.text_lengths import TextLengths
 from widgets.zipf import Zipf
 from widgets.duplicates import Duplicates
\ No newline at end of file
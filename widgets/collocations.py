@@ -0,0 +1,67 @@
+import gradio as gr
+
+from widgets.widget_base import Widget
+from data_measurements.dataset_statistics import DatasetStatisticsCacheClass as dmt_cls
+from data_measurements.collocations.collocations import NPMI
+import utils
+
+logs = utils.prepare_logging(__file__)
+
+
+class Collocations(Widget):
+    def __init__(self):
+        self.collocations_intro = gr.Markdown(render=False)
+        self.collocations_df = gr.DataFrame(render=False)
+        self.collocations_text = gr.Markdown(render=False)
+
+    def render(self):
+        with gr.TabItem("Word Pairs: Collocations"):
+            self.collocations_intro.render()
+            self.collocations_text.render()
+            self.collocations_df.render()
+
+    def update(self, dstats: dmt_cls):
+        output = {
+            self.collocations_intro: gr.Markdown.update(
+                value=self.expander_collocations_description(dstats.min_vocab_count)
+            )
+        }
+        if dstats.collocations_df is None or dstats.collocations_df.empty:
+            output[self.collocations_df] = gr.DataFrame.update(visible=False)
+            output[self.collocations_text] = gr.Markdown.update(
+                visible=True,
+                value="No word pairs co-occur often enough for results.",
+            )
+        else:
+            output[self.collocations_df] = gr.DataFrame.update(
+                visible=True, value=dstats.collocations_df.round({NPMI: 4})
+            )
+            output[self.collocations_text] = gr.Markdown.update(visible=False)
+        return output
+
+    @staticmethod
+    def expander_collocations_description(min_vocab):
+        return f"""
+        Use this widget to find the word pairs that are most associated with
+        each other anywhere in your dataset, such as names, set phrases, or
+        repeated boilerplate.
+
+        Pairs are ranked by their nPMI: how much more often the two words
+        occur in the same sentence than would be expected if they were
+        independent, normalized to be at most 1 (always together).
+
+        Only pairs that occur together in at least {min_vocab} sentences are shown.
+
+        -----
+        """
+
+    @property
+    def output_components(self):
+        return [
+            self.collocations_intro,
+            self.collocations_text,
+            self.collocations_df,
+        ]
+
+    def add_events(self, state: gr.State):
+        pass
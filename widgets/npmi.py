@@ -1,8 +1,8 @@
 import gradio as gr
-import pandas as pd
 
 from widgets.widget_base import Widget
 from data_measurements.dataset_statistics import DatasetStatisticsCacheClass as dmt_cls
+from data_measurements.npmi.npmi import PAGE_SIZE, TOP_K
 import utils
 
 logs = utils.prepare_logging(__file__)
@@ -16,9 +16,27 @@ class Npmi(Widget):
         self.npmi_second_word = gr.Dropdown(
             render=False, label="What is the second word you want to select?"
         )
+        self.npmi_custom_words = gr.Textbox(
+            render=False,
+            label="Or type any two words to compare, separated by a comma",
+        )
         self.npmi_error_text = gr.Markdown(render=False)
         self.npmi_df = gr.HTML(render=False)
         self.sort = gr.Dropdown(label="Sort By Column", render=False)
+        self.order = gr.Radio(
+            choices=["Highest first", "Lowest first"],
+            value="Highest first",
+            label="Order",
+            render=False,
+        )
+        self.page = gr.Slider(
+            minimum=1,
+            maximum=TOP_K // PAGE_SIZE,
+            step=1,
+            value=1,
+            label=f"Page ({PAGE_SIZE} words per page, of the top {TOP_K})",
+            render=False,
+        )
         self.npmi_empty_text = gr.Markdown(render=False)
         self.npmi_description = gr.Markdown(render=False)
 
@@ -27,7 +45,10 @@ class Npmi(Widget):
         return [
             self.npmi_first_word,
             self.npmi_second_word,
+            self.npmi_custom_words,
             self.sort,
+            self.order,
+            self.page,
             self.npmi_error_text,
             self.npmi_df,
             self.npmi_description,
@@ -39,7 +60,10 @@ class Npmi(Widget):
             self.npmi_description.render()
             self.npmi_first_word.render()
             self.npmi_second_word.render()
+            self.npmi_custom_words.render()
             self.sort.render()
+            self.order.render()
+            self.page.render()
             self.npmi_df.render()
             self.npmi_empty_text.render()
             self.npmi_error_text.render()
@@ -59,10 +83,14 @@ class Npmi(Widget):
             output[self.npmi_second_word] = gr.Dropdown.update(
                 choices=available_terms[::-1], value=available_terms[-1], visible=True
             )
+            output[self.npmi_custom_words] = gr.Textbox.update(visible=True)
             output[self.sort] = gr.Dropdown.update(choices=['bias', available_terms[0], available_terms[-1]],
-                                                   value='bias')
+                                                   value='bias', visible=True)
+            output[self.order] = gr.Radio.update(value="Highest first", visible=True)
+            output[self.page] = gr.Slider.update(value=1, visible=True)
             output.update(
-                self.npmi_show(available_terms[0], available_terms[-1], 'bias', dstats)
+                self.npmi_show(available_terms[0], available_terms[-1], 'bias',
+                               "Highest first", 1, dstats)
             )
         else:
             output[self.npmi_error_text] = gr.Markdown.update(
@@ -71,9 +99,13 @@ class Npmi(Widget):
             )
         return output
 
-    def npmi_show(self, term1, term2, sort_col, dstats):
+    def npmi_show(self, term1, term2, sort_col, order, page, dstats):
         npmi_stats = dstats.npmi_obj
-        paired_results = npmi_stats.get_display(term1, term2)
+        # A page of the precomputed top-k words, so nothing is sorted here.
+        paired_results = npmi_stats.get_display_page(
+            term1, term2, sort_col=sort_col,
+            ascending=order == "Lowest first", page=int(page) - 1
+        )
         output = {}
         if paired_results.empty:
             output[self.npmi_empty_text] = gr.Markdown.update(
@@ -86,21 +118,12 @@ class Npmi(Widget):
             output[self.npmi_empty_text] = gr.Markdown.update(visible=False)
             logs.debug("Results to be shown in streamlit are")
             logs.debug(paired_results)
-            s = pd.DataFrame(
-                paired_results.sort_values(sort_col, ascending=False)
-            )
+            s = paired_results.copy()
             s.index.name = "word"
             s = s.reset_index().round(4)
             bias_col = [col for col in s.columns if col != "word"]
-            # Keep the dataframe from being crazy big.
-            if s.shape[0] > 10000:
-                bias_thres = max(abs(s[s[0]][5000]), abs(s[s[0]][-5000]))
-                logs.info(f"filtering with bias threshold: {bias_thres}")
-                s_filtered = s[s[0].abs() > bias_thres]
-            else:
-                s_filtered = s
             out_df = (
-                s_filtered.style.background_gradient(subset=bias_col)
+                s.style.background_gradient(subset=bias_col)
                 .format(formatter="{:,.3f}", subset=bias_col)
                 .set_properties(**{"text-align": "center", "width": "100em"})
                 .set_caption(
@@ -124,7 +147,8 @@ class Npmi(Widget):
         ([Aka et al., 2021](https://arxiv.org/abs/2103.03417)).
 
         You can select from gender and sexual orientation
-        identity terms that appear in the dataset at least {min_vocab} times.
+        identity terms that appear in the dataset at least {min_vocab} times,
+        or type in any two words from the dataset.
 
         The resulting ranked words are those that co-occur with both identity terms.
 
@@ -136,26 +160,57 @@ class Npmi(Widget):
         -----
         """
 
-    def update_sort_and_npmi(self, first_word, second_word, sort_col, dstats):
+    def update_sort_and_npmi(self, first_word, second_word, sort_col, order, dstats):
         output = {self.sort: gr.Dropdown.update(choices=['bias', first_word, second_word],
-                                                value='bias')}
-        new_df = self.npmi_show(first_word, second_word, sort_col, dstats)
+                                                value='bias'),
+                  self.page: gr.Slider.update(value=1)}
+        new_df = self.npmi_show(first_word, second_word, 'bias', order, 1, dstats)
         output.update(new_df)
         return output
 
+    def update_custom_words(self, custom_words, dstats):
+        """
+        Adds the typed words to the word selections; selecting them computes
+        their associations.
+        """
+        words = [word.strip().lower() for word in custom_words.split(",")
+                 if word.strip()]
+        if len(words) != 2:
+            return {self.npmi_error_text: gr.Markdown.update(
+                visible=True,
+                value="Please type two words, separated by a comma.")}
+        first_word, second_word = words
+        available_terms = dstats.npmi_obj.avail_identity_terms
+        return {
+            self.npmi_error_text: gr.Markdown.update(visible=False),
+            self.npmi_first_word: gr.Dropdown.update(
+                choices=available_terms + [first_word], value=first_word),
+            self.npmi_second_word: gr.Dropdown.update(
+                choices=available_terms[::-1] + [second_word],
+                value=second_word),
+        }
+
     def add_events(self, state: gr.State):
         self.npmi_first_word.change(
             self.update_sort_and_npmi,
-            inputs=[self.npmi_first_word, self.npmi_second_word, self.sort, state],
-            outputs=[self.npmi_df, self.npmi_empty_text, self.sort],
+            inputs=[self.npmi_first_word, self.npmi_second_word, self.sort, self.order, state],
+            outputs=[self.npmi_df, self.npmi_empty_text, self.sort, self.page],
         )
         self.npmi_second_word.change(
             self.update_sort_and_npmi,
-            inputs=[self.npmi_first_word, self.npmi_second_word, self.sort, state],
-            outputs=[self.npmi_df, self.npmi_empty_text, self.sort],
+            inputs=[self.npmi_first_word, self.npmi_second_word, self.sort, self.order, state],
+            outputs=[self.npmi_df, self.npmi_empty_text, self.sort, self.page],
         )
-        self.sort.change(
-            self.npmi_show,
-            inputs=[self.npmi_first_word, self.npmi_second_word, self.sort, state],
-            outputs=[self.npmi_df, self.npmi_empty_text],
+        self.npmi_custom_words.submit(
+            self.update_custom_words,
+            inputs=[self.npmi_custom_words, state],
+            outputs=[self.npmi_first_word, self.npmi_second_word,
+                     self.npmi_error_text],
         )
+        for component in [self.sort, self.order, self.page]:
+            component.change(
+                self.npmi_show,
+                inputs=[self.npmi_first_word, self.npmi_second_word, self.sort,
+                        self.order, self.page, state],
+                outputs=[self.npmi_df, self.npmi_empty_text],
+            )
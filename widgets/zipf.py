@@ -56,6 +56,15 @@ class Zipf(Widget):
     def update(self, dstats: dmt_cls):
         z = dstats.z
         zipf_fig = dstats.zipf_fig
+        if z.alpha is None:
+            return {
+                self.zipf_table: pd.DataFrame(),
+                self.zipf_summary: "There are too few distinct word counts "
+                                   "in this dataset to fit Zipf's law.",
+                self.zipf_plot: zipf_fig,
+                self.alpha_warning: gr.Markdown.update(visible=False),
+                self.xmin_warning: gr.Markdown.update(visible=False),
+            }
 
         zipf_summary = (
             "The optimal alpha based on this dataset is: **"
@@ -78,6 +87,8 @@ class Zipf(Widget):
             columns=["Results"],
             orient="index",
         )
+        if z.bootstrap_p is not None:
+            fit_results_table.loc["Bootstrap p-value:"] = "%.2f" % z.bootstrap_p
         fit_results_table.index.name = ""
 
         output = {